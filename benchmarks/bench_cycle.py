@@ -0,0 +1,36 @@
+import pytest
+
+import base64
+
+from tconnectsync.api.replay import ReplayTConnectApi
+from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+
+from conftest import FEATURES, SyntheticTConnect, history_blob, time_range, sized
+
+pytest.importorskip('pytest_benchmark')
+
+
+@sized('1d', '30d')
+def test_process_time_range(benchmark, days, nightscout, secret):
+    time_start, time_end = time_range(days)
+    device = {'tconnectDeviceId': 'device', 'maxDateWithEvents': time_end.isoformat()}
+
+    def cycle():
+        return ProcessTimeRange(SyntheticTConnect(days), nightscout, device, False, secret, features=FEATURES).process(time_start, time_end)
+
+    processed, last_seqnum = benchmark.pedantic(cycle, rounds=3)
+    assert processed > 0 and last_seqnum
+
+@sized('30d')
+def test_replay_from_file(benchmark, days, nightscout, secret, tmp_path):
+    path = tmp_path / 'events.bin'
+    path.write_bytes(base64.b64decode(history_blob(days)))
+    time_start, time_end = time_range(days)
+
+    def cycle():
+        tconnect = ReplayTConnectApi([str(path)], secret, use_mmap=True)
+        device = tconnect.tandemsource.pump_event_metadata()[0]
+        return ProcessTimeRange(tconnect, nightscout, device, False, secret, features=FEATURES).process(time_start, time_end)
+
+    processed, last_seqnum = benchmark.pedantic(cycle, rounds=3)
+    assert processed > 0 and last_seqnum
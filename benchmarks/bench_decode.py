@@ -0,0 +1,33 @@
+import pytest
+
+from tconnectsync.eventparser.generic import Events, decode_raw_events
+from tconnectsync.eventparser.columnar import decode_columns
+from tconnectsync.export import export_events
+
+from conftest import TIMEZONE, history_blob, sized
+
+pytest.importorskip('pytest_benchmark')
+
+
+@sized('1d', '30d', '1y')
+def test_decode_events(benchmark, days):
+    blob = history_blob(days)
+    events = benchmark(lambda: list(Events(decode_raw_events(blob), timezone=TIMEZONE)))
+    assert len(events) > 500 * days
+
+@sized('30d')
+def test_base64_decode(benchmark, days):
+    blob = history_blob(days)
+    benchmark(decode_raw_events, blob)
+
+@sized('30d', '1y')
+def test_decode_columns(benchmark, days):
+    data = decode_raw_events(history_blob(days))
+    columns, _ = benchmark(decode_columns, data)
+    assert sum(len(c) for c in columns.values()) > 500 * days
+
+@sized('30d')
+def test_export_parquet(benchmark, days, tmp_path):
+    pytest.importorskip('pyarrow')
+    data = decode_raw_events(history_blob(days))
+    benchmark(export_events, data, str(tmp_path), TIMEZONE)
@@ -0,0 +1,27 @@
+import pytest
+
+from tconnectsync.fake.nightscout import FakeNightscout
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+
+from conftest import FEATURES, SyntheticTConnect, time_range, sized
+
+pytest.importorskip('pytest_benchmark')
+
+
+@sized('1d')
+@pytest.mark.parametrize('latency', [0, 0.005], ids=['0ms', '5ms'])
+def test_cycle_over_http(benchmark, days, latency, secret):
+    time_start, time_end = time_range(days)
+    device = {'tconnectDeviceId': 'device', 'maxDateWithEvents': time_end.isoformat()}
+
+    with FakeNightscout(latency=latency) as fake:
+        nightscout = NightscoutApi(fake.url, 'secret')
+
+        def cycle():
+            fake.collections.clear()
+            return ProcessTimeRange(SyntheticTConnect(days), nightscout, device, False, secret, features=FEATURES).process(time_start, time_end)
+
+        processed, _ = benchmark.pedantic(cycle, rounds=3)
+        benchmark.extra_info['requests'] = sum(fake.requests.values()) // 3
+    assert processed > 0
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from tconnectsync.parser.nightscout import NightscoutEntry
+from tconnectsync.util import serialize
+
+from conftest import START
+
+pytest.importorskip('pytest_benchmark')
+
+COUNT = 10000
+
+def created_at(i):
+    return START.shift(minutes=5 * i).format()
+
+
+def test_cgm_entries(benchmark):
+    times = [created_at(i) for i in range(COUNT)]
+    benchmark(lambda: [NightscoutEntry.entry(sgv=120, created_at=t, pump_event_id=str(i)) for i, t in enumerate(times)])
+
+def test_basal_entries(benchmark):
+    times = [created_at(i) for i in range(COUNT)]
+    benchmark(lambda: [NightscoutEntry.basal(value=0.8, duration_mins=5, created_at=t, reason='Algorithm', pump_event_id=str(i)) for i, t in enumerate(times)])
+
+def test_serialize_entries(benchmark):
+    entries = [NightscoutEntry.entry(sgv=120, created_at=created_at(i), pump_event_id=str(i)) for i in range(COUNT)]
+    # One request body per entry, as NightscoutApi.upload_entry sends them
+    benchmark(lambda: [json.dumps(e) for e in entries])
+
+def test_serialize_batch(benchmark):
+    entries = [NightscoutEntry.entry(sgv=120, created_at=created_at(i), pump_event_id=str(i)) for i in range(COUNT)]
+    # One request body for all entries, as NightscoutApi.upload_entries
+    # sends them with a large NS_UPLOAD_BATCH_SIZE
+    benchmark(serialize.dumps, entries)
@@ -0,0 +1,34 @@
+import pytest
+
+from tconnectsync.domain.tandemsource.event_class import EventClass
+from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+
+from conftest import FEATURES, batch_for, time_range, sized
+
+pytest.importorskip('pytest_benchmark')
+
+# The EventClasses present in the synthetic pump history
+EVENT_CLASSES = [EventClass.BASAL, EventClass.BOLUS, EventClass.CARTRIDGE, EventClass.CGM_READING, EventClass.USER_MODE]
+
+
+@sized('1d', '30d')
+@pytest.mark.parametrize('clazz', EVENT_CLASSES, ids=[c.name for c in EVENT_CLASSES])
+def test_transform(benchmark, days, clazz, nightscout, secret):
+    events = batch_for(days).for_eventclass[clazz.name]
+    time_start, time_end = time_range(days)
+    processor = ProcessTimeRange.event_classes[clazz.name](None, nightscout, 'device', False, FEATURES, secret=secret)
+
+    entries = benchmark(processor.process, events, time_start, time_end)
+    assert entries
+
+
+@sized('1d', '30d')
+@pytest.mark.parametrize('compact', [False, True], ids=['each', 'compacted'])
+def test_basal_upload_volume(benchmark, days, compact, nightscout, secret):
+    events = batch_for(days).for_eventclass[EventClass.BASAL.name]
+    time_start, time_end = time_range(days)
+    processor = ProcessTimeRange.event_classes[EventClass.BASAL.name](None, nightscout, 'device', False, FEATURES, secret=secret.replace(COMPACT_BASAL=compact))
+
+    entries = benchmark(processor.process, events, time_start, time_end)
+    benchmark.extra_info['treatments'] = len(entries)
+    assert entries
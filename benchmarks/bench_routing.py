@@ -0,0 +1,20 @@
+import pytest
+
+from tconnectsync.domain.tandemsource.event_class import EventClass
+from tconnectsync.sync.tandemsource.process import EventBatch
+
+from conftest import decoded_events, sized
+
+pytest.importorskip('pytest_benchmark')
+
+
+@sized('1d', '30d', '1y')
+def test_event_class_for_event(benchmark, days):
+    events = decoded_events(days)
+    benchmark(lambda: [EventClass.for_event(e) for e in events])
+
+@sized('1d', '30d', '1y')
+def test_event_batch(benchmark, days):
+    events = decoded_events(days)
+    batch = benchmark(lambda: EventBatch(events).sort())
+    assert batch.counts()[EventClass.BASAL.name] == 288 * days
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+
+"""
+Returns the cumulative import time in microseconds of the given module,
+as reported by python -X importtime.
+"""
+def import_time_us(module):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], capture_output=True, text=True, check=True).stderr
+    for line in out.splitlines():
+        parts = [p.strip() for p in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise ValueError("%s not in importtime output" % module)
+
+
+@pytest.mark.parametrize('module', ['tconnectsync', 'tconnectsync.api', 'tconnectsync.sync.tandemsource.process'])
+def test_import_time(benchmark, module):
+    benchmark.extra_info['import_time_us'] = import_time_us(module)
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', 'import %s' % module],), kwargs={'check': True}, rounds=5)
+
+@pytest.mark.parametrize('args', [['--version'], ['--help']], ids=['version', 'help'])
+def test_cli_startup(benchmark, args):
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-m', 'tconnectsync'] + args,), kwargs={'check': True, 'capture_output': True}, rounds=5)
+
+@pytest.mark.parametrize('schema', ['generated', 'compact'])
+def test_event_schema_import(benchmark, schema):
+    code = 'from tconnectsync.eventparser import events; events.EVENT_IDS[279]'
+    env = dict(os.environ, EVENT_SCHEMA=schema)
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', code],), kwargs={'check': True, 'env': env}, rounds=5)
@@ -0,0 +1,93 @@
+import json
+
+import arrow
+import pytest
+
+import tconnectsync.nightscout
+from tconnectsync.config import Config
+from tconnectsync.eventparser.generic import Events, decode_raw_events
+from tconnectsync.eventparser.synthetic import SyntheticPump
+from tconnectsync.features import BASAL, BOLUS, PUMP_EVENTS, CGM
+from tconnectsync.sync.tandemsource.process import EventBatch
+from tconnectsync.util import serialize
+
+TIMEZONE = 'America/New_York'
+START = arrow.get('2024-01-01T00:00:00').replace(tzinfo=TIMEZONE)
+FEATURES = [BASAL, BOLUS, PUMP_EVENTS, CGM]
+
+# Days of synthetic pump history, by the id used in benchmark names
+SIZES = {'1d': 1, '30d': 30, '1y': 365}
+
+_blobs = {}
+
+def history_blob(days):
+    if days not in _blobs:
+        _blobs[days] = SyntheticPump(start=START.naive).blob(days)
+    return _blobs[days]
+
+def decoded_events(days):
+    return list(Events(decode_raw_events(history_blob(days)), timezone=TIMEZONE))
+
+def time_range(days):
+    return START, START.shift(days=days)
+
+
+class NullNightscout(tconnectsync.nightscout.NightscoutApi):
+    """
+    Nightscout with nothing uploaded yet, which serializes uploads like
+    NightscoutApi does and then discards them.
+    """
+    def __init__(self):
+        self.url = 'invalid://'
+        self.secret = 'invalid'
+        self.uploaded = 0
+
+    def upload_entry(self, ns_format, entity='treatments'):
+        serialize.dumps(ns_format)
+        self.uploaded += len(ns_format) if isinstance(ns_format, list) else 1
+
+    def delete_entry(self, entity):
+        pass
+
+    def put_entry(self, ns_format, entity):
+        json.dumps(ns_format)
+
+    def last_uploaded_entry(self, eventType, time_start=None, time_end=None):
+        return None
+
+    def last_uploaded_bg_entry(self, time_start=None, time_end=None):
+        return None
+
+    def last_uploaded_activity(self, activityType, time_start=None, time_end=None):
+        return None
+
+    def last_uploaded_devicestatus(self, time_start=None, time_end=None):
+        return None
+
+
+class SyntheticTandemSource:
+    def __init__(self, days):
+        self.days = days
+
+    def pump_events(self, tconnect_device_id, min_date=None, max_date=None, fetch_all_event_types=False):
+        return Events(decode_raw_events(history_blob(self.days)), timezone=TIMEZONE)
+
+
+class SyntheticTConnect:
+    def __init__(self, days):
+        self.tandemsource = SyntheticTandemSource(days)
+
+
+@pytest.fixture
+def secret():
+    return Config(TIMEZONE_NAME=TIMEZONE, FETCH_ALL_EVENT_TYPES=False)
+
+@pytest.fixture
+def nightscout():
+    return NullNightscout()
+
+def sized(*ids):
+    return pytest.mark.parametrize('days', [SIZES[i] for i in ids], ids=ids)
+
+def batch_for(days):
+    return EventBatch(decoded_events(days)).sort()
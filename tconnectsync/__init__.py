@@ -1,7 +1,8 @@
 import sys
+import contextlib
 import datetime
-import arrow
 import argparse
+import importlib
 import logging
 import typing
 
@@ -13,13 +14,7 @@ if sys.version_info < (3, 8):
 else:
     from importlib.metadata import PackageNotFoundError, version
 
-from .api import TConnectApi
-from .sync.tandemsource.autoupdate import TandemSourceAutoupdate
-from .sync.tandemsource.choose_device import ChooseDevice as TandemSourceChooseDevice
-from .sync.tandemsource.process import ProcessTimeRange as TandemSourceProcessTimeRange
-from .check import check_login
-from .nightscout import NightscoutApi
-from .features import DEFAULT_FEATURES, ALL_FEATURES
+from .util.timing import Timings, Profiler
 
 try:
     from .secret import (
@@ -37,12 +32,36 @@ except Exception as e:
     print('Unable to read secrets from secret.py', e)
     sys.exit(1)
 
+# Reads secret.py, so is only imported once it is known to load
+from .features import DEFAULT_FEATURES, ALL_FEATURES
+
 
 try:
     __version__ = version("tconnectsync")
 except PackageNotFoundError:
     __version__ = "UNKNOWN"
 
+# Most runs are single syncs started from cron, so the API clients, the event
+# parser and the sync code are only imported once a sync needs them. They
+# remain available as attributes of this module (PEP 562).
+_LAZY = {
+    'TConnectApi': ('.api', 'TConnectApi'),
+    'TandemSourceAutoupdate': ('.sync.tandemsource.autoupdate', 'TandemSourceAutoupdate'),
+    'TandemSourceChooseDevice': ('.sync.tandemsource.choose_device', 'ChooseDevice'),
+    'TandemSourceProcessTimeRange': ('.sync.tandemsource.process', 'ProcessTimeRange'),
+    'PumpEventMetadataSnapshot': ('.domain.tandemsource.pump_event_metadata', 'PumpEventMetadataSnapshot'),
+    'check_login': ('.check', 'check_login'),
+    'Daemon': ('.daemon', 'Daemon'),
+    'load_accounts': ('.daemon', 'load_accounts'),
+    'NightscoutApi': ('.nightscout', 'NightscoutApi'),
+}
+
+def __getattr__(name):
+    if name in _LAZY:
+        module, attr = _LAZY[name]
+        return getattr(importlib.import_module(module, __name__), attr)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 def parse_args(*args, **kwargs):
     parser = argparse.ArgumentParser(description="Syncs bolus, basal, and IOB data from Tandem Diabetes t:connect to Nightscout.", epilog="Version %s" % __version__)
     parser.add_argument('--version', action='version', version='tconnectsync %s' % __version__)
@@ -55,6 +74,17 @@ def parse_args(*args, **kwargs):
     parser.add_argument('--check-login', dest='check_login', action='store_const', const=True, default=False, help='If set, checks that the provided t:connect credentials can be used to log in.')
     parser.add_argument('--features', dest='features', nargs='+', default=DEFAULT_FEATURES, choices=ALL_FEATURES, help='Specifies what data should be synchronized between tconnect and Nightscout.')
     parser.add_argument('--tandem-source', dest='tandem_source', action='store_const', const=True, default=True, help=argparse.SUPPRESS) # no longer used
+    parser.add_argument('--daemon', dest='daemon', type=str, default=None, help='Daemon mode: continuously syncs every account listed in the given JSON configuration file.')
+    parser.add_argument('--daemon-workers', dest='daemon_workers', type=int, default=4, help='The number of accounts which are synced at the same time in daemon mode.')
+    parser.add_argument('--window-days', dest='window_days', type=int, default=None, help='Backfill mode: fetches and uploads the date range this many days at a time, so that memory use does not grow with the length of the range. Overrides PIPELINE_CHUNK_DAYS.')
+    parser.add_argument('--profile', dest='profile', type=str, default=None, help='Logs how long each stage of a sync takes (login, event download, each processor and Nightscout requests) and writes the timings as JSON to the given file. In auto-update mode, timings are logged and written for every cycle.')
+    parser.add_argument('--profiler', dest='profiler', type=str, choices=Profiler.KINDS, default=None, help='With --profile, also captures a Python profile with cProfile (to <file>.prof) or pyinstrument (to <file>.html, if installed).')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=None, help='Serves Prometheus metrics (cycle duration, events decoded, entries uploaded, upstream request latency, logins, sleep decisions) over HTTP at /metrics on this port. Overrides METRICS_PORT.')
+    parser.add_argument('--export', dest='export', type=str, default=None, help='Export mode: writes the decoded pump history for the date range (every event type, one table per type partitioned by day) to the given directory, instead of uploading to Nightscout. History is fetched --window-days (default 30) days at a time. Requires pyarrow.')
+    parser.add_argument('--export-format', dest='export_format', type=str, choices=['parquet', 'arrow'], default='parquet', help='With --export, the file format to write: Parquet, or Arrow IPC.')
+    parser.add_argument('--from-file', dest='from_file', type=str, nargs='+', default=None, help='Replay mode: reads pump history from the given files (the base64 response of the Tandem Source pump events endpoint, or decoded binary events) instead of Tandem Source, and syncs it as usual. No Tandem Source credentials are needed.')
+    parser.add_argument('--metadata-file', dest='metadata_file', type=str, default=None, help='With --from-file, a saved pump_event_metadata JSON response. If not given, metadata for a single pump is built from the pump history.')
+    parser.add_argument('--mmap', dest='mmap', action='store_const', const=True, default=False, help='With --from-file, memory-maps binary pump history files instead of reading them into memory.')
     parser.add_argument('--region', dest='region', type=str, choices=['US', 'EU'], default=None, help='Tandem t:connect server region (US or EU). If not specified, uses TCONNECT_REGION from configuration or defaults to US.')
 
     return parser.parse_args(*args, **kwargs)
@@ -62,22 +92,54 @@ def parse_args(*args, **kwargs):
 def main(*args, **kwargs):
     args = parse_args(*args, **kwargs)
 
+    # In daemon mode, worker threads are named after the account they are syncing
+    log_format = '%(asctime)s %(levelname)-8s [%(threadName)s] %(message)s' if args.daemon else '%(asctime)s %(levelname)-8s %(message)s'
+
     if args.verbose:
         logging.basicConfig(
             level=logging.DEBUG,
-            format='%(asctime)s %(levelname)-8s %(message)s',
+            format=log_format,
             datefmt='%Y-%m-%d %H:%M:%S')
         logging.root.debug("Set logging level to DEBUG")
     else:
         logging.basicConfig(
             level=logging.INFO,
-            format='%(asctime)s %(levelname)-8s %(message)s',
+            format=log_format,
             datefmt='%Y-%m-%d %H:%M:%S')
 
+    metrics_port = args.metrics_port if args.metrics_port is not None else secret.METRICS_PORT
+    if metrics_port:
+        from .util import metrics
+        metrics.serve(metrics_port, secret.METRICS_ADDRESS)
+
+    if args.daemon:
+        if args.auto_update or args.start_date or args.end_date or args.check_login or args.profile or args.export or args.from_file:
+            raise Exception('Daemon mode cannot be used with auto-update, start/end date, check login, profile, export or replay from file')
+
+        from .daemon import Daemon, load_accounts
+        d = Daemon(load_accounts(args.daemon), workers=args.daemon_workers)
+        sys.exit(d.run())
+
     if args.auto_update and (args.start_date or args.end_date):
         raise Exception('Auto-update cannot be used with start/end date')
 
+    if args.auto_update and args.window_days:
+        raise Exception('Auto-update cannot be used with window days')
+
+    if args.export and (args.auto_update or args.check_login):
+        raise Exception('Export cannot be used with auto-update or check login')
+
+    if args.from_file and (args.auto_update or args.check_login):
+        raise Exception('Replay from file cannot be used with auto-update or check login')
+
+    if (args.metadata_file or args.mmap) and not args.from_file:
+        raise Exception('--metadata-file and --mmap must be used with --from-file')
+
+    if args.profiler and not args.profile:
+        raise Exception('--profiler must be used with --profile')
+
     if args.start_date and args.end_date:
+        import arrow
         time_start = arrow.get(args.start_date)
         time_end = arrow.get(args.end_date)
     else:
@@ -90,9 +152,9 @@ def main(*args, **kwargs):
     # Determine region: command line arg takes precedence, then config, then default to US
     region = args.region if args.region else TCONNECT_REGION
 
-    if TCONNECT_EMAIL == 'email@email.com':
+    if TCONNECT_EMAIL == 'email@email.com' and not args.from_file:
         logging.warn('NO USERNAME WAS PROVIDED. Ensure you have set TCONNECT_EMAIL appropriately.')
-    if TCONNECT_PASSWORD == 'password':
+    if TCONNECT_PASSWORD == 'password' and not args.from_file:
         logging.warn('NO PASSWORD WAS PROVIDED. Ensure you have set TCONNECT_PASSWORD appropriately.')
     if NS_URL == 'https://yournightscouturl/':
         logging.warn('NO NIGHTSCOUT URL WAS PROVIDED. Ensure your have set NS_URL appropriately.')
@@ -102,13 +164,42 @@ def main(*args, **kwargs):
         else:
             logging.warn('NO PUMP SERIAL NUMBER WAS PROVIDED. Ensure you have set PUMP_SERIAL_NUMBER appropriately.')
 
-    tconnect = TConnectApi(TCONNECT_EMAIL, TCONNECT_PASSWORD, region)
+    timings = Timings(report_path=args.profile) if args.profile else None
+    profiler = contextlib.nullcontext()
+    if args.profiler:
+        profiler = Profiler(args.profiler, args.profile + ('.prof' if args.profiler == 'cprofile' else '.html'))
+
+    with profiler:
+        return sync(args, time_start, time_end, region, timings)
+
+def sync(args, time_start, time_end, region, timings=None):
+    from .api import TConnectApi
+    from .nightscout import NightscoutApi
+    from .check import check_login
+    from .sync.tandemsource.autoupdate import TandemSourceAutoupdate
+    from .sync.tandemsource.choose_device import ChooseDevice as TandemSourceChooseDevice
+    from .sync.tandemsource.process import ProcessTimeRange as TandemSourceProcessTimeRange
+    from .domain.tandemsource.pump_event_metadata import PumpEventMetadataSnapshot
+
+    if args.from_file:
+        from .api.replay import ReplayTConnectApi
+        tconnect = ReplayTConnectApi(args.from_file, secret, metadata_path=args.metadata_file, use_mmap=args.mmap, timings=timings)
+    else:
+        tconnect = TConnectApi(TCONNECT_EMAIL, TCONNECT_PASSWORD, region, timings=timings)
 
-    nightscout = NightscoutApi(NS_URL, NS_SECRET, skip_verify=NS_SKIP_TLS_VERIFY, ignore_conn_errors=NS_IGNORE_CONN_ERRORS)
+    nightscout = NightscoutApi(NS_URL, NS_SECRET, skip_verify=NS_SKIP_TLS_VERIFY, ignore_conn_errors=NS_IGNORE_CONN_ERRORS, timings=timings)
 
     if args.check_login:
         return check_login(tconnect, time_start, time_end)
 
+    if args.export:
+        from .export import ExportTimeRange, DEFAULT_CHUNK_DAYS
+        tconnectDevice = TandemSourceChooseDevice(secret, tconnect).choose()
+        ExportTimeRange(tconnect, tconnectDevice, args.export, secret, fmt=args.export_format, chunk_days=args.window_days or DEFAULT_CHUNK_DAYS, timings=timings).export(time_start, time_end)
+        if timings:
+            timings.emit('Export')
+        return 0
+
     logging.warning("THIS VERSION OF TCONNECTSYNC READS DATA FROM TANDEM SOURCE, AND MAY CONTAIN BUGS!")
     logging.info("You may notice different behavior compared to older versions which utilized t:connect data sources.")
     logging.info("To report a bug or to get help, see https://github.com/jwoglom/tconnectsync/issues")
@@ -120,11 +211,16 @@ def main(*args, **kwargs):
         args.pretend = True
 
     if args.auto_update:
-        u = TandemSourceAutoupdate(secret)
+        u = TandemSourceAutoupdate(secret, timings=timings)
         sys.exit(u.process(tconnect, nightscout, args.pretend, features=args.features))
     else:
-        tconnectDevice = TandemSourceChooseDevice(secret, tconnect).choose()
-        added, last_event_id = TandemSourceProcessTimeRange(tconnect, nightscout, tconnectDevice, pretend=args.pretend, secret=secret, features=args.features).process(time_start, time_end)
+        metadata = PumpEventMetadataSnapshot.fetch(tconnect)
+        tconnectDevice = TandemSourceChooseDevice(secret, tconnect).choose(metadata)
+        from .config import Config
+        process_secret = Config(secret, PIPELINE_CHUNK_DAYS=args.window_days) if args.window_days else secret
+        added, last_event_id = TandemSourceProcessTimeRange(tconnect, nightscout, tconnectDevice, pretend=args.pretend, secret=process_secret, features=args.features, metadata=metadata, timings=timings).process(time_start, time_end)
+        if timings:
+            timings.emit('Sync')
 
         # return exit code 0 if processed events
         sys.exit(0 if added>0 else 1)
@@ -1,27 +1,46 @@
+import importlib
 import logging
 
-from .android import AndroidApi
-from .controliq import ControlIQApi
-from .ws2 import WS2Api
-from .webui import WebUIScraper
-from .tandemsource import TandemSourceApi
-
 logger = logging.getLogger(__name__)
 
+# The API clients pull in requests, bs4, requests_oidc, jwt and the event
+# parser, so they are only imported once they are used (PEP 562).
+_CLIENTS = {
+    'AndroidApi': 'android',
+    'ControlIQApi': 'controliq',
+    'WS2Api': 'ws2',
+    'WebUIScraper': 'webui',
+    'TandemSourceApi': 'tandemsource',
+    'ReplayTConnectApi': 'replay',
+}
+
+def __getattr__(name):
+    if name in _CLIENTS:
+        return getattr(importlib.import_module('.' + _CLIENTS[name], __name__), name)
+    if name in _CLIENTS.values():
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 """A wrapper for the three different t:connect API types."""
 class TConnectApi:
     email = None
     password = None
 
-    def __init__(self, email, password, region='US'):
+    def __init__(self, email, password, region='US', secret=None, timings=None):
         self.email = email
         self.password = password
         self.region = region
+        # Settings for the Tandem Source client; the secret module if None
+        self.secret = secret
+        # Per-stage timings for the Tandem Source client, when profiling
+        self.timings = timings
         self._ciq = None
         self._ws2 = None
         self._android = None
         self._webui = None
         self._tandemsource = None
+        # Kept across logins, so a failing backend stays backed off
+        self._tandemsource_retry_policy = None
 
     @property
     def tandemsource(self):
@@ -29,17 +48,43 @@ class TConnectApi:
             return self._tandemsource
 
         logger.debug(f"Instantiating new TandemSourceApi for region {self.region}")
+        from .tandemsource import TandemSourceApi
 
-        self._tandemsource = TandemSourceApi(self.email, self.password, self.region)
+        # A client created to log in again keeps the circuit breakers of the
+        # one it replaces
+        self._tandemsource = TandemSourceApi(self.email, self.password, self.region, secret=self.secret, timings=self.timings, retry_policy=self._tandemsource_retry_policy)
+        self._tandemsource_retry_policy = self._tandemsource.retry_policy
         return self._tandemsource
 
 
+    """
+    Returns the number of seconds until an open Tandem Source circuit breaker
+    will allow requests again, or 0 if requests are not being blocked.
+    """
+    def tandemsource_circuit_open_seconds(self):
+        policy = self._tandemsource.retry_policy if self._tandemsource else self._tandemsource_retry_policy
+        if not policy:
+            return 0
+        return policy.open_circuit_seconds()
+
+    """
+    Discards the API clients, so that each logs in again when it is next
+    used. The Tandem Source circuit breakers are kept.
+    """
+    def logout(self):
+        self._ciq = None
+        self._ws2 = None
+        self._android = None
+        self._webui = None
+        self._tandemsource = None
+
     @property
     def controliq(self):
         if self._ciq and not self._ciq.needs_relogin():
             return self._ciq
 
         logger.debug("Instantiating new ControlIQApi")
+        from .controliq import ControlIQApi
 
         self._ciq = ControlIQApi(self.email, self.password)
         return self._ciq
@@ -55,6 +100,7 @@ class TConnectApi:
         # so userGuid can be accessed from it
         self.controliq
 
+        from .ws2 import WS2Api
         self._ws2 = WS2Api(self._ciq.userGuid)
         return self._ws2
 
@@ -64,6 +110,7 @@ class TConnectApi:
             return self._android
 
         logger.debug("Instantiating new AndroidApi")
+        from .android import AndroidApi
 
         self._android = AndroidApi(self.email, self.password)
         return self._android
@@ -74,6 +121,7 @@ class TConnectApi:
             return self._webui
         
         logger.debug("Instantiating new WebUIScraper")
+        from .webui import WebUIScraper
 
         self._webui = WebUIScraper(self.controliq)
         return self._webui
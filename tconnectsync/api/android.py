@@ -11,7 +11,7 @@ import logging
 from bs4 import BeautifulSoup
 
 from ..util import timeago
-from .common import ApiException, ApiLoginException, parse_date, base_session
+from .common import ApiException, ApiLoginException, parse_date, base_session, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +45,7 @@ class AndroidApi:
 
     def __init__(self, email, password):
         self.session = base_session()
+        self.retry_policy = RetryPolicy('AndroidApi')
         self.login(email, password)
         self._email = email
         self._password = password
@@ -101,27 +102,15 @@ class AndroidApi:
         }, **kwargs)
 
         if r.status_code != 200:
-            raise ApiException(r.status_code, "Android API HTTP %s response: %s" % (str(r.status_code), r.text))
+            raise ApiException(r.status_code, "Android API HTTP %s response: %s" % (str(r.status_code), r.text), retry_after=r.headers.get('Retry-After'))
         return r.json()
 
-    def get(self, endpoint, query={}, tries=0, **kwargs):
-        try:
-            return self._get(endpoint, query, **kwargs)
-        except ApiException as e:
-            if tries > 0:
-                raise ApiException(e.status_code, "Android API HTTP %s on retry #%d: %s" % (e.status_code, tries, e))
+    def get(self, endpoint, query={}, **kwargs):
+        return self.retry_policy.call(endpoint, lambda: self._get(endpoint, query, **kwargs), on_unauthorized=self._relogin)
 
-            # Trigger automatic re-login, and try again once
-            if e.status_code == 401:
-                self.accessTokenExpiresAt = time.time()
-                self.login(self._email, self._password)
-
-                return self.get(endpoint, query, tries=tries+1, **kwargs)
-
-            if e.status_code == 500:
-                return self.get(endpoint, query, tries=tries+1, **kwargs)
-
-            raise e
+    def _relogin(self):
+        self.accessTokenExpiresAt = time.time()
+        self.login(self._email, self._password)
 
 
     def post(self, endpoint, query={}, **kwargs):
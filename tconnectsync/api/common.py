@@ -1,4 +1,8 @@
 import datetime
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
 from typing import List, Tuple
 import requests
 import random
@@ -6,6 +10,8 @@ import arrow
 
 from tconnectsync import secret
 
+logger = logging.getLogger(__name__)
+
 def parse_date(date):
     if type(date) == str:
         return date
@@ -91,15 +97,18 @@ random_ua = random.choice(USER_AGENTS)
 def base_headers():
     return {'user-agent': random_ua}
 
-def base_session():
+def base_session(proxy=None):
+    if proxy is None:
+        proxy = secret.REQUESTS_PROXY
+
     s = requests.Session()
-    if secret.REQUESTS_PROXY:
+    if proxy:
         def wrapped_request(self, *args, **kwargs):
             if not kwargs:
                 kwargs = {}
             kwargs['proxies'] = {
-                'http': secret.REQUESTS_PROXY,
-                'https': secret.REQUESTS_PROXY
+                'http': proxy,
+                'https': proxy
             }
             return self._original_request(*args, **kwargs)
 
@@ -130,9 +139,216 @@ def split_days_range(start_a, end_a, days: int = 5) -> List[Tuple[str, str]]:
     return ranges
 
 class ApiException(Exception):
-    def __init__(self, status_code, text, *args, **kwargs):
+    def __init__(self, status_code, text, *args, retry_after=None, **kwargs):
         self.status_code = status_code
+        self.retry_after = retry_after
         super().__init__('%s%s' % (text, ' (HTTP %s)' % status_code if status_code else ''), *args, **kwargs)
 
 class ApiLoginException(ApiException):
-    pass
\ No newline at end of file
+    pass
+
+class CircuitOpenException(ApiException):
+    def __init__(self, name, endpoint, retry_in):
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+        super().__init__(None, '%s circuit breaker is open for %s, retry in %d seconds' % (name, endpoint, retry_in))
+
+
+def parse_retry_after(value):
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, (arrow.get(when) - arrow.get()).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures for a single upstream endpoint. After
+    failure_threshold failures in a row the circuit opens and requests are
+    rejected until reset_timeout seconds have passed, after which a single
+    probe request is let through (half-open) to decide whether to close it.
+    Other requests are rejected until the probe has succeeded or failed.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    # Requests rejected while the probe is in flight are told to retry after
+    # this long, rather than the full reset_timeout
+    PROBE_WAIT_SECONDS = 5
+
+    def __init__(self, failure_threshold=5, reset_timeout=300, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._state = self.CLOSED
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _update_state(self):
+        if self._state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            self._update_state()
+            if self._state == self.OPEN:
+                return False
+            if self._state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def retry_in(self):
+        with self._lock:
+            self._update_state()
+            if self._state == self.HALF_OPEN and self._probing:
+                return min(self.PROBE_WAIT_SECONDS, self.reset_timeout)
+            if self._state != self.OPEN:
+                return 0
+            return max(0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._state = self.CLOSED
+            self._probing = False
+
+    """
+    Ends a probe request which neither succeeded nor failed in a way that
+    counts against the endpoint (e.g. HTTP 401 or 404), so that the next
+    request is let through as the probe instead.
+    """
+    def release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._probing = False
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class RetryPolicy:
+    """
+    Shared retry behavior for the t:connect API clients: retries transient
+    HTTP errors with exponential backoff and jitter (honoring Retry-After),
+    re-logs in once on HTTP 401 via on_unauthorized, and keeps a circuit
+    breaker per endpoint so a failing backend is not hammered.
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, name, max_retries=1, base_delay=1.0, max_delay=60.0, jitter=True,
+                 retry_status_codes=RETRY_STATUS_CODES, failure_threshold=5, reset_timeout=300,
+                 sleep=time.sleep):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_status_codes = retry_status_codes
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_key(endpoint):
+        # Group requests by path so that per-user IDs and query strings
+        # don't create a separate breaker for every call. Also used as the
+        # endpoint label of request metrics.
+        path = endpoint.split('?')[0]
+        return '/'.join('{id}' if any(c.isdigit() for c in part) else part for part in path.split('/'))
+
+    def breaker(self, endpoint):
+        key = self.endpoint_key(endpoint)
+        with self._lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[key]
+
+    def open_circuit_seconds(self):
+        """Returns the longest remaining wait across all open circuits, or 0 if none are open."""
+        with self._lock:
+            breakers = list(self.breakers.values())
+        return max([b.retry_in() for b in breakers if b.state == CircuitBreaker.OPEN] or [0])
+
+    def backoff_seconds(self, tries, retry_after=None):
+        delay = min(self.max_delay, self.base_delay * (2 ** tries))
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+    def is_retryable(self, e):
+        if isinstance(e, ApiException):
+            return e.status_code in self.retry_status_codes
+        return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def call(self, endpoint, fn, on_unauthorized=None):
+        breaker = self.breaker(endpoint)
+        tries = 0
+        while True:
+            if not breaker.allow_request():
+                raise CircuitOpenException(self.name, self.endpoint_key(endpoint), breaker.retry_in())
+
+            try:
+                ret = fn()
+            except (ApiException, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                status_code = getattr(e, 'status_code', None)
+                logger.warning("Received %s in %s with endpoint '%s' (tries %d): %s" % (type(e).__name__, self.name, endpoint, tries, e))
+
+                retryable = self.is_retryable(e)
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.release_probe()
+
+                if tries >= self.max_retries and (retryable or status_code == 401):
+                    raise ApiException(status_code, "%s HTTP %s on retry #%d: %s" % (self.name, status_code, tries, e)) from e
+
+                if status_code == 401 and on_unauthorized:
+                    logger.info("Performing automatic re-login after HTTP 401 for %s" % self.name)
+                    on_unauthorized()
+                elif retryable:
+                    delay = self.backoff_seconds(tries, parse_retry_after(getattr(e, 'retry_after', None)))
+                    logger.info("Retrying %s endpoint '%s' in %0.1f seconds (retry #%d)" % (self.name, endpoint, delay, tries + 1))
+                    self.sleep(delay)
+                else:
+                    raise e
+
+                tries += 1
+                continue
+            except BaseException:
+                breaker.release_probe()
+                raise
+
+            breaker.record_success()
+            return ret
\ No newline at end of file
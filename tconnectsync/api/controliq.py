@@ -6,7 +6,7 @@ import logging
 from bs4 import BeautifulSoup
 
 from ..util import timeago, cap_length
-from .common import parse_date, base_headers, base_session, ApiException, ApiLoginException
+from .common import parse_date, base_headers, base_session, ApiException, ApiLoginException, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +22,7 @@ class ControlIQApi:
     tconnect_software_ver = None
 
     def __init__(self, email, password):
+        self.retry_policy = RetryPolicy('ControlIQApi')
         self.login(email, password)
         self._email = email
         self._password = password
@@ -135,30 +136,15 @@ class ControlIQApi:
         r = base_session().get(self.BASE_URL + endpoint, data=query, headers=self.api_headers())
 
         if r.status_code != 200:
-            raise ApiException(r.status_code, "ControlIQ API HTTP %s response: %s" % (str(r.status_code), r.text))
+            raise ApiException(r.status_code, "ControlIQ API HTTP %s response: %s" % (str(r.status_code), r.text), retry_after=r.headers.get('Retry-After'))
         return r.json()
 
+    def get(self, endpoint, query):
+        return self.retry_policy.call(endpoint, lambda: self._get(endpoint, query), on_unauthorized=self._relogin)
 
-    def get(self, endpoint, query, tries=0):
-        try:
-            return self._get(endpoint, query)
-        except ApiException as e:
-            logger.warning("Received ApiException in ControlIQApi with endpoint '%s' (tries %d): %s" % (endpoint, tries, e))
-            if tries > 0:
-                raise ApiException(e.status_code, "ControlIQ API HTTP %d on retry #%d: %s", e.status_code, tries, e)
-
-            # Trigger automatic re-login, and try again once
-            if e.status_code == 401:
-                logger.info("Performing automatic re-login after HTTP 401 for ControlIQApi")
-                self.accessTokenExpiresAt = time.time()
-                self.login(self._email, self._password)
-
-                return self.get(endpoint, query, tries=tries+1)
-
-            if e.status_code == 500:
-                return self.get(endpoint, query, tries=tries+1)
-
-            raise e
+    def _relogin(self):
+        self.accessTokenExpiresAt = time.time()
+        self.login(self._email, self._password)
 
     """
     Returns detailed basal event information and reasons for delivery suspension.
@@ -0,0 +1,155 @@
+import base64
+import datetime
+import json
+import logging
+import mmap
+import struct
+
+from ..eventparser.generic import Events
+from ..eventparser.raw_event import EVENT_LEN, TANDEM_EPOCH
+from ..util.timing import NO_TIMINGS
+from .common import parse_ymd_date
+
+logger = logging.getLogger(__name__)
+
+# ID (and source), and timestamp of each event
+HEADER = struct.Struct('>HI%dx' % (EVENT_LEN - 6))
+
+SECONDS_PER_DAY = 24 * 60 * 60
+UNIX_EPOCH = datetime.date(1970, 1, 1)
+
+BASE64_CHARS = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=\r\n"')
+
+
+"""
+Reads the pump history saved in a file, either the base64 string returned
+by the Tandem Source pump events endpoint (optionally JSON-quoted) or the
+decoded binary events. Binary files are memory-mapped when use_mmap is
+set, rather than read into memory.
+"""
+def load_events_file(path, use_mmap=False):
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+        f.seek(0)
+        # Binary events always include bytes outside of the base64 alphabet
+        if head and all(c in BASE64_CHARS for c in head):
+            return base64.b64decode(f.read().strip().strip(b'"'))
+        if use_mmap and head:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+
+"""
+Returns the events in buffers of decoded binary events which are on the
+given local dates (inclusive), have the given IDs and, if until is given,
+a raw timestamp no later than until.
+"""
+def select_events(buffers, min_date=None, max_date=None, event_ids=None, until=None):
+    min_day = (datetime.date.fromisoformat(parse_ymd_date(min_date)) - UNIX_EPOCH).days if min_date else None
+    max_day = (datetime.date.fromisoformat(parse_ymd_date(max_date)) - UNIX_EPOCH).days if max_date else None
+    event_ids = frozenset(event_ids) if event_ids else None
+
+    chunks = []
+    for buf in buffers:
+        for i, (source_and_id, ts) in enumerate(HEADER.iter_unpack(buf)):
+            if until is not None and ts > until:
+                continue
+            day = (TANDEM_EPOCH + ts) // SECONDS_PER_DAY
+            if min_day is not None and day < min_day:
+                continue
+            if max_day is not None and day > max_day:
+                continue
+            if event_ids is not None and source_and_id & 0x0FFF not in event_ids:
+                continue
+            chunks.append(buf[i*EVENT_LEN:(i+1)*EVENT_LEN])
+    return b''.join(chunks)
+
+
+class ReplayTandemSourceApi:
+    """
+    Serves pump history and pump_event_metadata saved to disk in place of
+    Tandem Source, so a sync can be run without credentials against a
+    fixed history of any size. Like the real API, pump events are filtered
+    to the requested dates and, unless all event types are requested, to
+    DEFAULT_EVENT_IDS.
+
+    When no metadata file is given, metadata for a single pump is built
+    from the history, with the serial number from PUMP_SERIAL_NUMBER.
+    """
+    # Per-stage timings, recorded when profiling
+    timings = NO_TIMINGS
+
+    def __init__(self, paths, secret, metadata_path=None, use_mmap=False, timings=None):
+        from .tandemsource import TandemSourceApi
+        self.DEFAULT_EVENT_IDS = TandemSourceApi.DEFAULT_EVENT_IDS
+
+        self.secret = secret
+        if timings is not None:
+            self.timings = timings
+
+        self.buffers = []
+        for path in paths:
+            data = load_events_file(path, use_mmap=use_mmap)
+            if len(data) % EVENT_LEN:
+                logger.warning("%s is not a whole number of events, ignoring the last %d bytes" % (path, len(data) % EVENT_LEN))
+            self.buffers.append(memoryview(data)[:len(data) - len(data) % EVENT_LEN])
+            logger.info("Loaded %d events from %s" % (len(data) // EVENT_LEN, path))
+
+        if metadata_path:
+            with open(metadata_path) as f:
+                self.metadata = json.load(f)
+        else:
+            self.metadata = [self.build_metadata()]
+        self._metadata_returned = False
+
+    def needs_relogin(self):
+        return False
+
+    def pump_event_metadata(self):
+        return self.metadata
+
+    def pump_event_metadata_if_changed(self):
+        if self._metadata_returned:
+            return None
+        self._metadata_returned = True
+        return self.metadata
+
+    def build_metadata(self):
+        timestamps = [ts for buf in self.buffers for _, ts in HEADER.iter_unpack(buf)]
+        def local_time(ts):
+            return datetime.datetime.utcfromtimestamp(TANDEM_EPOCH + ts).isoformat()
+
+        serial_number = self.secret.PUMP_SERIAL_NUMBER
+        return {
+            'tconnectDeviceId': 'replay',
+            'serialNumber': str(serial_number) if serial_number else 'replay',
+            'minDateWithEvents': local_time(min(timestamps)) if timestamps else None,
+            'maxDateWithEvents': local_time(max(timestamps)) if timestamps else datetime.datetime.now().isoformat(),
+        }
+
+    """
+    Returns the saved events on the given local dates (inclusive) and with
+    the given IDs, as decoded binary events.
+    """
+    def select(self, min_date=None, max_date=None, event_ids=None):
+        return select_events(self.buffers, min_date, max_date, event_ids)
+
+    def pump_events_raw(self, tconnect_device_id, min_date=None, max_date=None, event_ids_filter=None):
+        return base64.b64encode(self.select(min_date, max_date, event_ids_filter)).decode()
+
+    def pump_events(self, tconnect_device_id, min_date=None, max_date=None, fetch_all_event_types=False):
+        with self.timings.stage('tandemsource.download'):
+            data = self.select(min_date, max_date, None if fetch_all_event_types else self.DEFAULT_EVENT_IDS)
+        logger.info(f"Read {len(data)} bytes (est. {len(data)/EVENT_LEN} events)")
+        return Events(data, timezone=self.secret.TIMEZONE_NAME)
+
+
+class ReplayTConnectApi:
+    """
+    A TConnectApi whose Tandem Source client is a ReplayTandemSourceApi.
+    """
+    def __init__(self, paths, secret, metadata_path=None, use_mmap=False, timings=None):
+        self.tandemsource = ReplayTandemSourceApi(paths, secret, metadata_path=metadata_path, use_mmap=use_mmap, timings=timings)
+
+    def tandemsource_circuit_open_seconds(self):
+        return 0
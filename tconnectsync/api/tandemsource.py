@@ -8,6 +8,9 @@ import hashlib
 import os
 import jwt
 import pickle
+import re
+import requests
+import threading
 
 from requests_oidc import make_auth_code_session
 from requests_oidc.plugins import OSCachedPlugin
@@ -17,8 +20,10 @@ from jwt.algorithms import RSAAlgorithm
 
 
 from ..util import timeago, cap_length
-from .common import parse_ymd_date, base_headers, base_session, ApiException, ApiLoginException
-from ..secret import CACHE_CREDENTIALS, CACHE_CREDENTIALS_PATH
+from ..util.timing import NO_TIMINGS, timed
+from ..util import metrics
+from .common import parse_ymd_date, base_headers, base_session, ApiException, ApiLoginException, RetryPolicy
+from .. import secret as default_secret
 from ..eventparser.generic import Events, decode_raw_events, EVENT_LEN
 
 logger = logging.getLogger(__name__)
@@ -54,7 +59,21 @@ class TandemSourceApi:
         'AUTHORIZATION_ENDPOINT': 'https://tdcservices.eu.tandemdiabetes.com/accounts/api/connect/authorize'
     }
 
-    def __init__(self, email, password, region='US'):
+    # Settings for cached credentials, the proxy and the pump time zone
+    secret = default_secret
+
+    # Per-stage timings, recorded when profiling
+    timings = NO_TIMINGS
+
+    def __init__(self, email, password, region='US', secret=None, timings=None, retry_policy=None):
+        # Circuit breakers are per client, so that one login's failures
+        # don't block requests for another
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy('TandemSourceApi')
+        if secret is not None:
+            self.secret = secret
+        if timings is not None:
+            self.timings = timings
+
         self.region = region.upper()
         if self.region not in ['US', 'EU']:
             raise ValueError(f"Invalid region '{region}'. Must be 'US' or 'EU'.")
@@ -89,13 +108,16 @@ class TandemSourceApi:
     def SOURCE_URL(self):
         return self._region_urls['SOURCE_URL']
 
+    @timed('tandemsource.login')
     def login(self, email, password):
         logger.info(f"Logging in to TandemSourceApi ({self.region} region)...")
         if self.try_load_cached_creds(email):
             logger.info("Successfully used cached credentials")
             return True
 
-        with base_session() as s:
+        metrics.LOGINS.inc('tandemsource')
+
+        with base_session(self.secret.REQUESTS_PROXY) as s:
             initial = s.get(self.LOGIN_PAGE_URL, headers=base_headers())
 
             data = {
@@ -212,17 +234,16 @@ class TandemSourceApi:
         logger.debug("6. extracting JWT from %s" % self.idToken)
         id_token = self.idToken
 
-        jwks_response = self.loginSession.get(self.TDC_OIDC_JWKS_URL)
-        jwks = jwks_response.json()
-        public_keys = {}
-        for jwk in jwks['keys']:
-            kid = jwk['kid']
-            public_keys[kid] = RSAAlgorithm.from_jwk(json.dumps(jwk))
-
         # Get the key ID (kid) from the headers of the ID Token
         unverified_header = jwt.get_unverified_header(id_token)
         kid = unverified_header['kid']
 
+        public_keys = self.jwks_public_keys()
+        if kid not in public_keys:
+            # The signing key may have been rotated since the JWKS was cached
+            logger.info("JWT key %s not found in cached JWKS, refetching" % kid)
+            public_keys = self.jwks_public_keys(force_refresh=True)
+
         key = public_keys.get(kid)
         if not key:
             raise ApiException(0, 'Public key not found for JWT: %s' % kid)
@@ -245,28 +266,152 @@ class TandemSourceApi:
         self.pumperId = id_token_claims['pumperId']
         self.accountId = id_token_claims['accountId']
 
+    # Used when the JWKS response specifies no Cache-Control max-age
+    JWKS_DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+
+    def jwks_public_keys(self, force_refresh=False):
+        jwks = self.fetch_jwks(force_refresh=force_refresh)
+        public_keys = {}
+        for jwk in jwks['keys']:
+            kid = jwk['kid']
+            public_keys[kid] = RSAAlgorithm.from_jwk(json.dumps(jwk))
+        return public_keys
+
+    """
+    Returns the JWKS document for the current region, using the on-disk cache
+    at CACHE_JWKS_PATH while it is fresh according to the Cache-Control max-age
+    returned by the server. Stale entries are revalidated with If-None-Match and
+    If-Modified-Since, so an unchanged JWKS costs only a 304 response.
+    """
+    def fetch_jwks(self, force_refresh=False):
+        url = self.TDC_OIDC_JWKS_URL
+        now = arrow.get().int_timestamp
+
+        cache = self._load_jwks_cache()
+        cached = cache.get(url)
+        if cached and not force_refresh and now < cached.get('expiresAt', 0):
+            logger.debug("Using cached JWKS for %s (expires %s)" % (url, arrow.get(cached['expiresAt'])))
+            return cached['jwks']
+
+        headers = base_headers()
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('lastModified'):
+            headers['If-Modified-Since'] = cached['lastModified']
+
+        try:
+            jwks_response = self.loginSession.get(url, headers=headers)
+        except requests.RequestException as e:
+            if not cached:
+                raise
+            logger.warning("Unable to refresh JWKS (%s), using cached copy" % e)
+            return cached['jwks']
+
+        if jwks_response.status_code == 304 and cached:
+            logger.debug("JWKS for %s not modified" % url)
+            jwks = cached['jwks']
+        elif jwks_response.status_code == 200:
+            jwks = jwks_response.json()
+        elif cached:
+            logger.warning("Unable to refresh JWKS (HTTP %s), using cached copy: %s" % (jwks_response.status_code, cap_length(jwks_response.text, 200)))
+            return cached['jwks']
+        else:
+            raise ApiException(jwks_response.status_code, 'Error fetching JWKS: %s' % jwks_response.text)
+
+        max_age = self._jwks_max_age(jwks_response.headers.get('Cache-Control'))
+        if max_age is None:
+            # The server asked for the JWKS not to be stored, so an older
+            # copy must not be served either
+            if cache.pop(url, None) is not None:
+                self._save_jwks_cache(cache)
+            return jwks
+
+        cache[url] = {
+            'jwks': jwks,
+            'etag': jwks_response.headers.get('ETag') or (cached or {}).get('etag'),
+            'lastModified': jwks_response.headers.get('Last-Modified') or (cached or {}).get('lastModified'),
+            'fetchedAt': now,
+            'expiresAt': now + max_age,
+        }
+        self._save_jwks_cache(cache)
+        return jwks
+
+    def _jwks_max_age(self, cache_control):
+        if not cache_control:
+            return self.JWKS_DEFAULT_MAX_AGE_SECONDS
+
+        directives = [d.strip().lower() for d in cache_control.split(',')]
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0
+
+        for d in directives:
+            m = re.match(r'^max-age=(\d+)$', d)
+            if m:
+                return int(m.group(1))
+        return self.JWKS_DEFAULT_MAX_AGE_SECONDS
+
+    def _load_jwks_cache(self):
+        if not self.secret.CACHE_JWKS or not os.path.exists(self.secret.CACHE_JWKS_PATH):
+            return {}
+
+        try:
+            with open(self.secret.CACHE_JWKS_PATH, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load cached JWKS at {self.secret.CACHE_JWKS_PATH}: {e}")
+            return {}
+
+    def _save_jwks_cache(self, cache):
+        if not self.secret.CACHE_JWKS:
+            return
+
+        try:
+            if not cache:
+                if os.path.exists(self.secret.CACHE_JWKS_PATH):
+                    os.remove(self.secret.CACHE_JWKS_PATH)
+                    logger.debug(f"Removed cached JWKS at {self.secret.CACHE_JWKS_PATH}")
+                return
+            mkdir = os.path.dirname(self.secret.CACHE_JWKS_PATH)
+            if mkdir:
+                os.makedirs(mkdir, exist_ok=True)
+            # Written to a temporary file first, so that other clients sharing
+            # the cache (e.g. daemon accounts) never read a partial file
+            tmp_path = '%s.%d.%d.tmp' % (self.secret.CACHE_JWKS_PATH, os.getpid(), threading.get_ident())
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(cache, f)
+                os.replace(tmp_path, self.secret.CACHE_JWKS_PATH)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.debug(f"Saved cached JWKS to {self.secret.CACHE_JWKS_PATH}")
+        except Exception as e:
+            logger.warning(f"Could not save cached JWKS to {self.secret.CACHE_JWKS_PATH}: {e}")
+
     def try_load_cached_creds(self, email):
-        if not CACHE_CREDENTIALS:
+        if not self.secret.CACHE_CREDENTIALS:
             return False
 
-        if not os.path.exists(CACHE_CREDENTIALS_PATH):
+        if not os.path.exists(self.secret.CACHE_CREDENTIALS_PATH):
             logger.info("No cached credentials exist")
             return False
 
         _saved_blob = {}
         try:
-            with open(CACHE_CREDENTIALS_PATH, 'rb') as f:
+            with open(self.secret.CACHE_CREDENTIALS_PATH, 'rb') as f:
                 _saved_blob = pickle.load(f)
         except Exception as e:
-            logger.warning(f"Could not load cached credentials at {CACHE_CREDENTIALS_PATH}: {e}")
+            logger.warning(f"Could not load cached credentials at {self.secret.CACHE_CREDENTIALS_PATH}: {e}")
             return False
 
         if not _saved_blob:
-            logger.warning(f"Could not load cached credentials at {CACHE_CREDENTIALS_PATH}: empty dict")
+            logger.warning(f"Could not load cached credentials at {self.secret.CACHE_CREDENTIALS_PATH}: empty dict")
             return False
 
         if _saved_blob.get('cache_creds_version') != 1.0:
-            logger.warning(f"Unexpected cache_creds_version at {CACHE_CREDENTIALS_PATH}: {_saved_blob['cache_creds_version']}, expected 1.0")
+            logger.warning(f"Unexpected cache_creds_version at {self.secret.CACHE_CREDENTIALS_PATH}: {_saved_blob['cache_creds_version']}, expected 1.0")
             return False
 
         if _saved_blob.get('cache_creds_email') != email:
@@ -319,13 +464,13 @@ class TandemSourceApi:
 
         sa = _saved_blob['cache_creds_saved_at']
         ex = _saved_blob['accessTokenExpiresAt']
-        logger.info(f"Loaded cached credentials from {CACHE_CREDENTIALS_PATH}: saved at {sa} ({est_time(sa)}), access token expiry {ex} ({est_time(ex)})")
+        logger.info(f"Loaded cached credentials from {self.secret.CACHE_CREDENTIALS_PATH}: saved at {sa} ({est_time(sa)}), access token expiry {ex} ({est_time(ex)})")
 
         return True
 
 
     def cache_creds(self, email):
-        if not CACHE_CREDENTIALS:
+        if not self.secret.CACHE_CREDENTIALS:
             logger.info("Credentials caching is disabled, skipping save")
             return
 
@@ -343,14 +488,14 @@ class TandemSourceApi:
             'loginSession': self.loginSession
         }
 
-        if not os.path.exists(CACHE_CREDENTIALS_PATH):
-            mkdir = os.path.dirname(CACHE_CREDENTIALS_PATH)
+        if not os.path.exists(self.secret.CACHE_CREDENTIALS_PATH):
+            mkdir = os.path.dirname(self.secret.CACHE_CREDENTIALS_PATH)
             logger.debug(f"Running mkdir on {mkdir}")
             os.makedirs(mkdir, exist_ok=True)
 
-        with open(CACHE_CREDENTIALS_PATH, 'wb') as f:
+        with open(self.secret.CACHE_CREDENTIALS_PATH, 'wb') as f:
             pickle.dump(_saved_blob, f)
-            logger.info(f"Saved cached credentials to {CACHE_CREDENTIALS_PATH}")
+            logger.info(f"Saved cached credentials to {self.secret.CACHE_CREDENTIALS_PATH}")
 
 
     def needs_relogin(self):
@@ -371,33 +516,27 @@ class TandemSourceApi:
         }
 
     def _get(self, endpoint, query):
-        r = base_session().get(self.SOURCE_URL + endpoint, data=query, headers=self.api_headers())
+        with metrics.HTTP_REQUEST_DURATION.time('tandemsource', RetryPolicy.endpoint_key(endpoint)):
+            r = base_session(self.secret.REQUESTS_PROXY).get(self.SOURCE_URL + endpoint, data=query, headers=self.api_headers())
 
         if r.status_code != 200:
-            raise ApiException(r.status_code, "TandemSourceApi HTTP %s response: %s" % (str(r.status_code), r.text))
+            raise ApiException(r.status_code, "TandemSourceApi HTTP %s response: %s" % (str(r.status_code), r.text), retry_after=r.headers.get('Retry-After'))
         return r.json()
 
+    def get(self, endpoint, query):
+        return self.retry_policy.call(endpoint, lambda: self._get(endpoint, query), on_unauthorized=self._relogin)
 
-    def get(self, endpoint, query, tries=0):
-        try:
-            return self._get(endpoint, query)
-        except ApiException as e:
-            logger.warning("Received ApiException in TandemSourceApi with endpoint '%s' (tries %d): %s" % (endpoint, tries, e))
-            if tries > 0:
-                raise ApiException(e.status_code, "TandemSourceApi HTTP %d on retry #%d: %s", e.status_code, tries, e)
-
-            # Trigger automatic re-login, and try again once
-            if e.status_code == 401:
-                logger.info("Performing automatic re-login after HTTP 401 for TandemSourceApi")
-                self.accessTokenExpiresAt = time.time()
-                self.login(self._email, self._password)
-
-                return self.get(endpoint, query, tries=tries+1)
+    def _relogin(self):
+        self.accessTokenExpiresAt = time.time()
+        self.login(self._email, self._password)
 
-            if e.status_code == 500:
-                return self.get(endpoint, query, tries=tries+1)
+    def _get_conditional(self, endpoint, query, headers):
+        with metrics.HTTP_REQUEST_DURATION.time('tandemsource', RetryPolicy.endpoint_key(endpoint)):
+            r = base_session(self.secret.REQUESTS_PROXY).get(self.SOURCE_URL + endpoint, data=query, headers={**self.api_headers(), **headers})
 
-            raise e
+        if r.status_code not in (200, 304):
+            raise ApiException(r.status_code, "TandemSourceApi HTTP %s response: %s" % (str(r.status_code), r.text), retry_after=r.headers.get('Retry-After'))
+        return r
 
     """
     Returns information about the user and available pumps.
@@ -411,9 +550,47 @@ class TandemSourceApi:
         {'tconnectDeviceId', 'serialNumber', 'modelNumber', 'minDateWithEvents', 'maxDateWithEvents', 'lastUpload', 'patientName', 'patientDateOfBirth', 'patientCareGiver', 'softwareVersion', 'partNumber'},
     ]
     """
+    @timed('tandemsource.metadata')
     def pump_event_metadata(self):
         return self.get('api/reports/reportsfacade/%s/pumpeventmetadata' % (self.pumperId), {})
 
+    # Validators for the last pump_event_metadata_if_changed() response
+    _metadata_etag = None
+    _metadata_last_modified = None
+    _metadata_digest = None
+
+    """
+    Lightweight change-detection probe for pump_event_metadata().
+    Returns the metadata if it changed since the previous call on this
+    instance, or None if it is unchanged. Sends If-None-Match and
+    If-Modified-Since when the server provided validators, and otherwise
+    compares a hash of the raw response body, so an unchanged response
+    (including its lastUpload settings) is never JSON-decoded.
+    """
+    @timed('tandemsource.metadata')
+    def pump_event_metadata_if_changed(self):
+        endpoint = 'api/reports/reportsfacade/%s/pumpeventmetadata' % (self.pumperId)
+        headers = {}
+        if self._metadata_digest and self._metadata_etag:
+            headers['If-None-Match'] = self._metadata_etag
+        if self._metadata_digest and self._metadata_last_modified:
+            headers['If-Modified-Since'] = self._metadata_last_modified
+
+        r = self.retry_policy.call(endpoint, lambda: self._get_conditional(endpoint, {}, headers), on_unauthorized=self._relogin)
+        if r.status_code == 304:
+            logger.debug("pump_event_metadata not modified (HTTP 304)")
+            return None
+
+        digest = hashlib.sha256(r.content).hexdigest()
+        self._metadata_etag = r.headers.get('ETag')
+        self._metadata_last_modified = r.headers.get('Last-Modified')
+        if digest == self._metadata_digest:
+            logger.debug("pump_event_metadata unchanged (sha256 %s)" % digest)
+            return None
+
+        self._metadata_digest = digest
+        return r.json()
+
     DEFAULT_EVENT_IDS = [229,5,28,4,26,99,279,3,16,59,21,55,20,280,64,65,66,61,33,371,171,369,460,172,370,461,372,399,256,213,406,394,212,404,214,405,447,313,60,14,6,90,230,140,12,11,53,13,63,203,307,191]
 
     """
@@ -441,15 +618,17 @@ class TandemSourceApi:
     If fetch_all_events=True, then all event types from the history log will be returned.
     """
     def pump_events(self, tconnect_device_id, min_date=None, max_date=None, fetch_all_event_types=False):
-        pump_events_raw = self.pump_events_raw(
-            tconnect_device_id,
-            min_date,
-            max_date,
-            event_ids_filter=None if fetch_all_event_types else self.DEFAULT_EVENT_IDS
-        )
+        with self.timings.stage('tandemsource.download'):
+            pump_events_raw = self.pump_events_raw(
+                tconnect_device_id,
+                min_date,
+                max_date,
+                event_ids_filter=None if fetch_all_event_types else self.DEFAULT_EVENT_IDS
+            )
 
-        pump_events_decoded = decode_raw_events(pump_events_raw)
+        with self.timings.stage('tandemsource.decode'):
+            pump_events_decoded = decode_raw_events(pump_events_raw)
         logger.info(f"Read {len(pump_events_decoded)} bytes (est. {len(pump_events_decoded)/EVENT_LEN} events)")
-        return Events(pump_events_decoded)
+        return Events(pump_events_decoded, timezone=self.secret.TIMEZONE_NAME)
 
 
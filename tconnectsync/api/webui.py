@@ -12,7 +12,7 @@ from tconnectsync.domain.device_settings import Device, Profile, ProfileSegment,
 from tconnectsync.util import removesuffix, removeprefix
 from tconnectsync.util.constants import MMOLL_TO_MGDL
 
-from .common import base_headers, ApiException
+from .common import base_headers, ApiException, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +25,7 @@ class WebUIScraper:
 
     def __init__(self, controliq):
         self.controliq = controliq
+        self.retry_policy = RetryPolicy('WebUIScraper')
 
     def needs_relogin(self):
         return self.controliq.needs_relogin()
@@ -33,35 +34,21 @@ class WebUIScraper:
         r = self.controliq.loginSession.get(self.BASE_URL + endpoint, headers=base_headers(), allow_redirects=True)
 
         if r.status_code != 200:
-            raise ApiException(r.status_code, "WebUIScraper HTTP %s response: %s" % (str(r.status_code), r.text))
+            raise ApiException(r.status_code, "WebUIScraper HTTP %s response: %s" % (str(r.status_code), r.text), retry_after=r.headers.get('Retry-After'))
 
         if 'login.aspx' in r.url:
             raise ApiException(401, "WebUIScraper HTTP %s response for login page, returning 401: %s" % (str(r.status_code), r.url))
 
         return r
 
+    def get(self, endpoint):
+        return self.retry_policy.call(endpoint, lambda: self._get(endpoint), on_unauthorized=self._relogin)
 
-    def get(self, endpoint, tries=0):
-        try:
-            return self._get(endpoint)
-        except ApiException as e:
-            logger.warning("Received ApiException in WebUIScraper with endpoint '%s' (tries %d): %s" % (endpoint, tries, e))
-            if tries > 0:
-                raise ApiException(e.status_code, "WebUIScraper HTTP %d on retry #%d: %s", e.status_code, tries, e)
+    def _relogin(self):
+        # Re-login happens via ControlIQApi, whose session is used for scraping
+        self.controliq.accessTokenExpiresAt = time.time()
+        self.controliq.login(self.controliq._email, self.controliq._password)
 
-            # Trigger automatic re-login, and try again once
-            if e.status_code == 401:
-                logger.info("Performing automatic re-login to ControlIQApi after HTTP 401 for ControlIQApi")
-                self.controliq.accessTokenExpiresAt = time.time()
-                self.controliq.login(self.controliq._email, self.controliq._password)
-
-                return self.get(endpoint, tries=tries+1)
-
-            if e.status_code == 500:
-                return self.get(endpoint, tries=tries+1)
-
-            raise e
-    
     def strip(self, txt):
         # Remove errant whitespace between litearl newlines (and literal &nbsp;)
         sep = '\r\n'
@@ -2,10 +2,9 @@ import requests
 import datetime
 import csv
 import logging
-import time
 import json
 
-from .common import base_session, parse_date, parsed_date_to_arrow, base_headers, days_between, split_days_range, ApiException
+from .common import base_session, parse_date, parsed_date_to_arrow, base_headers, days_between, split_days_range, ApiException, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +19,15 @@ class WS2Api:
     def __init__(self, userGuid):
         self.userGuid = userGuid
         self.session = base_session()
+        self.retry_policy = self.build_retry_policy()
+
+    def build_retry_policy(self):
+        return RetryPolicy('WS2Api', max_retries=self.MAX_RETRIES, base_delay=self.SLEEP_SECONDS_INCREMENT, max_delay=10 * self.SLEEP_SECONDS_INCREMENT)
 
     def get(self, endpoint, **kwargs):
         r = self.session.get(self.BASE_URL + endpoint, headers=base_headers(), **kwargs)
         if r.status_code != 200:
-            raise ApiException(r.status_code, "WS2 API HTTP %s response: %s" % (str(r.status_code), r.text))
+            raise ApiException(r.status_code, "WS2 API HTTP %s response: %s" % (str(r.status_code), r.text), retry_after=r.headers.get('Retry-After'))
         return r.text
 
     def get_jsonp(self, endpoint, **kwargs):
@@ -72,11 +75,11 @@ class WS2Api:
     The ControlIQ API endpoints must be used for basal data instead.
     However, all other fields are still accessed via this endpoint.
 
-    This has its own built-in retry logic because Tandem's frontend serving
-    the API returns 500s when its backend times out.
+    This uses a slower retry policy than other endpoints because Tandem's
+    frontend serving the API returns 500s when its backend times out.
     """
     MAX_THERAPY_TIMELINE_DAYS = 2
-    def therapy_timeline_csv(self, start=None, end=None, tries=0):
+    def therapy_timeline_csv(self, start=None, end=None):
         startDate = parse_date(start)
         endDate = parse_date(end)
 
@@ -89,7 +92,7 @@ class WS2Api:
             for rng in ranges:
                 rStart, rEnd = rng
                 logger.debug("split therapy_timeline_csv(%s, %s)", rStart, rEnd)
-                output = self.therapy_timeline_csv(rStart, rEnd, tries=tries)
+                output = self.therapy_timeline_csv(rStart, rEnd)
                 logger.debug("split therapy_timeline_csv(%s, %s) = %s", rStart, rEnd, ["%s: %s items" % (key, len(val)) for key, val in output.items()])
                 outputs.append(output)
             full = {}
@@ -103,18 +106,9 @@ class WS2Api:
             logger.debug("therapy_timeline_csv merge: %s", ["%s: %s items" % (key, len(val)) for key, val in full.items()])
             return full
 
-        try:
-            req_text = self.get('therapytimeline2csv/%s/%s/%s?format=csv' % (self.userGuid, startDate, endDate), timeout=10)
-        except ApiException as e:
-            # This seems to occur as some kind of soft rate-limit.
-            logger.warning("Received ApiException in therapy_timeline_csv: (retry count %d) %s" % (tries, e))
-            if e.status_code == 500:
-                sleep_seconds = (tries+1) * self.SLEEP_SECONDS_INCREMENT
-                logger.error("Retrying in %d seconds after HTTP 500 in therapy_timeline_csv (retry count %d): %s" % (sleep_seconds, tries, e))
-                time.sleep(sleep_seconds)
-                if tries < self.MAX_RETRIES:
-                    return self.therapy_timeline_csv(start, end, tries+1)
-            raise e
+        # HTTP 500s seem to occur as some kind of soft rate-limit.
+        endpoint = 'therapytimeline2csv/%s/%s/%s?format=csv' % (self.userGuid, startDate, endDate)
+        req_text = self.retry_policy.call(endpoint, lambda: self.get(endpoint, timeout=10))
 
         logger.debug('req_text: %s', req_text)
         sections = self._split_empty_sections(req_text)
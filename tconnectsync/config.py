@@ -0,0 +1,36 @@
+from . import secret as default_secret
+
+
+class Config:
+    """
+    tconnectsync settings scoped to one instance, with the same names as in
+    the secret module. Values start as a copy of the secret module (i.e. .env
+    and the environment, read at import time) and can be overridden per
+    instance, so several configurations can run in one process.
+
+    A Config can be passed anywhere a secret argument is accepted.
+    """
+    def __init__(self, base=None, **overrides):
+        if base is None:
+            base = default_secret
+
+        for k in dir(base):
+            if k.isupper():
+                setattr(self, k, getattr(base, k))
+
+        for k, v in overrides.items():
+            if not hasattr(self, k):
+                raise TypeError("Unknown setting %s" % k)
+            setattr(self, k, v)
+
+    """
+    Returns a copy of this Config with the given settings overridden.
+    """
+    def replace(self, **overrides):
+        return Config(self, **overrides)
+
+    def __repr__(self):
+        return "Config(TCONNECT_EMAIL=%r, NS_URL=%r, TIMEZONE_NAME=%r)" % (
+            getattr(self, 'TCONNECT_EMAIL', None),
+            getattr(self, 'NS_URL', None),
+            getattr(self, 'TIMEZONE_NAME', None))
@@ -0,0 +1,237 @@
+import heapq
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import secret
+from .config import Config
+from .api import TConnectApi
+from .nightscout import NightscoutApi
+from .features import DEFAULT_FEATURES, ALL_FEATURES
+from .sync.tandemsource.autoupdate import TandemSourceAutoupdate
+
+logger = logging.getLogger(__name__)
+
+"""
+Settings which must be provided for every account in the daemon config.
+"""
+REQUIRED_SETTINGS = ['TCONNECT_EMAIL', 'TCONNECT_PASSWORD', 'NS_URL', 'NS_SECRET']
+
+"""
+Settings which are read once when tconnectsync is imported, and so apply to
+every account served by the process. An account may only repeat the value
+the process was started with.
+"""
+PROCESS_WIDE_SETTINGS = [
+    'ENABLE_TESTING_MODES',
+    'EVENT_SCHEMA',
+]
+
+
+class DaemonConfigError(RuntimeError):
+    def __str__(self):
+        return "%s: %s" % (self.__class__.__name__, super().__str__())
+
+
+"""
+Builds the Config for one account, starting from the process configuration
+and overriding it with the account's settings.
+"""
+def account_secret(settings, base=secret):
+    config = Config(base)
+
+    overrides = {}
+    for k, v in settings.items():
+        if not k.isupper():
+            continue
+        if not hasattr(config, k):
+            raise DaemonConfigError("Unknown setting %s" % k)
+        if k in PROCESS_WIDE_SETTINGS and v != getattr(config, k):
+            raise DaemonConfigError("%s applies to every account and must be set in the daemon's own configuration" % k)
+        overrides[k] = v
+
+    for k in REQUIRED_SETTINGS:
+        if k not in settings:
+            raise DaemonConfigError("Missing required setting %s" % k)
+
+    config = config.replace(**overrides)
+    if config.PUMP_SERIAL_NUMBER == '11111111':
+        config.PUMP_SERIAL_NUMBER = None
+
+    return config
+
+
+"""
+Settings holding a file which only one account can use. Unless an account
+sets its own, it gets a path next to the process's, suffixed with the
+account name.
+"""
+PER_ACCOUNT_PATHS = [
+    # The cache only holds the credentials of a single login
+    'CACHE_CREDENTIALS_PATH',
+    # State is kept by pump, which accounts uploading the same pump to
+    # different Nightscout sites would otherwise share
+    'SYNC_STATE_PATH',
+]
+
+"""
+Returns the path of a per-account file for an account.
+"""
+def account_path(path, name):
+    return '%s.%s' % (path, re.sub(r'[^\w.@-]', '_', name))
+
+
+class DaemonAccount:
+    """
+    One account/pump/Nightscout combination served by the daemon. Holds the
+    per-account API clients, whose circuit breakers only track this
+    account's failures, and auto-update state between cycles.
+    """
+    def __init__(self, settings, index=0):
+        self.secret = account_secret(settings)
+        self.name = settings.get('name') or '%s#%d' % (self.secret.TCONNECT_EMAIL, index)
+        self.secret = self.secret.replace(**{
+            k: account_path(getattr(self.secret, k), self.name)
+            for k in PER_ACCOUNT_PATHS if k not in settings
+        })
+        self.pretend = settings.get('pretend', False)
+        self.features = settings.get('features', DEFAULT_FEATURES)
+        for f in self.features:
+            if f not in ALL_FEATURES:
+                raise DaemonConfigError("Unknown feature %s for %s" % (f, self.name))
+        self.tconnect = None
+        self.nightscout = None
+        self.autoupdate = None
+        self.reset()
+
+    """
+    Discards the API logins and auto-update state, so that the next cycle
+    logs in again and starts over. The circuit breakers and the number of
+    cycles run so far are kept.
+    """
+    def reset(self):
+        if self.tconnect is not None:
+            self.tconnect.logout()
+        invocations = self.autoupdate.autoupdate_invocations if self.autoupdate else 0
+        self.autoupdate = TandemSourceAutoupdate(self.secret, account=self.name)
+        self.autoupdate.autoupdate_invocations = invocations
+
+    def run_cycle(self):
+        if self.tconnect is None:
+            self.tconnect = TConnectApi(self.secret.TCONNECT_EMAIL, self.secret.TCONNECT_PASSWORD, self.secret.TCONNECT_REGION, secret=self.secret)
+        if self.nightscout is None:
+            self.nightscout = NightscoutApi(self.secret.NS_URL, self.secret.NS_SECRET, skip_verify=self.secret.NS_SKIP_TLS_VERIFY, ignore_conn_errors=self.secret.NS_IGNORE_CONN_ERRORS)
+
+        return self.autoupdate.cycle(self.tconnect, self.nightscout, self.pretend, features=self.features)
+
+    def finished(self):
+        return self.autoupdate.finished()
+
+
+"""
+Reads the daemon config file, a JSON list with one object per account. Each
+object contains settings with the same names as in .env, plus optional
+"name", "features" and "pretend" keys.
+"""
+def load_accounts(path):
+    with open(path, 'r') as f:
+        config = json.load(f)
+
+    if not isinstance(config, list):
+        raise DaemonConfigError("%s must contain a list of accounts" % path)
+
+    return [DaemonAccount(settings, i) for i, settings in enumerate(config)]
+
+
+class Daemon:
+    """
+    Runs auto-update cycles for many accounts on a shared pool of worker
+    threads. Accounts wait in a heap ordered by the time of their next
+    cycle, so idle accounts only cost their saved state.
+    """
+    def __init__(self, accounts, workers=4, clock=time.time):
+        self.accounts = accounts
+        self.workers = workers
+        self.clock = clock
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._stopped = False
+
+    def schedule(self, account, at):
+        with self._cond:
+            heapq.heappush(self._queue, (at, next(self._order), account))
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    """
+    Runs until stop() is called, or every account has reached
+    AUTOUPDATE_MAX_LOOP_INVOCATIONS.
+    """
+    def run(self):
+        logger.info("Starting daemon for %d accounts with %d workers" % (len(self.accounts), self.workers))
+        now = self.clock()
+        for account in self.accounts:
+            self.schedule(account, now)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='tconnectsync') as pool:
+            while True:
+                with self._cond:
+                    if self._stopped or (not self._queue and not self._running):
+                        break
+
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+
+                    at = self._queue[0][0]
+                    wait = at - self.clock()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+
+                    _, _, account = heapq.heappop(self._queue)
+                    self._running += 1
+
+                pool.submit(self._run, account)
+
+        return 0
+
+    def _run(self, account):
+        thread = threading.current_thread()
+        thread_name = thread.name
+        thread.name = account.name
+
+        try:
+            try:
+                exit_code, sleep_secs = account.run_cycle()
+            except Exception:
+                logger.exception("Auto-update cycle failed, restarting")
+                exit_code, sleep_secs = 1, 0
+
+            if exit_code is not None:
+                logger.warning("Restarting auto-update (exit code %d)" % exit_code)
+                account.reset()
+                sleep_secs = account.secret.AUTOUPDATE_DEFAULT_SLEEP_SECONDS
+
+            # Failed cycles count too, so a failing account still stops
+            account.autoupdate.autoupdate_invocations += 1
+
+            if account.finished():
+                logger.info("Reached AUTOUPDATE_MAX_LOOP_INVOCATIONS, no longer scheduling")
+            else:
+                self.schedule(account, self.clock() + sleep_secs)
+        finally:
+            thread.name = thread_name
+            with self._cond:
+                self._running -= 1
+                self._cond.notify()
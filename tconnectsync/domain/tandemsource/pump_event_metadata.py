@@ -0,0 +1,55 @@
+import hashlib
+import json
+import logging
+import threading
+
+from .pump_settings import PumpSettings
+
+logger = logging.getLogger(__name__)
+
+"""
+A single pump_event_metadata() response, fetched once per sync cycle and shared
+between ChooseDevice and UpdateProfiles so the (large) payload is only
+requested and decoded once.
+"""
+class PumpEventMetadataSnapshot:
+    # Parsed PumpSettings per tconnectDeviceId, keyed by a hash of the raw
+    # settings, so unchanged settings are not re-parsed on every cycle.
+    _parsed_settings = {}
+    _parsed_settings_lock = threading.Lock()
+
+    def __init__(self, metadata):
+        self.metadata = metadata or []
+
+    @staticmethod
+    def fetch(tconnect):
+        return PumpEventMetadataSnapshot(tconnect.tandemsource.pump_event_metadata())
+
+    def for_device(self, tconnect_device_id):
+        for m in self.metadata:
+            if m['tconnectDeviceId'] == tconnect_device_id:
+                return m
+        return None
+
+    def raw_settings(self, tconnect_device_id):
+        pump_meta = self.for_device(tconnect_device_id)
+        if not pump_meta:
+            return None
+        return (pump_meta.get("lastUpload") or {}).get("settings")
+
+    def pump_settings(self, tconnect_device_id):
+        raw_settings = self.raw_settings(tconnect_device_id)
+        if not raw_settings:
+            return None
+
+        digest = hashlib.sha256(json.dumps(raw_settings, sort_keys=True).encode()).hexdigest()
+        with self._parsed_settings_lock:
+            cached = self._parsed_settings.get(tconnect_device_id)
+        if cached and cached[0] == digest:
+            logger.debug("Pump settings unchanged for %s (sha256 %s), reusing parsed settings" % (tconnect_device_id, digest))
+            return cached[1]
+
+        pump_settings = PumpSettings.from_dict(raw_settings)
+        with self._parsed_settings_lock:
+            self._parsed_settings[tconnect_device_id] = (digest, pump_settings)
+        return pump_settings
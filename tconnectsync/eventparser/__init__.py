@@ -0,0 +1,5 @@
+from .. import secret
+
+if secret.EVENT_SCHEMA == 'compact':
+    from . import compact
+    compact.install()
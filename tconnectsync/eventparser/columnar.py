@@ -0,0 +1,115 @@
+import collections
+import struct
+
+from .raw_event import EVENT_LEN
+from .build_events import TYPE_TO_STRUCT
+from .compact import schema
+from .transforms import uniqueMemberNames
+
+STRUCT_TO_TYPE = {v: k for k, v in TYPE_TO_STRUCT.items()}
+
+"""
+Returns a struct which reads a single field of the given format at the
+given offset from each event in a buffer of whole events.
+"""
+def _column_struct(fmt, offset):
+    size = struct.calcsize(fmt)
+    return struct.Struct('>%dx%s%dx' % (offset, fmt[1:], EVENT_LEN - offset - size))
+
+SOURCE_AND_ID = _column_struct('>H', 0)
+TIMESTAMP = _column_struct('>I', 2)
+SEQ_NUM = _column_struct('>I', 6)
+
+
+class EventColumns:
+    """
+    The events of a single type, decoded into one list per field rather
+    than one object per event: source, seqNum and timestampRaw from the
+    header, each field of the event under the same name as on its event
+    class, and the enums, bitmasks and ratios resolved from those fields.
+
+    types maps each column to its type: one of the events.json field
+    types, 'enum' (the enum member name, or None), 'bitmask' (a tuple of
+    member names) or 'float64'.
+    """
+    def __init__(self, event_schema, data):
+        self.schema = event_schema
+        self.data = data
+        self.columns = collections.OrderedDict()
+        self.types = collections.OrderedDict()
+
+        self._add('source', 'uint8', [v >> 12 for v, in SOURCE_AND_ID.iter_unpack(data)])
+        self._add('seqNum', 'uint32', [v for v, in SEQ_NUM.iter_unpack(data)])
+        self._add('timestampRaw', 'uint32', [v for v, in TIMESTAMP.iter_unpack(data)])
+
+        for name, st, offset in event_schema.fields:
+            self._add(name, STRUCT_TO_TYPE[st.format], [v for v, in _column_struct(st.format, offset).iter_unpack(data)])
+
+        for kind, name_fmt, arg in event_schema.transforms:
+            RESOLVERS[kind](self, name_fmt, arg)
+
+    @property
+    def id(self):
+        return self.schema.id
+
+    @property
+    def name(self):
+        return self.schema.class_name
+
+    def __len__(self):
+        return len(self.data) // EVENT_LEN
+
+    def _add(self, name, type, values):
+        self.columns[name] = values
+        self.types[name] = type
+
+    def _resolve_enum(self, name_fmt, tx):
+        members = {int(k): v for k, v in uniqueMemberNames(tx).items()}
+        self._add(name_fmt, 'enum', [members.get(v) for v in self.columns[name_fmt + 'Raw']])
+
+    def _resolve_bitmask(self, name_fmt, tx):
+        bits = [(1 << int(k), v) for k, v in uniqueMemberNames(tx).items()]
+        raw = self.columns[name_fmt + 'Raw']
+        names = {v: tuple(name for bit, name in bits if v & bit) for v in set(raw)}
+        self._add(name_fmt, 'bitmask', [names[v] for v in raw])
+
+    def _resolve_ratio(self, name_fmt, ratio):
+        self._add(name_fmt, 'float64', [v * ratio for v in self.columns[name_fmt + 'Raw']])
+
+    def _resolve_battery_charge_percent(self, name_fmt, arg):
+        msb, lsb = self.columns['batterychargepercentmsbRaw'], self.columns['batterychargepercentlsbRaw']
+        self._add('batteryChargePercent', 'float64', [(256*(m-14)+l)/(3*256) for m, l in zip(msb, lsb)])
+
+RESOLVERS = {
+    'enum': EventColumns._resolve_enum,
+    'bitmask': EventColumns._resolve_bitmask,
+    'ratio': EventColumns._resolve_ratio,
+    'battery_charge_percent': EventColumns._resolve_battery_charge_percent,
+}
+
+
+"""
+Decodes raw pump history (as returned by decode_raw_events) into an
+EventColumns per event type, keyed by event ID. Events are grouped by
+type once, and each field is then read for every event of the type with
+a single struct.iter_unpack call. Also returns the number of events of
+each type missing from events.json, by event ID.
+"""
+def decode_columns(data, event_ids=None):
+    data = memoryview(data)[:len(data) - len(data) % EVENT_LEN]
+    by_id = collections.defaultdict(list)
+    for i, (source_and_id,) in enumerate(SOURCE_AND_ID.iter_unpack(data)):
+        by_id[source_and_id & 0x0FFF].append(i)
+
+    known = schema()
+    columns = {}
+    unknown = {}
+    for event_id, indexes in by_id.items():
+        if event_ids is not None and event_id not in event_ids:
+            continue
+        if event_id not in known:
+            unknown[event_id] = len(indexes)
+            continue
+        buf = b''.join([data[i*EVENT_LEN:(i+1)*EVENT_LEN] for i in indexes])
+        columns[event_id] = EventColumns(known[event_id], buf)
+    return columns, unknown
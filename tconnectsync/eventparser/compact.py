@@ -0,0 +1,276 @@
+import functools
+import json
+import logging
+import os
+import struct
+import sys
+import types
+
+from collections import namedtuple
+from collections.abc import Mapping
+from enum import Enum, IntFlag
+
+from .raw_event import RawEvent, EVENT_LEN
+from .build_events import TYPE_TO_STRUCT, HEADER_SIZE, eventNameFormat, fieldNameFormat
+from .transforms import enumNameFormat, uniqueMemberNames
+from .static_dicts import ALERTS_DICT, ALARMS_DICT, CGM_ALERTS_DICT
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILES = ['events.json', 'custom_events.json']
+
+DICTIONARIES = {
+    'alerts': ALERTS_DICT,
+    'alarms': ALARMS_DICT,
+    'dalerts': CGM_ALERTS_DICT,
+}
+
+EventSchema = namedtuple('EventSchema', ['id', 'name', 'class_name', 'fields', 'transforms'])
+
+
+def _compile(event_id, event_def):
+    fields = []
+    transforms = []
+    for name, field in event_def['data'].items():
+        name_fmt = fieldNameFormat(name)
+        suffix = 'Raw' if 'transform' in field and name[-3:] != 'Raw' else ''
+        fields.append((name_fmt + suffix, struct.Struct(TYPE_TO_STRUCT[field['type']]), HEADER_SIZE + field['offset']))
+        for kind, arg in field.get('transform', []):
+            if kind == 'dictionary':
+                if arg not in DICTIONARIES:
+                    continue
+                kind, arg = 'enum', DICTIONARIES[arg]
+            transforms.append((kind, name_fmt, arg))
+    return EventSchema(event_id, event_def['name'], eventNameFormat(event_def['name']), tuple(fields), tuple(transforms))
+
+"""
+Returns the compiled schema of every event type, keyed by event ID. It is
+compiled once per process.
+"""
+@functools.lru_cache(maxsize=None)
+def schema():
+    defs = {}
+    for name in SCHEMA_FILES:
+        with open(os.path.join(os.path.dirname(__file__), name)) as f:
+            defs.update(json.load(f)['events'])
+    return {int(k): _compile(int(k), v) for k, v in defs.items()}
+
+
+class CompactEvent:
+    """
+    Base class of the event types created from the schema. Each subclass
+    has a slot per field of its event, and a build method created by
+    build_class.
+    """
+    __slots__ = ('raw',)
+    ID = None
+    NAME = None
+    _FIELDS = ()
+
+    def __init__(self, raw, *args, **kwargs):
+        self.raw = raw
+        names = [f[0] for f in self._FIELDS]
+        for name, value in zip(names, args):
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            if name not in names:
+                raise TypeError("%s got an unexpected field %s" % (type(self).__name__, name))
+            setattr(self, name, value)
+
+    def _values(self):
+        return tuple(getattr(self, f[0], None) for f in self._FIELDS)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.raw == other.raw and self._values() == other._values()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            ['raw=%r' % self.raw] + ['%s=%r' % (f[0], getattr(self, f[0], None)) for f in self._FIELDS]))
+
+    @property
+    def eventTimestamp(self):
+        return self.raw.timestamp
+
+    @property
+    def seqNum(self):
+        return self.raw.seqNum
+
+    @property
+    def eventId(self):
+        return self.ID
+
+    def todict(self):
+        ret = dict(
+            id=self.ID,
+            name=self.NAME,
+            seqNum=self.seqNum,
+            eventTimestamp=str(self.eventTimestamp),
+        )
+        for name, _, _ in self._FIELDS:
+            ret[name] = getattr(self, name)
+        return ret
+
+
+class _LazyType:
+    """
+    Creates an Enum or IntFlag class the first time it is looked up on an
+    event class, since most of them are never used.
+    """
+    def __init__(self, name, create):
+        self.name = name
+        self.create = create
+
+    def __get__(self, obj, cls):
+        value = self.create()
+        setattr(cls, self.name, value)
+        return value
+
+def _enum_property(name_fmt, type_name):
+    def getter(self):
+        try:
+            return getattr(self, type_name)(getattr(self, name_fmt + 'Raw'))
+        except ValueError as e:
+            logger.error("Invalid %sRaw in %s for %s" % (name_fmt, type_name, self))
+            logger.error(e)
+            return None
+    return property(getter)
+
+def _transform_enum(name_fmt, tx):
+    prefix = enumNameFormat(name_fmt)
+    members = uniqueMemberNames(tx)
+    return {
+        prefix + 'Map': {str(k): v for k, v in tx.items()},
+        prefix + 'Enum': _LazyType(prefix + 'Enum', lambda: Enum(prefix + 'Enum', [(members[k], int(k)) for k in tx if k in members], module=__name__)),
+        name_fmt: _enum_property(name_fmt, prefix + 'Enum'),
+    }
+
+def _transform_bitmask(name_fmt, tx):
+    prefix = enumNameFormat(name_fmt)
+    members = uniqueMemberNames(tx)
+    return {
+        prefix + 'Map': {str(k): v for k, v in tx.items()},
+        prefix + 'Bitmask': _LazyType(prefix + 'Bitmask', lambda: IntFlag(prefix + 'Bitmask', [(members[k], 2**int(k)) for k in tx if k in members], module=__name__)),
+        name_fmt: _enum_property(name_fmt, prefix + 'Bitmask'),
+    }
+
+def _transform_ratio(name_fmt, ratio):
+    return {name_fmt: property(lambda self: getattr(self, name_fmt + 'Raw') * ratio)}
+
+def _transform_battery_charge_percent(name_fmt, arg):
+    return {'batteryChargePercent': property(lambda self: (256*(self.batterychargepercentmsbRaw-14)+self.batterychargepercentlsbRaw)/(3*256))}
+
+TRANSFORMS = {
+    'enum': _transform_enum,
+    'bitmask': _transform_bitmask,
+    'ratio': _transform_ratio,
+    'battery_charge_percent': _transform_battery_charge_percent,
+}
+
+
+def build_class(event_schema, module_name=__name__):
+    namespace = {
+        '__slots__': tuple(f[0] for f in event_schema.fields),
+        '__doc__': '%d: %s' % (event_schema.id, event_schema.name),
+        '__module__': module_name,
+        'ID': event_schema.id,
+        'NAME': event_schema.name,
+        '_FIELDS': event_schema.fields,
+    }
+    for kind, name_fmt, arg in event_schema.transforms:
+        namespace.update(TRANSFORMS[kind](name_fmt, arg))
+    namespace['build'] = _build_method(event_schema.fields)
+    return type(event_schema.class_name, (CompactEvent,), namespace)
+
+"""
+Returns a build classmethod which unpacks each field in turn, like the
+generated build methods do, which is faster than looping over the fields
+for every event.
+"""
+def _build_method(fields):
+    lines = [
+        'def build(cls, raw):',
+        '    event = new(cls)',
+        '    event.raw = RawEvent.build(raw)',
+        '    data = raw[:EVENT_LEN]',
+    ] + [
+        '    event.%s, = unpack%d(data, %d)' % (name, i, offset) for i, (name, _, offset) in enumerate(fields)
+    ] + [
+        '    return event',
+    ]
+    namespace = {'new': object.__new__, 'RawEvent': RawEvent, 'EVENT_LEN': EVENT_LEN}
+    namespace.update({'unpack%d' % i: st.unpack_from for i, (_, st, _) in enumerate(fields)})
+    exec('\n'.join(lines), namespace)
+    return classmethod(namespace['build'])
+
+
+class _LazyClasses(Mapping):
+    def __init__(self, module, keys):
+        self._module = module
+        self._keys = keys
+
+    def __getitem__(self, key):
+        return getattr(self._module, self._keys[key])
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class CompactEventsModule(types.ModuleType):
+    """
+    A table-driven stand-in for the generated events module. Instead of
+    importing thousands of lines of generated dataclasses, events.json and
+    custom_events.json are compiled into a small schema (struct formats and
+    offsets, enum tables), and the class for each event type is only
+    created the first time it is looked up, by class name or through
+    EVENT_IDS or EVENT_NAMES.
+
+    The classes have the same names, fields, Map dicts, Enum and Bitmask
+    classes and properties as the generated ones, so the rest of
+    tconnectsync works the same with either.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.EVENT_LEN = EVENT_LEN
+        self.RawEvent = RawEvent
+        self.logger = logger
+        for k, v in TYPE_TO_STRUCT.items():
+            setattr(self, k.upper(), v)
+
+        self._schema_by_class = {s.class_name: s for s in schema().values()}
+        self.EVENT_IDS = _LazyClasses(self, {s.id: s.class_name for s in schema().values()})
+        self.EVENT_NAMES = _LazyClasses(self, {s.name: s.class_name for s in schema().values()})
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name not in self.__dict__.get('_schema_by_class', {}):
+            raise AttributeError("module %r has no attribute %r" % (self.__name__, name))
+        clazz = build_class(self._schema_by_class[name], self.__name__)
+        setattr(self, name, clazz)
+        return clazz
+
+
+MODULE_NAME = __name__.rsplit('.', 1)[0] + '.events'
+
+"""
+Makes the compact schema stand in for the generated events module. Must
+run before anything imports tconnectsync.eventparser.events.
+"""
+def install():
+    module = sys.modules.get(MODULE_NAME)
+    if isinstance(module, CompactEventsModule):
+        return module
+    if module is not None:
+        raise RuntimeError("%s was imported before the compact event schema was installed" % MODULE_NAME)
+    module = CompactEventsModule(MODULE_NAME)
+    sys.modules[MODULE_NAME] = module
+    setattr(sys.modules[__name__.rsplit('.', 1)[0]], 'events', module)
+    return module
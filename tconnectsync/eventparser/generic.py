@@ -8,14 +8,17 @@ from .events import EVENT_IDS
 from .utils import batched
 
 
-def Event(x):
+def Event(x, timezone=None):
     raw_event = RawEvent.build(x)
     if not raw_event.id in EVENT_IDS:
+        raw_event.timezone = timezone
         return raw_event
 
-    return EVENT_IDS[raw_event.id].build(x)
+    event = EVENT_IDS[raw_event.id].build(x)
+    event.raw.timezone = timezone
+    return event
 
-Events = lambda x: (Event(bytearray(e)) for e in batched(x, EVENT_LEN))
+Events = lambda x, timezone=None: (Event(bytearray(e), timezone) for e in batched(x, EVENT_LEN))
 
 def decode_raw_events(raw):
     return base64.b64decode(raw)
\ No newline at end of file
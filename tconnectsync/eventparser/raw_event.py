@@ -1,7 +1,7 @@
 import struct
 import arrow
 
-from ..secret import TIMEZONE_NAME
+from .. import secret
 
 from dataclasses import dataclass
 
@@ -34,6 +34,10 @@ class RawEvent:
     seqNum: int
     raw: bytearray
 
+    # Time zone set on the pump; TIMEZONE_NAME from the secret module if unset.
+    # Not a dataclass field, so it isn't part of equality or todict().
+    timezone = None
+
     @staticmethod
     def build(raw):
         source_and_id, = struct.unpack_from(UINT16, raw[:EVENT_LEN], 0)
@@ -54,7 +58,13 @@ class RawEvent:
         # but represent the user's time zone setting. So we keep the time
         # referenced on them, but force the timezone to what the user
         # requests via the TZ secret.
-        return arrow.get(TANDEM_EPOCH + self.timestampRaw, tzinfo='UTC').replace(tzinfo=TIMEZONE_NAME)
+        timezone = self.timezone or secret.TIMEZONE_NAME
+        # Processors read the timestamp many times, so it is built only once.
+        cached = self.__dict__.get('_timestamp')
+        if cached is None or cached[0] != (self.timestampRaw, timezone):
+            cached = ((self.timestampRaw, timezone), arrow.get(TANDEM_EPOCH + self.timestampRaw, tzinfo='UTC').replace(tzinfo=timezone))
+            self._timestamp = cached
+        return cached[1]
 
     @property
     def eventId(self):
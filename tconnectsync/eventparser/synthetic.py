@@ -0,0 +1,166 @@
+import base64
+import datetime
+import json
+import os
+import random
+import struct
+
+from .raw_event import EVENT_LEN, TANDEM_EPOCH
+from .build_events import TYPE_TO_STRUCT, HEADER_SIZE, fieldNameFormat
+from . import events as eventtypes
+
+
+def _load_schema():
+    schema = {}
+    for name in ('events.json', 'custom_events.json'):
+        with open(os.path.join(os.path.dirname(__file__), name)) as f:
+            schema.update(json.load(f)['events'])
+
+    # Field offsets and struct formats, keyed by the generated dataclass's
+    # attribute name for each field
+    fields = {}
+    for event_id, event_def in schema.items():
+        fields[int(event_id)] = {
+            fieldNameFormat(name) + ('Raw' if 'transform' in field and name[-3:] != 'Raw' else ''): (TYPE_TO_STRUCT[field['type']], HEADER_SIZE + field['offset'])
+            for name, field in event_def['data'].items()
+        }
+    return fields
+
+FIELDS = _load_schema()
+
+
+"""
+Returns the 26 bytes of a pump history log event of the given type, built
+from the field layout in events.json. Fields are given by the attribute
+names of the event's dataclass, and default to 0.
+"""
+def encode_event(event_type, timestamp_raw, seq_num, source=0, **fields):
+    layout = FIELDS[event_type.ID]
+    raw = bytearray(EVENT_LEN)
+    struct.pack_into('>HII', raw, 0, (source << 12) | event_type.ID, int(timestamp_raw), seq_num)
+    for name, value in fields.items():
+        if name not in layout:
+            raise TypeError("%s has no field %s" % (event_type.__name__, name))
+        fmt, offset = layout[name]
+        struct.pack_into(fmt, raw, offset, value)
+    return bytes(raw)
+
+"""
+Returns the raw event timestamp for a naive datetime in the pump's time zone.
+"""
+def timestamp_raw(dt):
+    return int((dt - datetime.datetime.utcfromtimestamp(TANDEM_EPOCH)).total_seconds())
+
+
+class SyntheticPump:
+    """
+    Generates a plausible pump history: basal deliveries and CGM readings
+    every five minutes, meal boluses, overnight sleep mode, exercise mode
+    every other evening, and a cartridge change every three days. Events
+    are in time order, numbered from 1. The same seed always gives the
+    same history.
+    """
+    def __init__(self, start=datetime.datetime(2024, 1, 1), seed=0, interval_minutes=5):
+        self.start = start
+        self.seed = seed
+        self.interval = datetime.timedelta(minutes=interval_minutes)
+
+    MEAL_HOURS = (7.5, 12.5, 18.5)
+
+    def events(self, days):
+        rng = random.Random(self.seed)
+        seq = 0
+        bolus_id = 0
+        rate = 800
+        bg = 120
+        end = self.start + datetime.timedelta(days=days)
+
+        out = []
+        def add_all(pending):
+            nonlocal seq
+            # sorted() is stable, so events at the same time keep their order
+            for dt, event_type, fields in sorted(pending, key=lambda p: p[0]):
+                seq += 1
+                out.append(encode_event(event_type, timestamp_raw(dt), seq, **fields))
+
+        day = 0
+        while self.start + datetime.timedelta(days=day) < end:
+            midnight = self.start + datetime.timedelta(days=day)
+            t = midnight
+            next_day = midnight + datetime.timedelta(days=1)
+            at = lambda hours: midnight + datetime.timedelta(hours=hours)
+
+            meals = [at(h) for h in self.MEAL_HOURS]
+            cartridge_change = at(20) if day % 3 == 0 else None
+            mode_changes = [
+                (at(23), dict(requestedactionRaw=1, currentusermodeRaw=1, activesleepscheduleRaw=1)),
+            ]
+            if day > 0:
+                # Ends the sleep started the previous evening
+                mode_changes.append((at(7), dict(requestedactionRaw=2, previoususermodeRaw=1)))
+            if day % 2 == 1:
+                mode_changes += [
+                    (at(17), dict(requestedactionRaw=3, currentusermodeRaw=2, exercisechoiceRaw=0)),
+                    (at(18), dict(requestedactionRaw=4, previoususermodeRaw=2)),
+                ]
+
+            while t < next_day and t < end:
+                in_interval = lambda dt: dt is not None and t <= dt < t + self.interval
+                pending = []
+
+                # Control-IQ style rate changes, holding for a few intervals
+                if rng.random() < 0.3:
+                    rate = max(0, min(3000, rate + rng.choice((-100, -50, 50, 100))))
+                pending.append((t, eventtypes.LidBasalDelivery, dict(commandedRateSourceRaw=3, commandedRate=rate, profileBasalRate=800, algorithmRate=rate)))
+
+                bg = max(40, min(400, bg + rng.randint(-8, 8)))
+                pending.append((t + datetime.timedelta(seconds=30), eventtypes.LidCgmDataG7, dict(currentglucosedisplayvalue=bg, egvTimestamp=timestamp_raw(t), interval=5)))
+
+                for meal in filter(in_interval, meals):
+                    bolus_id += 1
+                    carbs = rng.randint(20, 80)
+                    units = round(carbs / 10.0, 2)
+                    pending += [
+                        (meal, eventtypes.LidBolusRequestedMsg1, dict(bolusid=bolus_id, bolustypeRaw=1, carbamount=carbs, BG=bg, carbratioRaw=10000)),
+                        (meal, eventtypes.LidBolusRequestedMsg2, dict(bolusid=bolus_id, standardpercent=100, targetbg=110, ISF=40)),
+                        (meal, eventtypes.LidBolusRequestedMsg3, dict(bolusid=bolus_id, foodbolussize=units, totalbolussize=units)),
+                        (meal + datetime.timedelta(minutes=2), eventtypes.LidBolusCompleted, dict(bolusid=bolus_id, completionstatusRaw=3, insulindelivered=units, insulinrequested=units)),
+                    ]
+
+                if in_interval(cartridge_change):
+                    pending += [
+                        (cartridge_change, eventtypes.LidCartridgeFilled, dict(insulinvolume=200, v2Volume=200.0)),
+                        (cartridge_change + datetime.timedelta(minutes=2), eventtypes.LidCannulaFilled, dict(primesize=0.3)),
+                    ]
+
+                for dt, fields in mode_changes:
+                    if in_interval(dt):
+                        pending.append((dt, eventtypes.LidAaUserModeChange, fields))
+
+                add_all(pending)
+                t += self.interval
+            day += 1
+
+        return out
+
+    """
+    Returns the history as the base64 blob returned by the Tandem Source
+    pump events endpoint.
+    """
+    def blob(self, days):
+        return base64.b64encode(b''.join(self.events(days))).decode()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Writes synthetic pump history, for replay with tconnectsync --from-file.")
+    parser.add_argument('path', type=str, help='The file to write.')
+    parser.add_argument('--days', type=int, default=30, help='The number of days of history.')
+    parser.add_argument('--start', type=str, default='2024-01-01', help='The first day of history, in the pump\'s time zone.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--base64', action='store_const', const=True, default=False, help='Writes base64, as returned by Tandem Source, rather than binary events.')
+    args = parser.parse_args()
+
+    pump = SyntheticPump(start=datetime.datetime.fromisoformat(args.start), seed=args.seed)
+    with open(args.path, 'w' if args.base64 else 'wb') as f:
+        f.write(pump.blob(args.days) if args.base64 else b''.join(pump.events(args.days)))
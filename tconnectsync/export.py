@@ -0,0 +1,159 @@
+import os
+import logging
+
+from .eventparser.columnar import decode_columns
+from .eventparser.generic import decode_raw_events
+from .eventparser.raw_event import TANDEM_EPOCH
+from .util.timing import NO_TIMINGS
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    # pyarrow.dataset format, file extension
+    'parquet': ('parquet', 'parquet'),
+    'arrow': ('ipc', 'arrow'),
+}
+
+DEFAULT_CHUNK_DAYS = 30
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class ExportUnavailableError(RuntimeError):
+    def __str__(self):
+        return "%s: %s" % (self.__class__.__name__, super().__str__())
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+    except ImportError:
+        raise ExportUnavailableError("pyarrow is not installed, install it with: pip install pyarrow")
+    return pyarrow
+
+
+"""
+Builds an Arrow table from the EventColumns of one event type. Besides
+the event's own columns, it has an eventTimestamp column (the pump's
+local time, in the given time zone) and a date column (the local date)
+to partition on.
+"""
+def to_table(event_columns, timezone):
+    pa = _pyarrow()
+    types = {
+        'uint8': pa.uint8(),
+        'int8': pa.int8(),
+        'uint16': pa.uint16(),
+        'int16': pa.int16(),
+        'uint32': pa.uint32(),
+        'float32': pa.float32(),
+        'float64': pa.float64(),
+        'enum': pa.dictionary(pa.int16(), pa.string()),
+        'bitmask': pa.list_(pa.string()),
+    }
+
+    # Raw timestamps are seconds since the Tandem epoch in the pump's local time
+    local_seconds = [TANDEM_EPOCH + t for t in event_columns.columns['timestampRaw']]
+    local_time = pa.array(local_seconds, pa.timestamp('s'))
+    names = ['eventTimestamp', 'date']
+    arrays = [
+        pa.compute.assume_timezone(local_time, timezone, ambiguous='earliest', nonexistent='earliest'),
+        pa.array([s // SECONDS_PER_DAY for s in local_seconds], pa.int32()).cast(pa.date32()),
+    ]
+    for name, values in event_columns.columns.items():
+        type = types[event_columns.types[name]]
+        names.append(name)
+        if pa.types.is_dictionary(type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode().cast(type))
+        else:
+            arrays.append(pa.array(values, type))
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+"""
+Writes each table under its own directory of path, partitioned by day
+(as date=YYYY-MM-DD directories, which DuckDB, pandas and Spark read as
+a date column). Days which already exist in a table's directory are
+replaced.
+"""
+def write_tables(tables, path, fmt='parquet'):
+    pa = _pyarrow()
+    dataset_format, extension = FORMATS[fmt]
+    partitioning = pa.dataset.partitioning(pa.schema([('date', pa.date32())]), flavor='hive')
+    for name, table in tables.items():
+        pa.dataset.write_dataset(
+            table,
+            os.path.join(path, name),
+            format=dataset_format,
+            partitioning=partitioning,
+            basename_template='part-{i}.%s' % extension,
+            existing_data_behavior='delete_matching',
+            max_partitions=max(1, len(pa.compute.unique(table['date']))))
+
+
+"""
+Decodes raw pump history and writes every event type it contains to
+path. When min_date and max_date are given, only events on those local
+dates (inclusive) are written. Returns the number of events written for
+each event type, by class name.
+"""
+def export_events(data, path, timezone, fmt='parquet', min_date=None, max_date=None):
+    pa = _pyarrow()
+    columns, unknown = decode_columns(data)
+    if unknown:
+        logger.info("Skipping events with no definition in events.json: %s" % unknown)
+
+    tables = {}
+    for event_columns in columns.values():
+        table = to_table(event_columns, timezone)
+        if min_date is not None:
+            table = table.filter(pa.compute.greater_equal(table['date'], pa.scalar(min_date, pa.date32())))
+        if max_date is not None:
+            table = table.filter(pa.compute.less_equal(table['date'], pa.scalar(max_date, pa.date32())))
+        if table.num_rows:
+            tables[event_columns.name] = table
+
+    write_tables(tables, path, fmt)
+    return {name: table.num_rows for name, table in tables.items()}
+
+
+class ExportTimeRange:
+    """
+    Exports the decoded pump history of a device to Parquet or Arrow IPC
+    files, one table per event type partitioned by day, for analysis
+    outside of Nightscout. Every event type in the history log is
+    fetched, chunk_days at a time.
+    """
+    # Per-stage timings, recorded when profiling
+    timings = NO_TIMINGS
+
+    def __init__(self, tconnect, tconnectDevice, path, secret, fmt='parquet', chunk_days=DEFAULT_CHUNK_DAYS, timings=None):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown export format %s" % fmt)
+        _pyarrow()
+
+        self.tconnect = tconnect
+        self.tconnect_device_id = tconnectDevice["tconnectDeviceId"]
+        self.path = path
+        self.secret = secret
+        self.fmt = fmt
+        self.chunk_days = chunk_days
+        if timings is not None:
+            self.timings = timings
+
+    def export(self, time_start, time_end):
+        from .sync.tandemsource.process import day_chunks
+
+        counts = {}
+        for min_date, max_date, _ in day_chunks(time_start, time_end, self.chunk_days):
+            logger.info("Exporting pump events %s to %s" % (min_date, max_date))
+            with self.timings.stage('tandemsource.download'):
+                raw = self.tconnect.tandemsource.pump_events_raw(self.tconnect_device_id, min_date, max_date, event_ids_filter=None)
+            with self.timings.stage('export.write'):
+                chunk_counts = export_events(decode_raw_events(raw), self.path, self.secret.TIMEZONE_NAME, self.fmt, min_date, max_date)
+            for name, n in chunk_counts.items():
+                counts[name] = counts.get(name, 0) + n
+
+        logger.info("Exported %d events to %s: %s" % (sum(counts.values()), self.path, counts))
+        return counts
@@ -0,0 +1,164 @@
+import collections
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class FakeServer:
+    """
+    Base class of the local stand-ins for the services tconnectsync talks
+    to, which serve requests from a background thread.
+
+    Each request can be delayed by latency seconds (or a random time in a
+    (min, max) range) and answered with error_status instead, at random,
+    error_rate of the time. The random choices are seeded, so a run can be
+    repeated.
+    """
+    # The _Handler subclass which serves requests
+    handler = None
+    name = 'fake'
+
+    def __init__(self, latency=0, error_rate=0, error_status=500, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # Number of requests handled, by the handler's request_key()
+        self.requests = collections.Counter()
+        self.server = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    """
+    Starts serving from a background thread on the given port (any free
+    port if 0), and returns self.
+    """
+    def serve(self, port=0, addr='127.0.0.1'):
+        handler = type('Handler', (self.handler,), {'fake': self})
+        self.server = ThreadingHTTPServer((addr, port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, name='tconnectsync-%s' % self.name, daemon=True).start()
+        logger.info("Serving %s on %s" % (self.name, self.url))
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.serve() if self.server is None else self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    """
+    Returns the delay and, if the request should fail, the error status
+    for the next request.
+    """
+    def fault(self):
+        with self._lock:
+            latency = self.latency
+            if isinstance(latency, (tuple, list)):
+                latency = self._random.uniform(*latency)
+            failed = self.error_rate and self._random.random() < self.error_rate
+        return latency, self.error_status if failed else None
+
+    def count_request(self, key):
+        with self._lock:
+            self.requests[key] += 1
+
+    """
+    Blocks until interrupted, for servers run from the command line.
+    """
+    def wait(self):
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.shutdown()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = 'HTTP/1.1'
+
+    """
+    Returns the key the request is counted under in FakeServer.requests.
+    """
+    def request_key(self, method, path):
+        return (method, '/'.join(path))
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+    def handle_request(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        path = [p for p in url.path.split('/') if p]
+        # Always read the body, so the connection can be reused
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        latency, error_status = self.fake.fault()
+        if latency:
+            time.sleep(latency)
+
+        self.fake.count_request(self.request_key(method, path))
+        if error_status:
+            return self.respond(error_status, {'status': error_status, 'message': 'Injected error'})
+        self.route(method, path, url.query, body)
+
+    def respond(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8') if status != 304 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def log_message(self, format, *args):
+        logger.debug("%s: %s" % (self.fake.name, format % args))
+
+
+"""
+Adds the --port, --address, --latency, --error-rate, --error-status and
+--seed options of a stand-in server run from the command line.
+"""
+def add_server_arguments(parser, port):
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--address', type=str, default='127.0.0.1')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0], help='Seconds to delay each request by, or a minimum and maximum to pick a delay from at random.')
+    parser.add_argument('--error-rate', type=float, default=0, help='The fraction of requests, chosen at random, which fail.')
+    parser.add_argument('--error-status', type=int, default=500, help='The HTTP status of failed requests.')
+    parser.add_argument('--seed', type=int, default=0)
+
+def server_options(args):
+    return dict(
+        latency=args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2]),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
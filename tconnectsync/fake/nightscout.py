@@ -0,0 +1,212 @@
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import urllib.parse
+
+from .common import FakeServer, _Handler, add_server_arguments, server_options
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ['treatments', 'entries', 'devicestatus', 'activity', 'profile']
+
+# The field each collection is sorted on, newest first
+SORT_FIELDS = {
+    'treatments': 'created_at',
+    'entries': 'date',
+    'devicestatus': 'created_at',
+    'activity': 'created_at',
+    'profile': 'startDate',
+}
+
+DEFAULT_COUNT = 10
+
+
+"""
+Parses the query string of a Nightscout API request into the count and a
+list of (field, operator, value) find filters, where operator is None for
+an equality match.
+"""
+def parse_query(query):
+    count = DEFAULT_COUNT
+    filters = []
+    # tconnectsync sends time zone offsets such as +00:00 unescaped
+    for key, value in urllib.parse.parse_qsl(query.replace('+', '%2B'), keep_blank_values=True):
+        if key == 'count':
+            count = int(value)
+        elif key.startswith('find['):
+            parts = key[len('find['):-1].split('][')
+            filters.append((parts[0], parts[1] if len(parts) > 1 else None, value))
+    return count, filters
+
+def _comparable(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return str(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+"""
+Returns whether a document matches the filters. Equality is compared as
+strings, and $gte/$lte as dates or numbers when both sides parse as one,
+so created_at matches whether it is written with a T or a space.
+"""
+def matches(doc, filters):
+    for field, op, value in filters:
+        if field not in doc:
+            return False
+        if op is None:
+            if str(doc[field]) != value:
+                return False
+            continue
+        a, b = _comparable(doc[field]), _comparable(value)
+        if type(a) != type(b):
+            a, b = str(doc[field]), value
+        if op == '$gte' and not a >= b:
+            return False
+        if op == '$lte' and not a <= b:
+            return False
+        if op == '$gt' and not a > b:
+            return False
+        if op == '$lt' and not a < b:
+            return False
+        if op == '$ne' and a == b:
+            return False
+    return True
+
+
+class FakeNightscout(FakeServer):
+    """
+    A local stand-in for the subset of the Nightscout api/v1 which
+    tconnectsync uses, storing documents in memory: GET (with find[...]
+    filters and count) and POST of treatments, entries, devicestatus,
+    activity and profile, PUT and DELETE, profile/current and status.json.
+    Requests are counted by method and collection.
+    """
+    name = 'fake Nightscout'
+
+    def __init__(self, secret=None, latency=0, error_rate=0, error_status=500, seed=0):
+        super().__init__(latency=latency, error_rate=error_rate, error_status=error_status, seed=seed)
+        self.secret = secret
+        self.collections = collections.defaultdict(list)
+        self._next_id = 0
+
+    def authorized(self, headers, query):
+        if not self.secret:
+            return True
+        hashed = hashlib.sha1(self.secret.encode()).hexdigest()
+        return headers.get('api-secret') in (self.secret, hashed) or query.get('api_secret') in (self.secret, hashed)
+
+    def insert(self, collection, doc):
+        with self._lock:
+            self._next_id += 1
+            doc = dict(doc)
+            doc.setdefault('_id', '%024x' % self._next_id)
+            if collection != 'entries':
+                doc.setdefault('created_at', datetime.datetime.now(datetime.timezone.utc).isoformat())
+            self.collections[collection].append(doc)
+            return doc
+
+    def put(self, collection, doc):
+        with self._lock:
+            docs = self.collections[collection]
+            for i, existing in enumerate(docs):
+                if '_id' in doc and existing.get('_id') == doc['_id']:
+                    docs[i] = dict(doc)
+                    return docs[i]
+        return self.insert(collection, doc)
+
+    def find(self, collection, filters=(), count=DEFAULT_COUNT):
+        with self._lock:
+            docs = [d for d in self.collections[collection] if matches(d, filters)]
+        sort_field = SORT_FIELDS[collection]
+        # Newest first, like Nightscout; sorted() is stable, so documents
+        # without the field keep their (reversed) insertion order
+        docs = sorted(reversed(docs), key=lambda d: _sort_key(d.get(sort_field)), reverse=True)
+        return docs[:count] if count else docs
+
+    def delete(self, collection, filters=(), _id=None):
+        with self._lock:
+            before = self.collections[collection]
+            kept = [d for d in before if not ((_id is None or d.get('_id') == _id) and matches(d, filters))]
+            self.collections[collection] = kept
+            return len(before) - len(kept)
+
+    def status(self):
+        return {
+            'status': 'ok',
+            'name': 'nightscout',
+            'version': '15.0.2',
+            'serverTime': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'apiEnabled': True,
+            'careportalEnabled': True,
+        }
+
+def _sort_key(value):
+    value = _comparable(value) if value is not None else None
+    return (value is not None, isinstance(value, str), value if value is not None else 0)
+
+
+class _NightscoutHandler(_Handler):
+    def request_key(self, method, path):
+        if path[:2] == ['api', 'v1'] and len(path) > 2:
+            return (method, path[2].rsplit('.json', 1)[0])
+        return super().request_key(method, path)
+
+    def route(self, method, path, query_string, data):
+        query = dict(urllib.parse.parse_qsl(query_string.replace('+', '%2B')))
+        if path[:2] != ['api', 'v1'] or len(path) < 3:
+            return self.respond(404, {'status': 404, 'message': 'Not found'})
+        collection = path[2].rsplit('.json', 1)[0]
+
+        if collection == 'status':
+            return self.respond(200, self.fake.status())
+        if collection not in COLLECTIONS:
+            return self.respond(404, {'status': 404, 'message': 'Not found'})
+        if not self.fake.authorized(self.headers, query):
+            return self.respond(401, {'status': 401, 'message': 'Unauthorized'})
+
+        count, filters = parse_query(query_string)
+        if method == 'GET':
+            if collection == 'profile' and path[3:] == ['current']:
+                profiles = self.fake.find('profile', count=1)
+                return self.respond(200, profiles[0] if profiles else None)
+            return self.respond(200, self.fake.find(collection, filters, count))
+
+        if method == 'DELETE':
+            n = self.fake.delete(collection, filters, _id=path[3] if len(path) > 3 else None)
+            return self.respond(200, {'n': n, 'ok': 1})
+
+        try:
+            body = json.loads(data or b'null')
+        except ValueError:
+            return self.respond(400, {'status': 400, 'message': 'Invalid JSON'})
+        docs = body if isinstance(body, list) else [body]
+        if not all(isinstance(d, dict) for d in docs):
+            return self.respond(400, {'status': 400, 'message': 'Expected an object or array of objects'})
+
+        if method == 'POST':
+            return self.respond(200, [self.fake.insert(collection, d) for d in docs])
+        return self.respond(200, [self.fake.put(collection, d) for d in docs])
+
+FakeNightscout.handler = _NightscoutHandler
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the Nightscout API used by tconnectsync, storing uploads in memory.")
+    add_server_arguments(parser, port=1337)
+    parser.add_argument('--secret', type=str, default=None, help='The API secret to require. By default, any request is accepted.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+    FakeNightscout(args.secret, **server_options(args)).serve(args.port, args.address).wait()
@@ -0,0 +1,247 @@
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+import arrow
+
+from ..api.common import RetryPolicy
+from ..api.replay import select_events
+from ..api.tandemsource import TandemSourceApi
+from ..eventparser.synthetic import SyntheticPump, timestamp_raw
+from .common import FakeServer, _Handler, add_server_arguments, server_options
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN = 'fake-access-token'
+DEFAULT_PUMPER_ID = '1234-fake-pumper'
+
+
+class SimulatedClock:
+    """
+    The pump's local time (as a naive datetime) in a FakeTandemSource,
+    starting at start (by default, the current time) and running speed
+    times faster than real time. advance() jumps it forward, so tests can
+    simulate hours of pump uploads without waiting.
+    """
+    def __init__(self, start=None, speed=1.0):
+        self.start = start or datetime.datetime.now()
+        self.speed = speed
+        self._started = time.monotonic()
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            elapsed = (time.monotonic() - self._started) * self.speed + self._offset
+        return self.start + datetime.timedelta(seconds=elapsed)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._offset += seconds
+
+
+class FakePump:
+    """
+    A pump on a FakeTandemSource account, whose history is generated by a
+    SyntheticPump from midnight days before start, and extended as the
+    clock passes the end of the generated history.
+    """
+    def __init__(self, serial_number, tconnect_device_id, start, days, seed=0, model_number='4628'):
+        self.serial_number = serial_number
+        self.tconnect_device_id = tconnect_device_id
+        self.model_number = model_number
+        self.history_start = datetime.datetime.combine(start.date(), datetime.time()) - datetime.timedelta(days=days)
+        self.synthetic = SyntheticPump(start=self.history_start, seed=seed)
+        self._days = 0
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    """
+    Returns the history generated so far, covering at least up to the
+    given time.
+    """
+    def history(self, until):
+        with self._lock:
+            days = (until - self.history_start).days + 1
+            if days > self._days:
+                # A SyntheticPump always gives the same events for the same
+                # days, so regenerating only appends to the history
+                self._days = days + 1
+                self._buffer = b''.join(self.synthetic.events(self._days))
+            return self._buffer
+
+
+class FakeTandemSource(FakeServer):
+    """
+    A local stand-in for the Tandem Source endpoints which tconnectsync
+    reads pump data from: pumpers, pumpeventmetadata (with an ETag, so
+    conditional requests are answered with 304 Not Modified) and
+    pumpevents. It serves synthetic history for any number of pumps, of
+    which the events up to the latest upload are visible: pumps upload
+    every upload_interval_minutes of the clock.
+
+    Requests must carry the Bearer token; login itself is not served, so
+    clients are built with FakeTConnectApi rather than credentials.
+    """
+    name = 'fake Tandem Source'
+
+    def __init__(self, pumps=1, days=30, clock=None, upload_interval_minutes=5, timezone='America/New_York', token=DEFAULT_TOKEN, pumper_id=DEFAULT_PUMPER_ID, seed=0, latency=0, error_rate=0, error_status=500):
+        super().__init__(latency=latency, error_rate=error_rate, error_status=error_status, seed=seed)
+        self.clock = clock or SimulatedClock()
+        self.upload_interval = datetime.timedelta(minutes=upload_interval_minutes)
+        self.timezone = timezone
+        self.token = token
+        self.pumper_id = pumper_id
+
+        serial_numbers = pumps if isinstance(pumps, (list, tuple)) else ['%08d' % (10000001 + i) for i in range(pumps)]
+        start = self.clock.now()
+        self.pumps = [
+            FakePump(str(serial), 100000 + i, start, days, seed=seed + i)
+            for i, serial in enumerate(serial_numbers)
+        ]
+
+    def pump(self, tconnect_device_id):
+        for pump in self.pumps:
+            if str(pump.tconnect_device_id) == str(tconnect_device_id):
+                return pump
+        return None
+
+    """
+    Returns the time of the pumps' latest upload.
+    """
+    def last_upload(self):
+        now = self.clock.now()
+        midnight = datetime.datetime.combine(now.date(), datetime.time())
+        return now - (now - midnight) % self.upload_interval
+
+    def _isoformat(self, dt):
+        return arrow.get(dt, tzinfo=self.timezone).isoformat()
+
+    def metadata(self):
+        last_upload = self.last_upload()
+        return [{
+            'tconnectDeviceId': pump.tconnect_device_id,
+            'serialNumber': pump.serial_number,
+            'modelNumber': pump.model_number,
+            'minDateWithEvents': self._isoformat(pump.history_start),
+            'maxDateWithEvents': self._isoformat(last_upload),
+            'lastUpload': {'lastUploadedAt': self._isoformat(last_upload)},
+            'patientName': 'Synthetic Patient',
+            'softwareVersion': '7.8.1',
+        } for pump in self.pumps]
+
+    """
+    Returns the uploaded events of a pump on the given local dates
+    (inclusive) and with the given IDs, as decoded binary events.
+    """
+    def events(self, tconnect_device_id, min_date=None, max_date=None, event_ids=None):
+        pump = self.pump(tconnect_device_id)
+        last_upload = self.last_upload()
+        return select_events([pump.history(last_upload)], min_date, max_date, event_ids, until=timestamp_raw(last_upload))
+
+    def pumper(self):
+        return {
+            'pumperId': self.pumper_id,
+            'firstName': 'Synthetic',
+            'lastName': 'Patient',
+            'devices': [{'tconnectDeviceId': p.tconnect_device_id, 'serialNumber': p.serial_number} for p in self.pumps],
+        }
+
+
+class _TandemSourceHandler(_Handler):
+    def request_key(self, method, path):
+        return (method, RetryPolicy.endpoint_key('/'.join(path)))
+
+    def route(self, method, path, query_string, data):
+        if method != 'GET':
+            return self.respond(405, {'status': 405, 'message': 'Method not allowed'})
+        if self.headers.get('Authorization') != 'Bearer %s' % self.fake.token:
+            return self.respond(401, {'status': 401, 'message': 'Unauthorized'})
+
+        query = dict(urllib.parse.parse_qsl(query_string))
+        pumper_id = self.fake.pumper_id
+        if path == ['api', 'pumpers', 'pumpers', pumper_id]:
+            return self.respond(200, self.fake.pumper())
+
+        if path == ['api', 'reports', 'reportsfacade', pumper_id, 'pumpeventmetadata']:
+            metadata = self.fake.metadata()
+            etag = '"%s"' % hashlib.sha256(json.dumps(metadata).encode('utf-8')).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                return self.respond(304, None, headers={'ETag': etag})
+            return self.respond(200, metadata, headers={'ETag': etag})
+
+        if path[:5] == ['api', 'reports', 'reportsfacade', 'pumpevents', pumper_id] and len(path) == 6:
+            if not self.fake.pump(path[5]):
+                return self.respond(404, {'status': 404, 'message': 'Unknown device'})
+            event_ids = [int(i) for i in query['eventIds'].split(',')] if query.get('eventIds') else None
+            data = self.fake.events(path[5], query.get('minDate'), query.get('maxDate'), event_ids)
+            return self.respond(200, base64.b64encode(data).decode())
+
+        return self.respond(404, {'status': 404, 'message': 'Not found'})
+
+FakeTandemSource.handler = _TandemSourceHandler
+
+
+class FakeTandemSourceApi(TandemSourceApi):
+    """
+    A TandemSourceApi for a FakeTandemSource, which is already logged in
+    with the server's token rather than credentials.
+    """
+    def __init__(self, server, secret, timings=None):
+        self.retry_policy = RetryPolicy('TandemSourceApi')
+        self.secret = secret
+        if timings is not None:
+            self.timings = timings
+        self.region = 'US'
+        self._region_urls = dict(self._US_URLS, SOURCE_URL=server.url)
+        self._email = None
+        self._password = None
+        self.accessToken = server.token
+        self.accessTokenExpiresAt = None
+        self.pumperId = server.pumper_id
+        self.accountId = server.pumper_id
+
+    def login(self, email, password):
+        pass
+
+
+class FakeTConnectApi:
+    """
+    A TConnectApi whose Tandem Source client is a FakeTandemSourceApi.
+    """
+    def __init__(self, server, secret, timings=None):
+        self.tandemsource = FakeTandemSourceApi(server, secret, timings=timings)
+
+    def tandemsource_circuit_open_seconds(self):
+        return self.tandemsource.retry_policy.open_circuit_seconds()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the Tandem Source API used by tconnectsync, serving synthetic pump history.")
+    add_server_arguments(parser, port=1338)
+    parser.add_argument('--pumps', type=int, default=1, help='The number of pumps on the account.')
+    parser.add_argument('--days', type=int, default=30, help='The days of history before the server started.')
+    parser.add_argument('--speed', type=float, default=1.0, help='How many times faster than real time the pumps upload.')
+    parser.add_argument('--upload-interval-minutes', type=int, default=5)
+    parser.add_argument('--timezone', type=str, default='America/New_York')
+    parser.add_argument('--token', type=str, default=DEFAULT_TOKEN, help='The Bearer token to require.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+    server = FakeTandemSource(
+        pumps=args.pumps,
+        days=args.days,
+        clock=SimulatedClock(speed=args.speed),
+        upload_interval_minutes=args.upload_interval_minutes,
+        timezone=args.timezone,
+        token=args.token,
+        **server_options(args))
+    server.serve(args.port, args.address)
+    logger.info("Pumper ID %s, pumps %s" % (server.pumper_id, ', '.join(p.serial_number for p in server.pumps)))
+    server.wait()
@@ -10,6 +10,8 @@ from urllib.parse import urljoin
 
 from .api.common import ApiException
 from .parser.nightscout import ENTERED_BY
+from .util.timing import NO_TIMINGS, timed
+from .util import metrics, serialize
 
 def format_datetime(date):
 	return arrow.get(date).isoformat()
@@ -30,22 +32,52 @@ def time_range(field_name, start_time, end_time, t_to_space=False):
 
 logger = logging.getLogger(__name__)
 class NightscoutApi:
-	def __init__(self, url, secret, skip_verify=False, ignore_conn_errors=False):
+	# Per-stage timings, recorded when profiling
+	timings = NO_TIMINGS
+
+	def __init__(self, url, secret, skip_verify=False, ignore_conn_errors=False, timings=None):
 		self.url = url
 		self.secret = secret
 		self.verify = False if skip_verify else None
 		self.ignore_conn_errors = ignore_conn_errors
+		if timings is not None:
+			self.timings = timings
 
 
+	@timed('nightscout.upload')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'upload')
 	def upload_entry(self, ns_format, entity='treatments'):
-		r = requests.post(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=ns_format, headers={
+		r = requests.post(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), data=serialize.dumps(ns_format), headers={
 			'Accept': 'application/json',
 			'Content-Type': 'application/json',
 			'api-secret': hashlib.sha1(self.secret.encode()).hexdigest()
 		}, verify=self.verify)
 		if r.status_code != 200:
 			raise ApiException(r.status_code, "Nightscout upload %s response: %s" % (r.status_code, r.text))
+		metrics.ENTRIES_UPLOADED.inc(entity, amount=len(ns_format) if isinstance(ns_format, list) else 1)
+		# The created documents, which include the _id Nightscout assigned
+		try:
+			return r.json()
+		except ValueError:
+			return None
+
+	"""
+	Uploads a list of entries batch_size at a time, with each batch sent as
+	a single request whose body is a JSON array, which the Nightscout API
+	accepts in place of a single document. With a batch_size of 1, each
+	entry is uploaded on its own as before.
+	"""
+	def upload_entries(self, ns_entries, entity='treatments', batch_size=1):
+		if batch_size <= 1:
+			for entry in ns_entries:
+				self.upload_entry(entry, entity=entity)
+			return
+
+		for i in range(0, len(ns_entries), batch_size):
+			self.upload_entry(ns_entries[i:i+batch_size], entity=entity)
 
+	@timed('nightscout.delete')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'delete')
 	def delete_entry(self, entity):
 		r = requests.delete(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json={}, headers={
 			'Accept': 'application/json',
@@ -55,6 +87,8 @@ class NightscoutApi:
 		if r.status_code != 200:
 			raise ApiException(r.status_code, "Nightscout delete %s response: %s" % (r.status_code, r.text))
 
+	@timed('nightscout.put')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'put')
 	def put_entry(self, ns_format, entity):
 		r = requests.put(urljoin(self.url, 'api/v1/' + entity + '?api_secret=' + self.secret), json=ns_format, headers={
 			'Accept': 'application/json',
@@ -64,6 +98,8 @@ class NightscoutApi:
 		if r.status_code != 200:
 			raise ApiException(r.status_code, "Nightscout put %s response: %s" % (r.status_code, r.text))
 
+	@timed('nightscout.last_uploaded')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'last_uploaded')
 	def last_uploaded_entry(self, eventType, time_start=None, time_end=None):
 		def internal(t_to_space):
 			dateFilter = time_range('created_at', time_start, time_end, t_to_space=t_to_space)
@@ -102,6 +138,8 @@ class NightscoutApi:
 			else:
 				raise e
 
+	@timed('nightscout.last_uploaded')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'last_uploaded')
 	def last_uploaded_bg_entry(self, time_start=None, time_end=None):
 		def internal(t_to_space):
 			dateFilter = time_range('dateString', time_start, time_end, t_to_space=t_to_space)
@@ -133,6 +171,8 @@ class NightscoutApi:
 			else:
 				raise e
 
+	@timed('nightscout.last_uploaded')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'last_uploaded')
 	def last_uploaded_activity(self, activityType, time_start=None, time_end=None):
 		def internal(t_to_space):
 			dateFilter = time_range('created_at', time_start, time_end, t_to_space=t_to_space)
@@ -163,6 +203,8 @@ class NightscoutApi:
 			else:
 				raise e
 
+	@timed('nightscout.last_uploaded')
+	@metrics.HTTP_REQUEST_DURATION.time('nightscout', 'last_uploaded')
 	def last_uploaded_devicestatus(self, time_start=None, time_end=None):
 		def internal(t_to_space):
 			dateFilter = time_range('created_at', time_start, time_end, t_to_space=t_to_space)
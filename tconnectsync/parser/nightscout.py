@@ -1,8 +1,9 @@
 import arrow
+import datetime
 
 from ..domain.device_settings import Profile, DeviceSettings
 from ..domain.tandemsource.pump_settings import PumpProfile, PumpSettings
-from ..secret import TIMEZONE_NAME, NIGHTSCOUT_PROFILE_CARBS_HR_VALUE, NIGHTSCOUT_PROFILE_DELAY_VALUE
+from .. import secret as default_secret
 
 ENTERED_BY = "Pump (tconnectsync)"
 
@@ -23,6 +24,21 @@ CGM_STOP_EVENTTYPE = "Sensor Stop"
 IOB_ACTIVITYTYPE = "tconnect_iob"
 
 
+"""
+Parses a created_at time, which is usually formatted by Arrow.format(),
+with datetime.fromisoformat rather than the much slower arrow.get when
+it can.
+"""
+def parse_created_at(created_at):
+    if isinstance(created_at, datetime.datetime):
+        return created_at
+    try:
+        t = datetime.datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return arrow.get(created_at).datetime
+    return t if t.tzinfo else arrow.get(created_at).datetime
+
+
 """
 Conversion methods for parsing data into Nightscout objects.
 """
@@ -84,11 +100,12 @@ class NightscoutEntry:
 
     @staticmethod
     def entry(sgv, created_at, pump_event_id=""):
+        t = parse_created_at(created_at)
         return {
             "type": "sgv",
             "sgv": int(sgv),
-            "date": int(1000 * arrow.get(created_at).timestamp()),
-            "dateString": arrow.get(created_at).strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "date": int(1000 * t.timestamp()),
+            "dateString": t.strftime('%Y-%m-%dT%H:%M:%S%z'),
             "device": ENTERED_BY,
             "pump_event_id": pump_event_id,
             # delta, direction are undefined
@@ -212,7 +229,10 @@ class NightscoutEntry:
 
     # Tandem-scraped profile to Nightscout profile store entry
     @staticmethod
-    def profile_store(profile: Profile, device_settings: DeviceSettings) -> dict:
+    def profile_store(profile: Profile, device_settings: DeviceSettings, secret=None) -> dict:
+        if secret is None:
+            secret = default_secret
+
         return {
             # insulin duration in hours; Nightscout JS bug requires all top-level fields to be strings
             "dia": "%s" % (profile.insulin_duration_min / 60),
@@ -224,8 +244,8 @@ class NightscoutEntry:
                 } for segment in profile.segments
             ],
 
-            "carbs_hr": NIGHTSCOUT_PROFILE_CARBS_HR_VALUE,
-            "delay": NIGHTSCOUT_PROFILE_DELAY_VALUE,
+            "carbs_hr": secret.NIGHTSCOUT_PROFILE_CARBS_HR_VALUE,
+            "delay": secret.NIGHTSCOUT_PROFILE_DELAY_VALUE,
             "sens": [ # Correction factor
                 {
                     "time": tandem_to_ns_time(segment.time),
@@ -254,7 +274,7 @@ class NightscoutEntry:
                     "value": device_settings.high_bg_threshold
                 }
             ],
-            "timezone": TIMEZONE_NAME, # tconnectsync settings timezone
+            "timezone": secret.TIMEZONE_NAME, # tconnectsync settings timezone
             "startDate": "1970-01-01T00:00:00.000Z",
             "units": "mg/dl"
         }
@@ -263,7 +283,10 @@ class NightscoutEntry:
 
     # TandemSource profile to Nightscout profile store entry
     @staticmethod
-    def tandemsource_profile_store(profile: PumpProfile, pump_settings: PumpSettings) -> dict:
+    def tandemsource_profile_store(profile: PumpProfile, pump_settings: PumpSettings, secret=None) -> dict:
+        if secret is None:
+            secret = default_secret
+
         return {
             # insulin duration in hours; Nightscout JS bug requires all top-level fields to be strings
             "dia": "%s" % (profile.insulinDuration / 60),
@@ -275,8 +298,8 @@ class NightscoutEntry:
                 } for segment in profile.tDependentSegs if not segment.skip
             ], key=lambda x: x["timeAsSeconds"])),
 
-            "carbs_hr": NIGHTSCOUT_PROFILE_CARBS_HR_VALUE,
-            "delay": NIGHTSCOUT_PROFILE_DELAY_VALUE,
+            "carbs_hr": secret.NIGHTSCOUT_PROFILE_CARBS_HR_VALUE,
+            "delay": secret.NIGHTSCOUT_PROFILE_DELAY_VALUE,
 
             "sens": list(sorted([ # Correction factor / isf
                 {
@@ -308,7 +331,7 @@ class NightscoutEntry:
                     "value": pump_settings.cgmSettings.highGlucoseAlert.mgPerDl
                 }
             ],
-            "timezone": TIMEZONE_NAME, # tconnectsync settings timezone
+            "timezone": secret.TIMEZONE_NAME, # tconnectsync settings timezone
             "startDate": "1970-01-01T00:00:00.000Z",
             "units": "mg/dl"
         }
@@ -7,6 +7,12 @@ global_path = os.path.join(pathlib.Path.home(), '.config/tconnectsync/.env')
 cwd_creds_path = os.path.join(os.getcwd(), '.creds_cache')
 global_creds_path = os.path.join(pathlib.Path.home(), '.config/tconnectsync/.creds_cache')
 
+cwd_jwks_path = os.path.join(os.getcwd(), '.jwks_cache')
+global_jwks_path = os.path.join(pathlib.Path.home(), '.config/tconnectsync/.jwks_cache')
+
+cwd_state_path = os.path.join(os.getcwd(), '.sync_state')
+global_state_path = os.path.join(pathlib.Path.home(), '.config/tconnectsync/.sync_state')
+
 values = {}
 
 if os.path.exists(cwd_path):
@@ -54,6 +60,8 @@ if not get('NS_SECRET') and get('API_SECRET'):
 
 NS_SKIP_TLS_VERIFY = get_bool('NS_SKIP_TLS_VERIFY', 'false')
 NS_IGNORE_CONN_ERRORS = get_bool('NS_IGNORE_CONN_ERRORS', 'false')
+# Basal and CGM entries are uploaded this many to a request
+NS_UPLOAD_BATCH_SIZE = int(get_number('NS_UPLOAD_BATCH_SIZE', '1'))
 
 # This should be the timezone your pump is set to.
 TIMEZONE_NAME = get('TIMEZONE_NAME', 'America/New_York')
@@ -66,10 +74,17 @@ if not get('TIMEZONE_NAME') and get('TZ'):
 
 CACHE_CREDENTIALS = get_bool('CACHE_CREDENTIALS', 'true')
 CACHE_CREDENTIALS_PATH = get('CACHE_CREDENTIALS', cwd_creds_path if os.path.exists(cwd_creds_path) else global_creds_path)
+CACHE_JWKS = get_bool('CACHE_JWKS', 'true')
+CACHE_JWKS_PATH = get('CACHE_JWKS_PATH', cwd_jwks_path if os.path.exists(cwd_jwks_path) else global_jwks_path)
+# When set, processors keep state such as partially-delivered boluses between syncs
+SYNC_STATE = get_bool('SYNC_STATE', 'false')
+SYNC_STATE_PATH = get('SYNC_STATE_PATH', cwd_state_path if os.path.exists(cwd_state_path) else global_state_path)
 AUTOUPDATE_DEFAULT_SLEEP_SECONDS = get_number('AUTOUPDATE_DEFAULT_SLEEP_SECONDS', '300') # 5 minutes
 AUTOUPDATE_MAX_SLEEP_SECONDS = get_number('AUTOUPDATE_MAX_SLEEP_SECONDS', '1500') # 25 minutes
 AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS = get_number('AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS', '60') # 1 minute
 AUTOUPDATE_USE_FIXED_SLEEP = get_bool('AUTOUPDATE_USE_FIXED_SLEEP', 'false')
+AUTOUPDATE_SCHEDULER = get_one_of('AUTOUPDATE_SCHEDULER', 'rolling', ['rolling', 'phase'])
+AUTOUPDATE_PHASE_CONFIDENCE_PERCENT = get_number('AUTOUPDATE_PHASE_CONFIDENCE_PERCENT', '90')
 AUTOUPDATE_NO_DATA_FAILURE_MINUTES = get_number('AUTOUPDATE_NO_DATA_FAILURE_MINUTES', '180') # 3 hours
 AUTOUPDATE_FAILURE_MINUTES = get_number('AUTOUPDATE_FAILURE_MINUTES', '75') # 75 minutes
 AUTOUPDATE_RESTART_ON_FAILURE = get_bool('AUTOUPDATE_RESTART_ON_FAILURE', 'false')
@@ -77,13 +92,33 @@ AUTOUPDATE_MAX_LOOP_INVOCATIONS = get_number('AUTOUPDATE_MAX_LOOP_INVOCATIONS',
 
 NIGHTSCOUT_PROFILE_UPLOAD_MODE = get_one_of('NIGHTSCOUT_PROFILE_UPLOAD_MODE', 'add', ['add', 'replace'])
 
+# 'compact' builds event types from events.json when they are first used,
+# instead of importing the generated eventparser/events.py module
+EVENT_SCHEMA = get_one_of('EVENT_SCHEMA', 'generated', ['generated', 'compact'])
+
 # When set, all possible history log event types are fetched from Tandem Source
 FETCH_ALL_EVENT_TYPES = get_bool('FETCH_ALL_EVENT_TYPES', 'false')
 
+# Number of threads used to run the per-EventClass processors; 1 runs them in sequence
+PROCESSOR_WORKERS = int(get_number('PROCESSOR_WORKERS', '1'))
+
+# When set, time ranges longer than this many days are fetched and processed in
+# chunks of days, with fetching and decoding running ahead of uploads
+PIPELINE_CHUNK_DAYS = int(get_number('PIPELINE_CHUNK_DAYS', '0'))
+PIPELINE_QUEUE_SIZE = int(get_number('PIPELINE_QUEUE_SIZE', '2'))
+PIPELINE_CARRY_MINUTES = get_number('PIPELINE_CARRY_MINUTES', '60')
+
+# When set, Prometheus metrics are served at http://METRICS_ADDRESS:METRICS_PORT/metrics
+METRICS_PORT = int(get_number('METRICS_PORT', '0'))
+METRICS_ADDRESS = get('METRICS_ADDRESS', '127.0.0.1')
+
 # Default Nightscout profile segment fields which aren't stored by Tandem
 NIGHTSCOUT_PROFILE_CARBS_HR_VALUE = get('NIGHTSCOUT_PROFILE_CARBS_HR_VALUE', '20')
 NIGHTSCOUT_PROFILE_DELAY_VALUE = get('NIGHTSCOUT_PROFILE_DELAY_VALUE', '20')
 IGNORE_ZERO_UNIT_BASAL = get_bool('IGNORE_ZERO_UNIT_BASAL', 'false')
+# When set, consecutive basal deliveries with the same rate and rate source
+# are uploaded as a single Temp Basal treatment
+COMPACT_BASAL = get_bool('COMPACT_BASAL', 'false')
 
 ENABLE_TESTING_MODES = get_bool('ENABLE_TESTING_MODES', 'false')
 SKIP_NS_LAST_UPLOADED_CHECK = get_bool('SKIP_NS_LAST_UPLOADED_CHECK', 'false')
@@ -0,0 +1,286 @@
+import bisect
+import logging
+import statistics
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+"""
+How long the autoupdate loop should sleep before polling Tandem Source again.
+unexpected_no_index is set when new data was expected by now but has not
+appeared, which the autoupdate loop reports as a warning.
+"""
+SleepDecision = namedtuple('SleepDecision', ['seconds', 'unexpected_no_index'])
+
+
+class RollingMeanScheduler:
+    """
+    Sleeps for the rolling average of the time between pump event index
+    updates, and polls every AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS
+    once three polls in a row have found no new data.
+    """
+    name = 'rolling'
+
+    def __init__(self, secret):
+        self.secret = secret
+        self.last_max_date_with_events = None
+        self.last_attempt_time = 0
+        self.time_diffs_between_attempts = []
+        self.time_diffs_between_updates = []
+
+    def new_data(self, now, max_date_with_events, track_interval=True):
+        # Skip the first update, since we don't know at what exact
+        # point the event index changed. The autoupdate loop also skips
+        # updates until it has synced an event index, e.g. in pretend mode.
+        if track_interval and self.last_max_date_with_events:
+            self.time_diffs_between_updates.append(now - self.last_max_date_with_events)
+            # Only keep the 10 latest time diffs
+            self.time_diffs_between_updates = self.time_diffs_between_updates[-10:]
+            logger.debug('Updating tracking of time since last update: %s' % self.time_diffs_between_updates)
+
+        self.last_max_date_with_events = max_date_with_events
+        self.last_attempt_time = now
+        self.time_diffs_between_attempts = []
+
+    def no_new_data(self, now):
+        # Track how long we've been retrying
+        if self.last_attempt_time:
+            self.time_diffs_between_attempts.append(now - self.last_attempt_time)
+
+        self.last_attempt_time = now
+
+    def next_sleep(self, now):
+        # If it's been 3 loops since the last time we found new data,
+        # then we're not in sync with the rate at which pump data is being
+        # uploaded
+        if len(self.time_diffs_between_attempts) >= 3:
+            logger.debug("Time diffs between attempts: %s" % self.time_diffs_between_attempts)
+            return SleepDecision(self.secret.AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS, True)
+
+        sleep_secs = self.secret.AUTOUPDATE_DEFAULT_SLEEP_SECONDS
+
+        # Sleep for a rolling average of time between updates
+        if self.secret.AUTOUPDATE_USE_FIXED_SLEEP != 1:
+            logger.debug("Time diffs between updates: %s" % self.time_diffs_between_updates)
+
+            # If we have less than 3 data points, use the default
+            if len(self.time_diffs_between_updates) > 2:
+                sleep_secs = sum(self.time_diffs_between_updates) / len(self.time_diffs_between_updates)
+
+            # At minimum, update every AUTOUPDATE_MAX_SLEEP_SECONDS regardless
+            # of how often we're seeing new data appear
+            if sleep_secs > self.secret.AUTOUPDATE_MAX_SLEEP_SECONDS:
+                sleep_secs = self.secret.AUTOUPDATE_MAX_SLEEP_SECONDS
+
+        return SleepDecision(sleep_secs, False)
+
+
+class UploadPhaseScheduler:
+    """
+    Models pump uploads as arriving at a fixed cadence with a phase offset,
+    and wakes at the start of the window in which the next upload is
+    expected to become visible. Inside that window it polls every
+    AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS, so each upload is seen
+    shortly after it lands without polling in between uploads.
+
+    The window covers the central AUTOUPDATE_PHASE_CONFIDENCE_PERCENT of the
+    observed phase offsets. Until enough uploads have been observed, it
+    polls every AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS to learn them.
+    """
+    name = 'phase'
+
+    HISTORY = 48
+    MIN_OBSERVATIONS = 4
+
+    # After this many uploads in a row land outside their window, the
+    # pump's phase has shifted and is learned again from scratch
+    MAX_MISPLACED_UPLOADS = 3
+
+    def __init__(self, secret):
+        self.secret = secret
+        self.visible_times = deque(maxlen=self.HISTORY)
+        self.last_poll_time = None
+        self.last_data_time = 0
+        self.misplaced_uploads = 0
+
+    def new_data(self, now, max_date_with_events, track_interval=True):
+        # The upload became visible at some point after the previous poll.
+        # When that poll was a retry, the midpoint is a precise estimate.
+        # Otherwise the upload could have landed any time since, e.g. late
+        # in the previous window, so it isn't used to learn the phase.
+        waited = None if self.last_poll_time is None else now - self.last_poll_time
+        self.last_poll_time = now
+        self.last_data_time = now
+
+        if waited is not None and waited <= 1.5 * self.secret.AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS:
+            self.visible_times.append(now - waited / 2)
+            self.misplaced_uploads = 0
+        elif self.cadence() is not None:
+            self.misplaced_uploads += 1
+            if self.misplaced_uploads >= self.MAX_MISPLACED_UPLOADS:
+                logger.info("Uploads no longer match the learned phase, relearning")
+                self.visible_times.clear()
+                self.misplaced_uploads = 0
+
+    def no_new_data(self, now):
+        self.last_poll_time = now
+
+    """
+    Returns the estimated number of seconds between uploads, or None if
+    not enough uploads have been observed.
+    """
+    def cadence(self):
+        if len(self.visible_times) < self.MIN_OBSERVATIONS:
+            return None
+
+        times = list(self.visible_times)
+
+        diffs = [b - a for a, b in zip(times, times[1:]) if b > a]
+        if not diffs:
+            return None
+
+        # The median is robust to skipped uploads; refine it over the whole
+        # history so small errors don't accumulate across cycles.
+        median = statistics.median(diffs)
+        span = times[-1] - times[0]
+        cycles = round(span / median)
+        if cycles <= 0:
+            return median
+        return span / cycles
+
+    """
+    Returns the (start, end) offsets, relative to the latest observed upload
+    plus a whole number of cadences, in which the next upload is expected.
+    """
+    def window(self, cadence):
+        latest = self.visible_times[-1]
+        offsets = sorted(
+            ((t - latest + cadence / 2) % cadence) - cadence / 2
+            for t in self.visible_times)
+
+        # Each estimate is only known to within one retry interval
+        margin = self.secret.AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS / 2
+        tail = (100 - self.secret.AUTOUPDATE_PHASE_CONFIDENCE_PERCENT) / 2
+        return (
+            percentile(offsets, tail) - margin,
+            percentile(offsets, 100 - tail) + margin
+        )
+
+    def next_sleep(self, now):
+        cadence = self.cadence()
+        if cadence is None:
+            return SleepDecision(self.secret.AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS, False)
+
+        latest = self.visible_times[-1]
+        start, end = self.window(cadence)
+
+        # The first upload after the latest one whose window hasn't closed yet
+        cycle = max(1, int((now - latest - end) // cadence) + 1)
+        window_start = latest + cycle * cadence + start
+        window_end = latest + cycle * cadence + end
+
+        # A whole window passed without any upload appearing
+        missed_window_start = latest + (cycle - 1) * cadence + start
+        unexpected = cycle > 1 and self.last_data_time < missed_window_start
+        if now < window_start:
+            sleep_secs = window_start - now
+        else:
+            sleep_secs = min(self.secret.AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS, window_end - now)
+
+        logger.debug("Upload cadence %0.01f sec, window %0.01f to %0.01f sec (cycle %d)" % (cadence, start, end, cycle))
+        return SleepDecision(max(1, min(sleep_secs, self.secret.AUTOUPDATE_MAX_SLEEP_SECONDS)), unexpected)
+
+
+SCHEDULERS = {
+    RollingMeanScheduler.name: RollingMeanScheduler,
+    UploadPhaseScheduler.name: UploadPhaseScheduler,
+}
+
+def build_scheduler(secret):
+    return SCHEDULERS[secret.AUTOUPDATE_SCHEDULER](secret)
+
+
+def percentile(sorted_values, pct):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * pct / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+class SimulationResult:
+    def __init__(self, name, polls, wasted_polls, latencies):
+        self.name = name
+        self.polls = polls
+        self.wasted_polls = wasted_polls
+        self.latencies = latencies
+
+    @property
+    def mean_latency(self):
+        return statistics.mean(self.latencies) if self.latencies else 0
+
+    @property
+    def p95_latency(self):
+        return percentile(sorted(self.latencies), 95) if self.latencies else 0
+
+    def __str__(self):
+        return "%s: %d polls (%d without new data), %d uploads, latency mean %0.01f sec p95 %0.01f sec" % (
+            self.name, self.polls, self.wasted_polls, len(self.latencies), self.mean_latency, self.p95_latency)
+
+
+"""
+Replays the times at which uploads became visible in Tandem Source against
+a scheduler, without sleeping, and reports how many polls it made and how
+long each upload waited before being seen.
+"""
+def simulate(scheduler, upload_times, start=None, end=None):
+    upload_times = sorted(upload_times)
+    now = upload_times[0] if start is None else start
+
+    polls = 0
+    wasted_polls = 0
+    latencies = []
+    seen = bisect.bisect_right(upload_times, now)
+    last_max_date = None
+
+    # Without an end time, run until every upload has been seen
+    while (seen < len(upload_times)) if end is None else (now <= end):
+        polls += 1
+        visible = bisect.bisect_right(upload_times, now)
+        cur_max_date = upload_times[visible - 1] if visible else None
+
+        if cur_max_date is not None and (last_max_date is None or cur_max_date > last_max_date):
+            latencies.extend(now - t for t in upload_times[seen:visible])
+            seen = visible
+            last_max_date = cur_max_date
+            scheduler.new_data(now, cur_max_date)
+        else:
+            wasted_polls += 1
+            scheduler.no_new_data(now)
+
+        now += scheduler.next_sleep(now).seconds
+
+    return SimulationResult(scheduler.name, polls, wasted_polls, latencies)
+
+
+if __name__ == '__main__':
+    import argparse
+    import arrow
+    from ... import secret
+
+    parser = argparse.ArgumentParser(description="Score autoupdate schedulers against recorded upload times.")
+    parser.add_argument('file', help="File with one upload timestamp per line (ISO 8601 or unix seconds)")
+    args = parser.parse_args()
+
+    def parse_time(line):
+        try:
+            return float(line)
+        except ValueError:
+            return arrow.get(line).float_timestamp
+
+    with open(args.file) as f:
+        times = [parse_time(line.strip()) for line in f if line.strip()]
+
+    for name, cls in SCHEDULERS.items():
+        print(simulate(cls(secret), times))
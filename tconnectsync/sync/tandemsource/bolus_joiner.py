@@ -0,0 +1,94 @@
+import logging
+
+from ...eventparser.generic import Event
+from ...eventparser import events as eventtypes
+
+logger = logging.getLogger(__name__)
+
+REQUESTED_TYPES = (eventtypes.LidBolusRequestedMsg1, eventtypes.LidBolusRequestedMsg2, eventtypes.LidBolusRequestedMsg3)
+
+# LidBolusRequestedMsg2.OptionsMap values for "Extended Bolus" and
+# "BLE Extended Bolus", whose extended part ends with a LidBolexCompleted
+EXTENDED_OPTIONS = (1, 5)
+
+# Boluses with no new events for this long are assumed to have ended
+# without a completion event. Extended boluses last at most 8 hours.
+STALE_SECONDS = 24 * 60 * 60
+
+
+class BolusJoiner:
+    """
+    Joins the events of each bolus as they are added in time order: the
+    LidBolusRequestedMsg1/2/3 sent when it is requested, with the
+    LidBolusCompleted sent when it has been delivered and, for extended
+    boluses, the LidBolexCompleted sent when the extended part has been.
+
+    Only the requested events of boluses which are still being delivered
+    are kept. A bolus is dropped on its last completion event, or once it
+    has had no events for STALE_SECONDS, so memory is proportional to the
+    number of boluses in progress rather than to the time range.
+    """
+    def __init__(self):
+        # bolusid to the requested events by type, and the raw timestamp of
+        # the newest event seen for the bolus
+        self.open = {}
+        self.last_seen = {}
+
+    """
+    Adds the next event and, if it completes (part of) a bolus, returns
+    the completion event and the requested events for the bolus by type.
+    """
+    def add(self, event):
+        self.evict_stale(event.raw.timestampRaw)
+        bolusid = event.bolusid
+
+        if type(event) in REQUESTED_TYPES:
+            self.open.setdefault(bolusid, {})[type(event)] = event
+            self.last_seen[bolusid] = event.raw.timestampRaw
+            return None
+
+        requested = self.open.get(bolusid, {})
+        msg2 = requested.get(eventtypes.LidBolusRequestedMsg2)
+        if type(event) == eventtypes.LidBolusCompleted and msg2 and msg2.optionsRaw in EXTENDED_OPTIONS:
+            # The extended part is still to be delivered
+            self.last_seen[bolusid] = event.raw.timestampRaw
+        else:
+            self.close(bolusid)
+        return event, requested
+
+    def close(self, bolusid):
+        self.open.pop(bolusid, None)
+        self.last_seen.pop(bolusid, None)
+
+    def evict_stale(self, timestamp_raw):
+        for bolusid, last_seen in list(self.last_seen.items()):
+            if timestamp_raw - last_seen > STALE_SECONDS:
+                logger.info("Dropping bolus %d with no completion event since %d" % (bolusid, last_seen))
+                self.close(bolusid)
+
+    """
+    Returns the events of the boluses still being delivered.
+    """
+    def open_events(self):
+        return [e for requested in self.open.values() for e in requested.values()]
+
+    """
+    Returns the open boluses as a JSON-serializable value for SyncState.
+    """
+    def to_state(self):
+        return {
+            str(bolusid): {
+                'lastSeen': self.last_seen[bolusid],
+                'events': [bytes(e.raw.raw).hex() for e in requested.values()],
+            }
+            for bolusid, requested in self.open.items()
+        }
+
+    @staticmethod
+    def from_state(state, timezone=None):
+        joiner = BolusJoiner()
+        for bolusid, item in (state or {}).items():
+            events = [Event(bytearray.fromhex(h), timezone) for h in item['events']]
+            joiner.open[int(bolusid)] = {type(e): e for e in events}
+            joiner.last_seen[int(bolusid)] = item['lastSeen']
+        return joiner
@@ -1,6 +1,8 @@
 import arrow
 import logging
 
+from ...domain.tandemsource.pump_event_metadata import PumpEventMetadataSnapshot
+
 logger = logging.getLogger(__name__)
 
 class ChooseDevice:
@@ -8,10 +10,18 @@ class ChooseDevice:
         self.secret = secret
         self.tconnect = tconnect
 
-    def choose(self):
+    """
+    Chooses the pump to sync from pump_event_metadata. The metadata is fetched
+    unless an already-fetched pumpEventMetadata list or PumpEventMetadataSnapshot
+    is provided.
+    """
+    def choose(self, pumpEventMetadata=None):
         tconnect = self.tconnect
 
-        pumpEventMetadata = tconnect.tandemsource.pump_event_metadata()
+        if pumpEventMetadata is None:
+            pumpEventMetadata = tconnect.tandemsource.pump_event_metadata()
+        elif isinstance(pumpEventMetadata, PumpEventMetadataSnapshot):
+            pumpEventMetadata = pumpEventMetadata.metadata
 
         serialNumberToPump = {p['serialNumber']: p for p in pumpEventMetadata}
         logger.info(f'Found {len(serialNumberToPump)} pumps: {serialNumberToPump.keys()}')
@@ -1,3 +1,56 @@
+import arrow
+
+from ...eventparser.raw_event import TANDEM_EPOCH
+
+class TimestampSortedEvents(list):
+    """
+    A list of events already in eventTimestamp order, which processors can
+    iterate over without sorting again.
+    """
+    pass
+
+"""
+Returns the events in eventTimestamp order. All events from one fetch share
+the pump time zone, so this sorts on the integer timestampRaw instead of
+building arrow objects. Events arrive in (nearly) seqNum order, which is
+also nearly timestamp order apart from pump clock changes, so the sort only
+has to merge a few runs.
+"""
+def sort_by_timestamp(events):
+    if isinstance(events, TimestampSortedEvents):
+        return events
+    return TimestampSortedEvents(sorted(events, key=lambda x: x.raw.timestampRaw))
+
+"""
+Returns the index of the first of the timestamp-sorted events which is
+after the watermark (usually the time of the last Nightscout upload), so
+that processors can slice off events which were already uploaded. The
+search is a bisection on the integer raw timestamps.
+"""
+def watermark_index(events, watermark, raw=lambda x: x.raw.timestampRaw, timestamp=lambda x: x.eventTimestamp):
+    if not watermark or not events:
+        return 0
+
+    # Raw timestamps count pump wall clock seconds, so express the watermark
+    # the same way
+    watermark = arrow.get(watermark)
+    watermark_raw = watermark.to(timestamp(events[0]).tzinfo).replace(tzinfo='UTC').timestamp() - TANDEM_EPOCH
+
+    lo, hi = 0, len(events)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if raw(events[mid]) <= watermark_raw:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    # Wall clock times repeat when the clock goes back for DST, so check the
+    # events next to the boundary by their actual time
+    while lo > 0 and timestamp(events[lo-1]) > watermark:
+        lo -= 1
+    while lo < len(events) and timestamp(events[lo]) <= watermark:
+        lo += 1
+    return lo
 
 def insulin_float_round(amt):
     if type(amt) != float:
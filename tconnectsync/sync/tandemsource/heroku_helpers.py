@@ -1,6 +1,7 @@
 from ...features import DEFAULT_FEATURES
 from .choose_device import ChooseDevice
 from .process import ProcessTimeRange
+from ...domain.tandemsource.pump_event_metadata import PumpEventMetadataSnapshot
 from ... import secret
 
 import datetime
@@ -13,5 +14,6 @@ def run_oneshot(tconnect, nightscout, pretend=False, features=DEFAULT_FEATURES,
     if not secret_arg:
         secret_arg = secret
 
-    tconnectDevice = ChooseDevice(secret_arg, tconnect).choose()
-    return ProcessTimeRange(tconnect, nightscout, tconnectDevice, pretend, secret_arg, features).process(time_start, time_end)
+    metadata = PumpEventMetadataSnapshot.fetch(tconnect)
+    tconnectDevice = ChooseDevice(secret_arg, tconnect).choose(metadata)
+    return ProcessTimeRange(tconnect, nightscout, tconnectDevice, pretend, secret_arg, features, metadata=metadata).process(time_start, time_end)
@@ -0,0 +1,101 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class Pipeline:
+    """
+    Runs each item from source through a chain of stage functions. Each stage
+    runs on its own thread and hands its output to the next stage through a
+    bounded queue, so a slow consumer holds back the stages in front of it
+    instead of letting their results pile up in memory.
+
+    Iterating over the Pipeline yields the output of the last stage, in
+    order, on the calling thread. An exception raised by any stage is
+    re-raised there, and the remaining stages are stopped.
+    """
+    def __init__(self, source, stages, queue_size=2, name='pipeline'):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.name = name
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _feed(self, outbox):
+        try:
+            for item in self.source:
+                if not self._put(outbox, item):
+                    return
+        except Exception as e:
+            self._put(outbox, _Failure(e))
+            return
+        self._put(outbox, _DONE)
+
+    def _run_stage(self, fn, inbox, outbox):
+        while True:
+            item = self._get(inbox)
+            if item is _DONE or isinstance(item, _Failure):
+                self._put(outbox, item)
+                return
+            try:
+                result = fn(item)
+            except Exception as e:
+                self._put(outbox, _Failure(e))
+                return
+            if not self._put(outbox, result):
+                return
+
+    def _start(self):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        self._threads.append(threading.Thread(target=self._feed, args=(queues[0],), name='%s-source' % self.name, daemon=True))
+        for i, fn in enumerate(self.stages):
+            self._threads.append(threading.Thread(target=self._run_stage, args=(fn, queues[i], queues[i+1]), name='%s-%s' % (self.name, getattr(fn, '__name__', i)), daemon=True))
+        for t in self._threads:
+            t.start()
+        return queues[-1]
+
+    def close(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def __iter__(self):
+        outbox = self._start()
+        try:
+            while True:
+                item = outbox.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            self.close()
@@ -1,10 +1,14 @@
 import logging
 import collections
 import arrow
+from concurrent.futures import ThreadPoolExecutor
 
 from ...features import DEVICE_STATUS, DEFAULT_FEATURES
 from ...eventparser import events as eventtypes
 from ...domain.tandemsource.event_class import EventClass
+from ...util.logbuffer import ThreadLogBuffer
+from ...util.timing import NO_TIMINGS
+from ...util import metrics
 from .process_basal import ProcessBasal
 from .process_basal_suspension import ProcessBasalSuspension
 from .process_basal_resume import ProcessBasalResume
@@ -17,11 +21,16 @@ from .process_cgm_reading import ProcessCGMReading
 from .process_device_status import ProcessDeviceStatus
 from .process_user_mode import ProcessUserMode
 from .update_profiles import UpdateProfiles
+from .pipeline import Pipeline
+from .helpers import sort_by_timestamp
 
 logger = logging.getLogger(__name__)
 
 class ProcessTimeRange:
-    def __init__(self, tconnect, nightscout, tconnectDevice, pretend, secret, features=DEFAULT_FEATURES):
+    # Per-stage timings, recorded when profiling
+    timings = NO_TIMINGS
+
+    def __init__(self, tconnect, nightscout, tconnectDevice, pretend, secret, features=DEFAULT_FEATURES, metadata=None, timings=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnectDevice['tconnectDeviceId']
@@ -29,6 +38,10 @@ class ProcessTimeRange:
         self.pretend = pretend
         self.secret = secret
         self.features = features
+        # PumpEventMetadataSnapshot for this cycle, shared with the updaters
+        self.metadata = metadata
+        if timings is not None:
+            self.timings = timings
 
     event_classes = {
         EventClass.BASAL.name: ProcessBasal,
@@ -52,56 +65,271 @@ class ProcessTimeRange:
         fetch_all_event_types = self.secret.FETCH_ALL_EVENT_TYPES or DEVICE_STATUS in self.features
 
         logger.info(f"ProcessTimeRange time_start={time_start} time_end={time_end} tconnect_device_id={self.tconnect_device_id} features={self.features} fetch_all_event_types={fetch_all_event_types}")
-        events = self.tconnect.tandemsource.pump_events(self.tconnect_device_id, time_start, time_end, fetch_all_event_types=fetch_all_event_types)
 
-        events_first_time = None
-        events_last_time = None
-        last_event_seqnum = None
-        for_eventclass = collections.defaultdict(list)
-        for event in events:
-            if not events_first_time:
-                events_first_time = event.eventTimestamp
-            if not events_last_time:
-                events_last_time = event.eventTimestamp
-            if not last_event_seqnum:
-                last_event_seqnum = event.seqNum
-            events_first_time = min(events_first_time, event.eventTimestamp)
-            events_last_time = max(events_last_time, event.eventTimestamp)
-            last_event_seqnum = max(event.seqNum, last_event_seqnum)
+        chunk_days = int(self.secret.PIPELINE_CHUNK_DAYS)
+        chunks = list(day_chunks(time_start, time_end, chunk_days)) if chunk_days > 0 else []
+        if len(chunks) > 1:
+            processed_count, last_event_seqnum = self.process_pipelined(chunks, time_end, fetch_all_event_types)
+        else:
+            events = self.tconnect.tandemsource.pump_events(self.tconnect_device_id, time_start, time_end, fetch_all_event_types=fetch_all_event_types)
+            with self.timings.stage('events.build'):
+                events = list(events)
+            count_decoded(events)
+            with self.timings.stage('events.classify'):
+                batch = EventBatch(events).sort()
+            logger.info(f"Found events: {batch.counts()}")
+            processed_count = self.process_batch(batch, time_end)
+            last_event_seqnum = batch.last_event_seqnum
 
-            clazz = EventClass.for_event(event)
-            if clazz:
-                for_eventclass[clazz.name].append(event)
+        for updater_class in self.updater_classes:
+            c = updater_class(self.tconnect, self.nightscout, self.tconnect_device_id, self.pretend, self.features, metadata=self.metadata, secret=self.secret)
+            if c.enabled():
+                logger.info("%s is enabled from features %s" % (updater_class.__name__, self.features))
+                with self.timings.stage('%s.update' % updater_class.__name__):
+                    done = c.update(self.pretend)
+                logger.info("%s completed with update required: %s" % (updater_class.__name__, done))
+            else:
+                logger.info("Skipping %s, is not enabled from features %s" % (updater_class.__name__, self.features))
 
-        count_by_eventclass = {k: len(v) for k,v in for_eventclass.items()}
-        logger.info(f"Found events: {count_by_eventclass}")
+        logger.info("Processed %d events. Last event ID seen: %d" % (processed_count if processed_count else 0, last_event_seqnum if last_event_seqnum else -1))
+        return processed_count, last_event_seqnum
 
-        processed_count = 0
-        for clazz, events in for_eventclass.items():
+    """
+    Runs the enabled processors over one EventBatch and returns the number
+    of Nightscout entries written.
+    """
+    def process_batch(self, batch, time_end):
+        # Cap events_last_time at time_end to handle pump clock drift
+        # Ensure time_end is timezone-aware for comparison
+        time_end_aware = arrow.get(time_end)
+        capped_time_end = min(batch.events_last_time, time_end_aware) if batch.events_last_time else time_end_aware
+
+        processors = []
+        for clazz, events in batch.for_eventclass.items():
             if clazz in self.event_classes.keys():
-                c = self.event_classes[clazz](self.tconnect, self.nightscout, self.tconnect_device_id, self.pretend, self.features)
+                c = self.event_classes[clazz](self.tconnect, self.nightscout, self.tconnect_device_id, self.pretend, self.features, secret=self.secret)
                 if c.enabled():
                     logger.info("%s is enabled from features %s" % (clazz, self.features))
-                    # Cap events_last_time at time_end to handle pump clock drift
-                    # Ensure time_end is timezone-aware for comparison
-                    time_end_aware = arrow.get(time_end)
-                    capped_time_end = min(events_last_time, time_end_aware) if events_last_time else time_end_aware
-                    ns_entries = c.process(events, events_first_time, capped_time_end)
-                    w = c.write(ns_entries)
-                    if w:
-                        processed_count += w
+                    processors.append((c, sort_by_timestamp(events), batch.class_time_end.get(clazz, capped_time_end)))
                 else:
                     logger.info("Skipping %s, is not enabled from features %s" % (clazz, self.features))
 
-        for updater_class in self.updater_classes:
-            c = updater_class(self.tconnect, self.nightscout, self.tconnect_device_id, self.pretend, self.features)
-            if c.enabled():
-                logger.info("%s is enabled from features %s" % (updater_class.__name__, self.features))
-                done = c.update(self.pretend)
-                logger.info("%s completed with update required: %s" % (updater_class.__name__, done))
-            else:
-                logger.info("Skipping %s, is not enabled from features %s" % (updater_class.__name__, self.features))
+        workers = int(self.secret.PROCESSOR_WORKERS)
+        if workers > 1 and len(processors) > 1:
+            written = self.run_processors_concurrently(processors, batch.events_first_time, workers)
+        else:
+            written = [self.run_processor(c, events, batch.events_first_time, class_time_end) for c, events, class_time_end in processors]
+
+        processed_count = 0
+        for w in written:
+            if w:
+                processed_count += w
+        return processed_count
+
+    """
+    Returns the events of an EventClass which its processor can't handle
+    until later events are known.
+    """
+    def held_events(self, clazz, events):
+        if clazz not in self.event_classes:
+            return []
+        c = self.event_classes[clazz](self.tconnect, self.nightscout, self.tconnect_device_id, self.pretend, self.features, secret=self.secret)
+        if not hasattr(c, 'held_events'):
+            return []
+        return c.held_events(events)
+
+    def run_processor(self, c, events, time_start, time_end):
+        with self.timings.stage('%s.transform' % type(c).__name__):
+            ns_entries = c.process(events, time_start, time_end)
+        with self.timings.stage('%s.upload' % type(c).__name__):
+            return c.write(ns_entries)
+
+    """
+    Runs the processors on a thread pool. Each processor handles its own
+    EventClass and Nightscout eventTypes, so they don't depend on each other.
+    Log output from each processor is held back and emitted in processor
+    order once all have finished, and the first failure is then re-raised.
+    """
+    def run_processors_concurrently(self, processors, time_start, workers):
+        logger.info("Running %d processors on %d workers" % (len(processors), workers))
+        buffers = [[] for _ in processors]
+        with ThreadLogBuffer() as logs:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tconnectsync-process') as pool:
+                futures = [
+                    pool.submit(logs.run, buf, self.run_processor, c, events, time_start, time_end)
+                    for buf, (c, events, time_end) in zip(buffers, processors)
+                ]
+
+        for buf in buffers:
+            logs.replay(buf)
+
+        return [f.result() for f in futures]
+
+    """
+    Processes a long time range one chunk of days at a time. Fetching,
+    decoding and routing of later chunks run on their own threads while the
+    processors transform and upload earlier ones, with at most
+    PIPELINE_QUEUE_SIZE chunks waiting between each pair of stages.
+
+    Transform and upload stay together on the calling thread, since each
+    processor looks up its last Nightscout upload before transforming and
+    must see the entries written for the previous chunk.
+    """
+    def process_pipelined(self, chunks, time_end, fetch_all_event_types):
+        logger.info("Processing %d chunks of %d days" % (len(chunks), int(self.secret.PIPELINE_CHUNK_DAYS)))
+
+        def fetch(chunk):
+            min_date, max_date, last = chunk
+            logger.info("Fetching pump events %s to %s" % (min_date, max_date))
+            return chunk, self.tconnect.tandemsource.pump_events(self.tconnect_device_id, min_date, max_date, fetch_all_event_types=fetch_all_event_types)
+
+        def decode(item):
+            chunk, events = item
+            with self.timings.stage('events.build'):
+                events = list(events)
+            count_decoded(events)
+            return chunk, events
+
+        router = ChunkRouter(self.secret.TIMEZONE_NAME, self.secret.PIPELINE_CARRY_MINUTES, held_events=self.held_events)
+        def route(item):
+            chunk, events = item
+            with self.timings.stage('events.classify'):
+                return chunk, router.route(events, chunk)
+
+        processed_count = 0
+        last_event_seqnum = None
+        for chunk, batch in Pipeline(chunks, [fetch, decode, route], queue_size=int(self.secret.PIPELINE_QUEUE_SIZE), name='tconnectsync-pipeline'):
+            logger.info(f"Found events for {chunk[0]} to {chunk[1]}: {batch.counts()}")
+            processed_count += self.process_batch(batch, time_end)
+            if batch.last_event_seqnum is not None:
+                last_event_seqnum = max(batch.last_event_seqnum, last_event_seqnum or 0)
 
-        logger.info("Processed %d events. Last event ID seen: %d" % (processed_count if processed_count else 0, last_event_seqnum if last_event_seqnum else -1))
         return processed_count, last_event_seqnum
 
+
+"""
+Adds decoded pump events to the per event type metric.
+"""
+def count_decoded(events):
+    for event_type, n in collections.Counter(type(e).__name__ for e in events).items():
+        metrics.EVENTS_DECODED.inc(event_type, amount=n)
+
+
+class EventBatch:
+    """
+    Pump events bucketed by EventClass name, with the time and sequence
+    number bounds of the events seen.
+    """
+    def __init__(self, events=()):
+        self.events_first_time = None
+        self.events_last_time = None
+        self.last_event_seqnum = None
+        self.for_eventclass = collections.defaultdict(list)
+        # Per-EventClass time_end overrides, used for the end of a pipeline chunk
+        self.class_time_end = {}
+
+        for event in events:
+            self.add(event)
+
+    def add(self, event):
+        if not self.events_first_time:
+            self.events_first_time = event.eventTimestamp
+        if not self.events_last_time:
+            self.events_last_time = event.eventTimestamp
+        if not self.last_event_seqnum:
+            self.last_event_seqnum = event.seqNum
+        self.events_first_time = min(self.events_first_time, event.eventTimestamp)
+        self.events_last_time = max(self.events_last_time, event.eventTimestamp)
+        self.last_event_seqnum = max(event.seqNum, self.last_event_seqnum)
+
+        clazz = EventClass.for_event(event)
+        if clazz:
+            self.for_eventclass[clazz.name].append(event)
+
+    def counts(self):
+        return {k: len(v) for k,v in self.for_eventclass.items()}
+
+    """
+    Puts each EventClass bucket in timestamp order, once, so that the
+    processors don't need to sort their events.
+    """
+    def sort(self):
+        for clazz, events in self.for_eventclass.items():
+            self.for_eventclass[clazz] = sort_by_timestamp(events)
+        return self
+
+
+class ChunkRouter:
+    """
+    Builds an EventBatch for each pipeline chunk, carrying state across
+    chunk boundaries. Events which a processor can't handle until later
+    events are known (see the processors' held_events: the last basal rate,
+    boluses which haven't completed, sleep or exercise modes which haven't
+    ended), and any event in the last carry_minutes before the end of the
+    chunk, are held back and processed with the following chunk.
+
+    Only the held back events are kept between chunks, so memory use
+    depends on the chunk length and not on the length of the whole range.
+    Events held for longer than MAX_HOLD_DAYS are processed anyway.
+    """
+    MAX_HOLD_DAYS = 1
+
+    def __init__(self, timezone, carry_minutes, held_events=None):
+        self.timezone = timezone
+        self.carry_minutes = carry_minutes
+        self.held_events = held_events or (lambda clazz, events: events[-1:])
+        self.carried = []
+
+    def route(self, events, chunk):
+        min_date, max_date, last = chunk
+        events = self.carried + events
+        self.carried = []
+
+        if last:
+            return EventBatch(events).sort()
+
+        cutoff = arrow.get(max_date).shift(days=1).replace(tzinfo=self.timezone).shift(minutes=-self.carry_minutes)
+        release_before = cutoff.shift(days=-self.MAX_HOLD_DAYS)
+
+        for_eventclass = collections.defaultdict(list)
+        for event in events:
+            clazz = EventClass.for_event(event)
+            if clazz:
+                for_eventclass[clazz.name].append(event)
+
+        held = set()
+        for clazz, class_events in for_eventclass.items():
+            for event in self.held_events(clazz, class_events):
+                if event.eventTimestamp >= release_before:
+                    held.add(id(event))
+
+        batch = EventBatch()
+        for event in events:
+            if event.eventTimestamp > cutoff or id(event) in held:
+                self.carried.append(event)
+            else:
+                batch.add(event)
+
+        # Processors which use time_end, such as for the duration of the last
+        # basal rate, should stop at the first event held back for the class
+        for event in self.carried:
+            clazz = EventClass.for_event(event)
+            if clazz:
+                batch.class_time_end[clazz.name] = min(event.eventTimestamp, batch.class_time_end.get(clazz.name, event.eventTimestamp))
+        for clazz, class_events in batch.for_eventclass.items():
+            if clazz in batch.class_time_end:
+                batch.class_time_end[clazz] = max(batch.class_time_end[clazz], max(e.eventTimestamp for e in class_events))
+        return batch.sort()
+
+
+"""
+Splits the range from time_start to time_end into chunks of whole days, as
+(min_date, max_date, is_last) tuples with both dates inclusive.
+"""
+def day_chunks(time_start, time_end, days):
+    start = arrow.get(time_start).floor('day')
+    end = arrow.get(time_end).floor('day')
+    while start <= end:
+        chunk_end = start.shift(days=days-1)
+        yield start.date(), min(chunk_end, end).date(), chunk_end >= end
+        start = chunk_end.shift(days=1)
@@ -1,13 +1,13 @@
 import logging
 import arrow
 
-from ...secret import IGNORE_ZERO_UNIT_BASAL
 from ...features import DEFAULT_FEATURES
 from ... import features
+from ... import secret as default_secret
 from ...eventparser.generic import Events, decode_raw_events, EVENT_LEN
 from ...eventparser.utils import bitmask_to_list
 from ...eventparser import events as eventtypes
-from .helpers import insulin_float_round, insulin_milliunits_to_real
+from .helpers import insulin_float_round, insulin_milliunits_to_real, sort_by_timestamp, watermark_index
 from ...domain.tandemsource.event_class import EventClass
 from ...parser.nightscout import (
     BASAL_EVENTTYPE,
@@ -17,12 +17,13 @@ from ...parser.nightscout import (
 logger = logging.getLogger(__name__)
 
 class ProcessBasal:
-    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES):
+    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, secret=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnect_device_id
         self.pretend = pretend
         self.features = features
+        self.secret = secret if secret is not None else default_secret
 
     def enabled(self):
         return features.BASAL in self.features
@@ -36,12 +37,13 @@ class ProcessBasal:
         logger.info("Last Nightscout basal upload: %s" % last_upload_time)
 
         with_duration = []
-        for event in sorted(events, key=lambda x: x.eventTimestamp):
-            if last_upload_time and arrow.get(event.eventTimestamp) <= last_upload_time:
-                if self.pretend:
-                    logger.info("Skipping basal event not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
-                continue
+        events = sort_by_timestamp(events)
+        uploaded = watermark_index(events, last_upload_time)
+        if self.pretend:
+            for event in events[:uploaded]:
+                logger.info("Skipping basal event not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
 
+        for event in events[uploaded:]:
             with_duration.append([event.eventTimestamp, None, event])
 
         if not with_duration:
@@ -53,6 +55,11 @@ class ProcessBasal:
 
         with_duration[-1][1] = time_end - with_duration[-1][0]
 
+        if self.secret.COMPACT_BASAL:
+            count = len(with_duration)
+            with_duration = compact_basal(with_duration)
+            logger.info("Compacted %d basal events into %d segments" % (count, len(with_duration)))
+
         ns_entries = []
         for item in with_duration:
             ns = self.basal_to_nsentry(*item)
@@ -61,41 +68,76 @@ class ProcessBasal:
 
         return ns_entries
 
+    """
+    Events which can't be processed until later events are known. The last
+    basal rate lasts until the next one, which may not have been fetched yet.
+    """
+    def held_events(self, events):
+        if not events:
+            return []
+        return [max(events, key=lambda x: x.eventTimestamp)]
+
     def write(self, ns_entries):
-        count = 0
         for entry in ns_entries:
             if self.pretend:
                 logger.info("Would upload to Nightscout: %s" % entry)
             else:
                 logger.info("Uploading to Nightscout: %s" % entry)
-                self.nightscout.upload_entry(entry)
-            count += 1
 
-        return count
+        if not self.pretend:
+            self.nightscout.upload_entries(ns_entries, entity='treatments', batch_size=int(self.secret.NS_UPLOAD_BATCH_SIZE))
+        return len(ns_entries)
 
 
     def basal_to_nsentry(self, start, duration, event):
         if type(event) == eventtypes.LidBasalRateChange:
             value = insulin_float_round(event.commandedbasalrate)
-            if IGNORE_ZERO_UNIT_BASAL and value < 0.01:
+            if self.secret.IGNORE_ZERO_UNIT_BASAL and value < 0.01:
                 logger.info("Ignoring basal entry with %.2f unit basal because IGNORE_ZERO_UNIT_BASAL=true: %s" % (value, event))
                 return None
             return NightscoutEntry.basal(
                 value = value,
-                duration_mins = duration.seconds / 60,
+                duration_mins = duration.total_seconds() / 60,
                 created_at = start.format(),
                 reason = ', '.join(bitmask_to_list(event.changetype)),
                 pump_event_id = "%s" % event.seqNum
             )
         if type(event) == eventtypes.LidBasalDelivery:
             value = insulin_milliunits_to_real(event.commandedRate)
-            if IGNORE_ZERO_UNIT_BASAL and value < 0.01:
+            if self.secret.IGNORE_ZERO_UNIT_BASAL and value < 0.01:
                 logger.info("Ignoring basal entry with %.2f unit basal because IGNORE_ZERO_UNIT_BASAL=true: %s" % (value, event))
                 return None
             return NightscoutEntry.basal(
                 value = value,
-                duration_mins = duration.seconds / 60,
+                duration_mins = duration.total_seconds() / 60,
                 created_at = start.format(),
                 reason = ', '.join(bitmask_to_list(event.commandedRateSource)),
                 pump_event_id = "%s" % event.seqNum
             )
+
+
+"""
+Returns the rate and rate source which a basal event is uploaded with.
+"""
+def basal_segment_key(event):
+    if type(event) == eventtypes.LidBasalRateChange:
+        return (type(event), insulin_float_round(event.commandedbasalrate), event.changetypeRaw)
+    if type(event) == eventtypes.LidBasalDelivery:
+        return (type(event), event.commandedRate, event.commandedRateSourceRaw)
+    return (type(event), event.seqNum)
+
+"""
+Merges each run of consecutive [start, duration, event] basal items with
+the same rate and rate source into the run's first item, with the
+summed duration. The last item, whose duration runs to time_end, is
+never merged into another, so the newest uploaded treatment still starts
+at the newest basal event and the next sync continues after it.
+"""
+def compact_basal(with_duration):
+    compacted = []
+    for start, duration, event in with_duration[:-1]:
+        if compacted and basal_segment_key(compacted[-1][2]) == basal_segment_key(event):
+            compacted[-1][1] += duration
+        else:
+            compacted.append([start, duration, event])
+    return compacted + with_duration[-1:]
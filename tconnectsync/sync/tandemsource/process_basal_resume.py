@@ -3,10 +3,12 @@ import arrow
 
 from ...features import DEFAULT_FEATURES
 from ... import features
+from ... import secret as default_secret
 from ...eventparser.generic import Events, decode_raw_events, EVENT_LEN
 from ...eventparser.utils import bitmask_to_list
 from ...eventparser import events as eventtypes
 from ...domain.tandemsource.event_class import EventClass
+from .helpers import sort_by_timestamp, watermark_index
 from ...parser.nightscout import (
     BASALRESUME_EVENTTYPE,
     NightscoutEntry
@@ -15,12 +17,13 @@ from ...parser.nightscout import (
 logger = logging.getLogger(__name__)
 
 class ProcessBasalResume:
-    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES):
+    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, secret=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnect_device_id
         self.pretend = pretend
         self.features = features
+        self.secret = secret if secret is not None else default_secret
 
     def enabled(self):
         return features.PUMP_EVENTS in self.features
@@ -34,12 +37,13 @@ class ProcessBasalResume:
         logger.info("Last Nightscout BasalResume upload: %s" % last_upload_time)
 
         ns_entries = []
-        for event in sorted(events, key=lambda x: x.eventTimestamp):
-            if last_upload_time and arrow.get(event.eventTimestamp) <= last_upload_time:
-                if self.pretend:
-                    logger.info("Skipping BasalResume event not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
-                continue
+        events = sort_by_timestamp(events)
+        uploaded = watermark_index(events, last_upload_time)
+        if self.pretend:
+            for event in events[:uploaded]:
+                logger.info("Skipping BasalResume event not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
 
+        for event in events[uploaded:]:
             ns_entries.append(self.resume_to_nsentry(event))
 
 
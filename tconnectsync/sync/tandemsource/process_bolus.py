@@ -3,11 +3,14 @@ import arrow
 
 from ...features import DEFAULT_FEATURES
 from ... import features
+from ... import secret as default_secret
 from ...eventparser.generic import Events, decode_raw_events, EVENT_LEN
 from ...eventparser.utils import bitmask_to_list
 from ...eventparser import events as eventtypes
 from ...domain.tandemsource.event_class import EventClass
-from .helpers import insulin_float_round
+from .helpers import insulin_float_round, sort_by_timestamp, watermark_index
+from .bolus_joiner import BolusJoiner
+from .state import SyncState
 from ...parser.nightscout import (
     BOLUS_EVENTTYPE,
     NightscoutEntry
@@ -16,12 +19,13 @@ from ...parser.nightscout import (
 logger = logging.getLogger(__name__)
 
 class ProcessBolus:
-    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES):
+    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, secret=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnect_device_id
         self.pretend = pretend
         self.features = features
+        self.secret = secret if secret is not None else default_secret
 
     def enabled(self):
         return features.BOLUS in self.features
@@ -34,40 +38,46 @@ class ProcessBolus:
             last_upload_time = arrow.get(last_upload["created_at"])
         logger.info("Last Nightscout bolus upload: %s" % last_upload_time)
 
-        # TODO EXTENDED BOLUSES
-        bolusCompletedEvents = []
-        bolusEventsForId = {}
-        for event in sorted(events, key=lambda x: x.eventTimestamp):
-            if event.bolusid not in bolusEventsForId.keys():
-                bolusEventsForId[event.bolusid] = {}
-
-            bolusEventsForId[event.bolusid][type(event)] = event
-
-            if type(event) == eventtypes.LidBolusCompleted:
-                if last_upload_time and arrow.get(event.eventTimestamp) <= last_upload_time:
-                    if self.pretend:
-                        logger.info("Skipping bolusCompletedEvent not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
-                    continue
-
-                bolusCompletedEvents.append(event)
-
-        bolusCompletedEvents.sort(key=lambda e: e.eventTimestamp)
-
-
+        # Boluses still being delivered at the end of the previous sync
+        state = SyncState(self.secret, self.tconnect_device_id)
+        joiner = BolusJoiner.from_state(state.load('bolus'), timezone=self.secret.TIMEZONE_NAME)
 
         ns_entries = []
-        for bolusCompleted in bolusCompletedEvents:
-            m = bolusEventsForId[bolusCompleted.bolusid]
+        events = sort_by_timestamp(events)
+        uploaded = watermark_index(events, last_upload_time)
+        for i, event in enumerate(events):
+            joined = joiner.add(event)
+            if not joined:
+                continue
+
+            completed, requested = joined
+            if i < uploaded:
+                if self.pretend:
+                    logger.info("Skipping %s not after last upload time: %s (time range: %s - %s)" % (type(completed).__name__, completed, time_start, time_end))
+                continue
 
             ns_entries.append(self.bolus_to_nsentry(
-                bolusCompleted,
-                bolusRequested1 = m.get(eventtypes.LidBolusRequestedMsg1),
-                bolusRequested2 = m.get(eventtypes.LidBolusRequestedMsg2),
-                bolusRequested3 = m.get(eventtypes.LidBolusRequestedMsg3),
+                completed,
+                bolusRequested1 = requested.get(eventtypes.LidBolusRequestedMsg1),
+                bolusRequested2 = requested.get(eventtypes.LidBolusRequestedMsg2),
+                bolusRequested3 = requested.get(eventtypes.LidBolusRequestedMsg3),
             ))
 
+        if not self.pretend:
+            state.save('bolus', joiner.to_state())
         return ns_entries
 
+    """
+    Events which can't be processed until later events are known: those for
+    boluses which haven't completed yet, including extended boluses whose
+    extended part is still being delivered.
+    """
+    def held_events(self, events):
+        joiner = BolusJoiner()
+        for event in sort_by_timestamp(events):
+            joiner.add(event)
+        return joiner.open_events()
+
     def write(self, ns_entries):
         count = 0
         for entry in ns_entries:
@@ -89,6 +99,12 @@ class ProcessBolus:
         if bolusRequested2 and bolusRequested2.declinedcorrection == eventtypes.LidBolusRequestedMsg2.DeclinedcorrectionEnum.Yes:
             suffixes.append('(Declined Correction)')
 
+        # The extended part of an extended bolus is uploaded on its own,
+        # after the part delivered immediately which has the carbs and BG
+        extended = type(bolusCompleted) == eventtypes.LidBolexCompleted
+        if extended:
+            suffixes.append('(Extended)')
+
         suffix = (' ' + (' '.join(suffixes))) if suffixes else ''
 
         seq_nums = []
@@ -103,10 +119,10 @@ class ProcessBolus:
 
         return NightscoutEntry.bolus(
             bolus = insulin_float_round(bolusCompleted.insulindelivered),
-            carbs = bolusRequested1.carbamount if bolusRequested1 and bolusRequested1.carbamount>0 else None,
+            carbs = bolusRequested1.carbamount if bolusRequested1 and bolusRequested1.carbamount>0 and not extended else None,
             created_at = bolusCompleted.eventTimestamp.format(),
             notes = notes + suffix,
-            bg = bolusRequested1.BG if bolusRequested1 and bolusRequested1.BG > 0 else None,
+            bg = bolusRequested1.BG if bolusRequested1 and bolusRequested1.BG > 0 and not extended else None,
             pump_event_id = ",".join(seq_nums)
         )
 
@@ -3,12 +3,13 @@ import arrow
 
 from ...features import DEFAULT_FEATURES
 from ... import features
-from ... import secret
+from ... import secret as default_secret
 from ...eventparser.generic import Events, decode_raw_events, EVENT_LEN
 from ...eventparser.utils import bitmask_to_list
 from ...eventparser.raw_event import TANDEM_EPOCH
 from ...eventparser import events as eventtypes
 from ...domain.tandemsource.event_class import EventClass
+from .helpers import watermark_index
 from ...parser.nightscout import (
     CGM_START_EVENTTYPE,
     NightscoutEntry
@@ -17,13 +18,14 @@ from ...parser.nightscout import (
 logger = logging.getLogger(__name__)
 
 class ProcessCGMReading:
-    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, timezone=None):
+    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, timezone=None, secret=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnect_device_id
         self.pretend = pretend
         self.features = features
-        self.timezone = timezone or secret.TIMEZONE_NAME
+        self.secret = secret if secret is not None else default_secret
+        self.timezone = timezone or self.secret.TIMEZONE_NAME
 
     def enabled(self):
         return features.CGM in self.features
@@ -39,13 +41,13 @@ class ProcessCGMReading:
         logger.info("ProcessCGMReading: Last Nightscout bg upload: %s" % last_upload_time)
 
         readings = []
-        for event in sorted(events, key=lambda x: self.timestamp_for(x)):
-            if last_upload_time and self.timestamp_for(event) <= last_upload_time:
-                if self.pretend:
-                    logger.info("ProcessCGMReading: Skipping %s not after last upload time: %s (time range: %s - %s)" % (type(event), event, time_start, time_end))
-                continue
+        events = sorted(events, key=lambda x: x.egvTimestamp)
+        uploaded = watermark_index(events, last_upload_time, raw=lambda x: x.egvTimestamp, timestamp=self.timestamp_for)
+        if self.pretend:
+            for event in events[:uploaded]:
+                logger.info("ProcessCGMReading: Skipping %s not after last upload time: %s (time range: %s - %s)" % (type(event), event, time_start, time_end))
 
-            readings.append(event)
+        readings.extend(events[uploaded:])
 
         ns_entries = []
         for event in readings:
@@ -54,16 +56,15 @@ class ProcessCGMReading:
         return ns_entries
 
     def write(self, ns_entries):
-        count = 0
         for entry in ns_entries:
             if self.pretend:
                 logger.info("Would upload to Nightscout: %s" % entry)
             else:
                 logger.info("Uploading to Nightscout: %s" % entry)
-                self.nightscout.upload_entry(entry, entity='entries')
-            count += 1
 
-        return count
+        if not self.pretend:
+            self.nightscout.upload_entries(ns_entries, entity='entries', batch_size=int(self.secret.NS_UPLOAD_BATCH_SIZE))
+        return len(ns_entries)
 
     def timestamp_for(self, event):
         # For backfills the time the event was added to the pump's event store
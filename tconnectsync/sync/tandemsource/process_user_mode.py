@@ -3,10 +3,13 @@ import arrow
 
 from ...features import DEFAULT_FEATURES
 from ... import features
+from ... import secret as default_secret
 from ...eventparser.generic import Events, decode_raw_events, EVENT_LEN
 from ...eventparser.utils import bitmask_to_list
 from ...eventparser import events as eventtypes
 from ...domain.tandemsource.event_class import EventClass
+from .helpers import sort_by_timestamp, watermark_index
+from .state import SyncState
 from ...parser.nightscout import (
     EXERCISE_EVENTTYPE,
     SLEEP_EVENTTYPE,
@@ -18,52 +21,37 @@ NOT_ENDED = "Not Ended"
 logger = logging.getLogger(__name__)
 
 class ProcessUserMode:
-    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES):
+    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, secret=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnect_device_id
         self.pretend = pretend
         self.features = features
+        self.secret = secret if secret is not None else default_secret
 
     def enabled(self):
         return features.PUMP_EVENTS in self.features
 
     def process(self, events, time_start, time_end):
-        logger.debug("ProcessUserMode: querying for last uploaded exercise entry")
-        exercise_last_upload = self.nightscout.last_uploaded_entry(EXERCISE_EVENTTYPE, time_start=time_start, time_end=time_end)
-        exercise_last_upload_time = None
-        if exercise_last_upload:
-            exercise_last_upload_time = arrow.get(exercise_last_upload["created_at"])
-        logger.info("ProcessUserMode: Last Nightscout exercise upload: %s" % exercise_last_upload_time)
-
-        exercise_not_ended = False
-        if exercise_last_upload and NOT_ENDED in exercise_last_upload.get("reason", ""):
-            exercise_not_ended = True
-            logger.info("ProcessUserMode: Last exercise not ended: %s" % exercise_last_upload)
-
-
-        logger.debug("ProcessUserMode: querying for last uploaded sleep entry")
-        sleep_last_upload = self.nightscout.last_uploaded_entry(SLEEP_EVENTTYPE, time_start=time_start, time_end=time_end)
-        sleep_last_upload_time = None
-        if sleep_last_upload:
-            sleep_last_upload_time = arrow.get(sleep_last_upload["created_at"])
-        logger.info("ProcessUserMode: Last Nightscout sleep upload: %s" % sleep_last_upload_time)
-
-        sleep_not_ended = False
-        if sleep_last_upload and NOT_ENDED in sleep_last_upload.get("reason", ""):
-            sleep_not_ended = True
-            logger.info("ProcessUserMode: Last sleep not ended: %s" % sleep_last_upload)
-
-        last_upload_time = None
-        if exercise_last_upload_time and sleep_last_upload_time:
-            last_upload_time = max(exercise_last_upload_time, sleep_last_upload_time)
-        elif exercise_last_upload_time:
-            last_upload_time = exercise_last_upload_time
-        elif sleep_last_upload_time:
-            last_upload_time = sleep_last_upload_time
-
-        logger.info("ProcessUserMode: Last Nightscout usermode upload: %s" % last_upload_time)
-
+        events = sort_by_timestamp(events)
+
+        # The open modes and last seqNum processed by the previous sync, when
+        # SYNC_STATE is set, save rediscovering them from Nightscout
+        self.state = SyncState(self.secret, self.tconnect_device_id)
+        saved = self.state.load('user_mode')
+        if saved is not None:
+            open_modes = dict(saved['open'])
+            last_seqnum = saved['lastSeqNum']
+            logger.info("ProcessUserMode: Continuing after seqNum %d with open modes: %s" % (last_seqnum, list(open_modes.keys())))
+            new_events = [e for e in events if e.seqNum > last_seqnum]
+        else:
+            open_modes, last_upload_time = self.open_modes_from_nightscout(time_start, time_end)
+            last_seqnum = None
+            uploaded = watermark_index(events, last_upload_time)
+            if self.pretend:
+                for event in events[:uploaded]:
+                    logger.info("ProcessUserMode: Skipping usermode event not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
+            new_events = events[uploaded:]
 
         ns_entries = []
 
@@ -71,12 +59,7 @@ class ProcessUserMode:
         processed_exercise = []
         start_sleep = None
         start_exercise = None
-        for event in sorted(events, key=lambda x: x.eventTimestamp):
-            if last_upload_time and arrow.get(event.eventTimestamp) <= last_upload_time:
-                if self.pretend:
-                    logger.info("ProcessUserMode: Skipping usermode event not after last upload time: %s (time range: %s - %s)" % (event, time_start, time_end))
-                continue
-
+        for event in new_events:
             if self.is_start_sleep(event):
                 start_sleep = event
             elif self.is_stop_sleep(event):
@@ -84,9 +67,10 @@ class ProcessUserMode:
                     processed_sleep.append((start_sleep, event))
                     start_sleep = None
                 else:
-                    if sleep_not_ended:
+                    sleep_last_upload = open_modes.pop(SLEEP_EVENTTYPE, None)
+                    if sleep_last_upload:
                         logger.info("ProcessUserMode: Found StopSleep without StartSleep, with incomplete sleep event in nightscout: %s NS: %s" % (event, sleep_last_upload))
-                        ns_entries.append(self.process_unended_sleep_stop(event, sleep_last_upload))
+                        ns_entries.append(self.process_unended_sleep_stop(event, self.with_id(SLEEP_EVENTTYPE, sleep_last_upload, time_start, time_end)))
                     else:
                         logger.warning("ProcessUserMode: Found StopSleep without StartSleep, and no active sleep event in nightscout: %s" % event)
             elif self.is_start_exercise(event):
@@ -96,9 +80,10 @@ class ProcessUserMode:
                     processed_exercise.append((start_exercise, event))
                     start_exercise = None
                 else:
-                    if exercise_not_ended:
+                    exercise_last_upload = open_modes.pop(EXERCISE_EVENTTYPE, None)
+                    if exercise_last_upload:
                         logger.info("ProcessUserMode: Found StopExercise without StartExercise, with incomplete exercise event in nightscout: %s NS: %s" % (event, exercise_last_upload))
-                        ns_entries.append(self.process_unended_exercise_stop(event, exercise_last_upload))
+                        ns_entries.append(self.process_unended_exercise_stop(event, self.with_id(EXERCISE_EVENTTYPE, exercise_last_upload, time_start, time_end)))
                     else:
                         logger.warning("ProcessUserMode: Found StopExercise without StartExercise, and no active exercise event in nightscout: %s" % event)
             else:
@@ -111,24 +96,104 @@ class ProcessUserMode:
             processed_exercise.append((start_exercise, None))
             logger.info("ProcessUserMode: exercise is active")
 
-        for items in processed_sleep:
-            ns_entries.append(self.sleep_to_nsentry(start=items[0], stop=items[1], time_end=time_end))
+        # The newest mode of each type is the one left open, if it hasn't ended
+        for event_type, processed, to_nsentry in (
+            (SLEEP_EVENTTYPE, processed_sleep, self.sleep_to_nsentry),
+            (EXERCISE_EVENTTYPE, processed_exercise, self.exercise_to_nsentry)):
+            for start, stop in processed:
+                entry = to_nsentry(start=start, stop=stop, time_end=time_end)
+                ns_entries.append(entry)
+                if stop:
+                    open_modes.pop(event_type, None)
+                else:
+                    open_modes[event_type] = entry
 
-        for items in processed_exercise:
-            ns_entries.append(self.exercise_to_nsentry(start=items[0], stop=items[1], time_end=time_end))
+        self.pending_state = None
+        if events:
+            self.pending_state = {
+                'lastSeqNum': max([e.seqNum for e in events] + [last_seqnum or 0]),
+                'open': open_modes,
+            }
+        elif saved is not None:
+            self.pending_state = saved
 
         return ns_entries
 
+    """
+    Returns the sleep and exercise treatments in Nightscout which haven't
+    ended, by eventType, and the time of the last one uploaded.
+    """
+    def open_modes_from_nightscout(self, time_start, time_end):
+        open_modes = {}
+        last_upload_times = []
+        for event_type in (EXERCISE_EVENTTYPE, SLEEP_EVENTTYPE):
+            logger.debug("ProcessUserMode: querying for last uploaded %s entry" % event_type)
+            last_upload = self.nightscout.last_uploaded_entry(event_type, time_start=time_start, time_end=time_end)
+            last_upload_time = None
+            if last_upload:
+                last_upload_time = arrow.get(last_upload["created_at"])
+                last_upload_times.append(last_upload_time)
+            logger.info("ProcessUserMode: Last Nightscout %s upload: %s" % (event_type, last_upload_time))
+
+            if last_upload and NOT_ENDED in last_upload.get("reason", ""):
+                open_modes[event_type] = last_upload
+                logger.info("ProcessUserMode: Last %s not ended: %s" % (event_type, last_upload))
+
+        last_upload_time = max(last_upload_times) if last_upload_times else None
+        logger.info("ProcessUserMode: Last Nightscout usermode upload: %s" % last_upload_time)
+        return open_modes, last_upload_time
+
+    """
+    Returns the Nightscout treatment for a mode which hasn't ended, looking
+    up its _id in Nightscout if it wasn't known when it was uploaded.
+    """
+    def with_id(self, event_type, ns_entry, time_start, time_end):
+        if "_id" in ns_entry:
+            return ns_entry
+        last_upload = self.nightscout.last_uploaded_entry(event_type, time_start=time_start, time_end=time_end)
+        if last_upload and last_upload.get("created_at") == ns_entry.get("created_at"):
+            return last_upload
+        return ns_entry
+
+    """
+    Events which can't be processed until later events are known: everything
+    from the start of a sleep or exercise mode which hasn't ended yet.
+    """
+    def held_events(self, events):
+        open_starts = {}
+        for event in sort_by_timestamp(events):
+            if self.is_start_sleep(event):
+                open_starts[SLEEP_EVENTTYPE] = event
+            elif self.is_stop_sleep(event):
+                open_starts.pop(SLEEP_EVENTTYPE, None)
+            if self.is_start_exercise(event):
+                open_starts[EXERCISE_EVENTTYPE] = event
+            elif self.is_stop_exercise(event):
+                open_starts.pop(EXERCISE_EVENTTYPE, None)
+
+        if not open_starts:
+            return []
+        since = min(e.eventTimestamp for e in open_starts.values())
+        return [e for e in events if e.eventTimestamp >= since]
+
     def write(self, ns_entries):
+        open_entries = [e for e in (self.pending_state or {}).get('open', {}).values()]
         count = 0
         for entry in ns_entries:
             if self.pretend:
                 logger.info("Would upload to Nightscout: %s" % entry)
             else:
                 logger.info("Uploading to Nightscout: %s" % entry)
-                self.nightscout.upload_entry(entry)
+                created = self.nightscout.upload_entry(entry)
+                # Kept so that the treatment can be replaced when the mode ends
+                if any(entry is e for e in open_entries):
+                    created_id = created_ids(created)
+                    if created_id:
+                        entry["_id"] = created_id[0]
             count += 1
 
+        if not self.pretend and self.pending_state is not None:
+            self.state.save('user_mode', self.pending_state)
         return count
 
     def is_start_sleep(self, event):
@@ -208,10 +273,12 @@ class ProcessUserMode:
             )
 
     def process_unended_sleep_stop(self, event, sleep_last_upload):
-        logger.info("ProcessUserMode: Deleting old sleep event treatment before pushing update (delete treatments/%s)" % sleep_last_upload["_id"])
-        if self.pretend:
+        if "_id" not in sleep_last_upload:
+            logger.warning("ProcessUserMode: Not deleting old sleep event treatment with unknown _id: %s" % sleep_last_upload)
+        elif self.pretend:
             logger.info("ProcessUserMode: Skipping delete in pretend mode")
         else:
+            logger.info("ProcessUserMode: Deleting old sleep event treatment before pushing update (delete treatments/%s)" % sleep_last_upload["_id"])
             self.nightscout.delete_entry('treatments/%s' % sleep_last_upload["_id"])
 
         duration_mins = (event.eventTimestamp - arrow.get(sleep_last_upload["created_at"])).seconds / 60
@@ -224,10 +291,12 @@ class ProcessUserMode:
         )
 
     def process_unended_exercise_stop(self, event, exercise_last_upload):
-        logger.info("ProcessUserMode: Deleting old exercise event treatment before pushing update (delete treatments/%s)" % exercise_last_upload["_id"])
-        if self.pretend:
+        if "_id" not in exercise_last_upload:
+            logger.warning("ProcessUserMode: Not deleting old exercise event treatment with unknown _id: %s" % exercise_last_upload)
+        elif self.pretend:
             logger.info("ProcessUserMode: Skipping delete in pretend mode")
         else:
+            logger.info("ProcessUserMode: Deleting old exercise event treatment before pushing update (delete treatments/%s)" % exercise_last_upload["_id"])
             self.nightscout.delete_entry('treatments/%s' % exercise_last_upload["_id"])
 
         reason = exercise_last_upload["reason"].replace(" - %s" % NOT_ENDED, "")
@@ -241,4 +310,11 @@ class ProcessUserMode:
             duration=duration_mins,
             event_type=EXERCISE_EVENTTYPE,
             pump_event_id="%s,%s" % (exercise_last_upload.get("pump_event_id",""), event.seqNum)
-        )
\ No newline at end of file
+        )
+
+"""
+Returns the _ids of the documents in a Nightscout upload response.
+"""
+def created_ids(response):
+    docs = response if isinstance(response, list) else [response]
+    return [d["_id"] for d in docs if isinstance(d, dict) and "_id" in d]
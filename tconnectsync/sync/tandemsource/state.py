@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Processors can run on several threads, and each saves its own section
+_lock = threading.Lock()
+
+
+class SyncState:
+    """
+    Processor state for one pump which is kept between syncs, so that a
+    processor can carry on from where the previous sync stopped rather
+    than rebuilding it from Nightscout or the whole time range. Each
+    processor stores a JSON-serializable value under its own name.
+
+    State is only kept when SYNC_STATE is set, in a JSON file at
+    SYNC_STATE_PATH. Otherwise load() always returns None and save() does
+    nothing, so processors behave as if every sync were the first.
+    """
+    def __init__(self, secret, tconnect_device_id):
+        self.enabled = secret.SYNC_STATE
+        self.path = secret.SYNC_STATE_PATH
+        self.device = str(tconnect_device_id)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load sync state at {self.path}: {e}")
+            return {}
+
+    def load(self, name):
+        if not self.enabled:
+            return None
+        with _lock:
+            return self._read().get(self.device, {}).get(name)
+
+    def save(self, name, value):
+        if not self.enabled:
+            return
+        with _lock:
+            state = self._read()
+            state.setdefault(self.device, {})[name] = value
+            try:
+                mkdir = os.path.dirname(self.path)
+                if mkdir:
+                    os.makedirs(mkdir, exist_ok=True)
+                # Written to a temporary file first, so an interrupted sync
+                # never leaves a partial file behind
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(state, f)
+                os.replace(self.path + '.tmp', self.path)
+                logger.debug(f"Saved {name} sync state to {self.path}")
+            except Exception as e:
+                logger.warning(f"Could not save sync state to {self.path}: {e}")
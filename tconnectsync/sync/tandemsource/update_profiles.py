@@ -7,45 +7,39 @@ from typing import Tuple
 from ...features import DEFAULT_FEATURES
 from ... import features
 from ...domain.tandemsource.pump_settings import PumpSettings
+from ...domain.tandemsource.pump_event_metadata import PumpEventMetadataSnapshot
 from ...parser.nightscout import (
     NightscoutEntry, ENTERED_BY
 )
-from ...secret import NIGHTSCOUT_PROFILE_UPLOAD_MODE
+from ... import secret as default_secret
 
 logger = logging.getLogger(__name__)
 
-def _get_default_upload_mode():
-    return NIGHTSCOUT_PROFILE_UPLOAD_MODE
-
 class UpdateProfiles:
-    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES):
+    def __init__(self, tconnect, nightscout, tconnect_device_id, pretend, features=DEFAULT_FEATURES, metadata=None, secret=None):
         self.tconnect = tconnect
         self.nightscout = nightscout
         self.tconnect_device_id = tconnect_device_id
         self.pretend = pretend
         self.features = features
+        self.metadata = metadata
+        self.secret = secret if secret is not None else default_secret
 
     def enabled(self):
         return features.PROFILES in self.features
 
     def update(self, pretend):
-        upload_mode = _get_default_upload_mode()
+        upload_mode = self.secret.NIGHTSCOUT_PROFILE_UPLOAD_MODE
         logger.debug("UpdateProfiles: getting Tandem Source profile data")
 
-        all_metadata = self.tconnect.tandemsource.pump_event_metadata()
-        pump_meta = None
-        for m in all_metadata:
-            if m['tconnectDeviceId'] == self.tconnect_device_id:
-                pump_meta = m
-
-        if not pump_meta:
-            return False
+        metadata = self.metadata
+        if metadata is None:
+            metadata = PumpEventMetadataSnapshot.fetch(self.tconnect)
 
-        raw_settings = pump_meta.get("lastUpload", {}).get("settings")
-        if not raw_settings:
+        pump_settings = metadata.pump_settings(self.tconnect_device_id)
+        if not pump_settings:
             return False
 
-        pump_settings = PumpSettings.from_dict(raw_settings)
         logger.info("Current pump settings: %s" % pump_settings)
 
         ns_profile_obj = self.nightscout.current_profile()
@@ -106,7 +100,7 @@ class UpdateProfiles:
         for profile_name in missing_profiles_in_ns:
             logger.info("Missing %s profile in Nightscout: %s", profile_name, device.get(profile_name))
             pump_configured_profile = device[profile_name]
-            ns_translated_profile = NightscoutEntry.tandemsource_profile_store(pump_configured_profile, pump_settings)
+            ns_translated_profile = NightscoutEntry.tandemsource_profile_store(pump_configured_profile, pump_settings, secret=self.secret)
             logger.info("Will add %s profile to Nightscout: %s", profile_name, ns_translated_profile)
             new_ns_profile['store'][profile_name] = ns_translated_profile
             updated_ns_profile = True
@@ -115,7 +109,7 @@ class UpdateProfiles:
         for profile_name in existent_profiles_in_ns:
             #logger.debug("Checking for differences for %s profile between pump and nightscout", profile_name)
             pump_configured_profile = device[profile_name]
-            ns_translated_profile = NightscoutEntry.tandemsource_profile_store(pump_configured_profile, pump_settings)
+            ns_translated_profile = NightscoutEntry.tandemsource_profile_store(pump_configured_profile, pump_settings, secret=self.secret)
             ns_configured_profile = ns[profile_name]
 
             #logger.debug("Comparing %s profile from pump: %s to nightscout: %s", profile_name, ns_translated_profile, ns_configured_profile)
@@ -1,9 +1,8 @@
-import arrow
-
 from . import cli
 from . import constants
 
 def timeago(timestamp):
+    import arrow
     seconds = (arrow.get() - arrow.get(timestamp)).total_seconds()
     fmt = '%s ago' if seconds >= 0 else 'in %s'
     seconds = abs(seconds)
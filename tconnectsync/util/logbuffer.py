@@ -0,0 +1,60 @@
+import logging
+import threading
+
+
+class ThreadLogBuffer(logging.Filter):
+    """
+    Holds back log records emitted by worker threads, so that they can be
+    replayed in a fixed order once the workers have finished instead of
+    being interleaved in whatever order the threads happened to run.
+
+    While in use as a context manager, the buffer is installed as a filter on
+    the handlers of every existing logger.
+    """
+    def __init__(self):
+        super().__init__()
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._handlers = []
+
+    def __enter__(self):
+        loggers = [logging.getLogger()] + [l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)]
+        self._handlers = list({id(h): h for l in loggers for h in l.handlers}.values())
+        for h in self._handlers:
+            h.addFilter(self)
+        return self
+
+    def __exit__(self, *args):
+        for h in self._handlers:
+            h.removeFilter(self)
+        self._handlers = []
+
+    def filter(self, record):
+        with self._lock:
+            buf = self._buffers.get(record.thread)
+        if buf is None:
+            return True
+        # The same record passes through each handler's filter
+        if not buf or buf[-1] is not record:
+            buf.append(record)
+        return False
+
+    """
+    Calls fn, storing the log records emitted by the calling thread in buf.
+    """
+    def run(self, buf, fn, *args, **kwargs):
+        ident = threading.get_ident()
+        with self._lock:
+            self._buffers[ident] = buf
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                del self._buffers[ident]
+
+    """
+    Emits the given buffered records through their original loggers.
+    """
+    def replay(self, buf):
+        for record in buf:
+            logging.getLogger(record.name).handle(record)
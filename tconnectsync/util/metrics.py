@@ -0,0 +1,236 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for v in values)
+    return '{%s}' % ','.join('%s="%s"' % (n, v) for n, v in zip(names, escaped))
+
+
+class Metric:
+    """
+    A named metric with optional labels. Values are kept per combination of
+    label values, given positionally in the order of labelnames.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError("%s expects labels %s" % (self.name, self.labelnames))
+        return tuple(str(v) for v in labelvalues)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, k, v) for k, v in sorted(self._values.items())]
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.TYPE),
+        ]
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append('%s%s %s' % (name, _format_labels(labelnames, labelvalues), _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labelvalues):
+        with self._lock:
+            return self._values.get(self._key(labelvalues), 0)
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, function=None):
+        super().__init__(name, documentation, labelnames, registry)
+        # Computes the value when the metrics are collected, or with labels
+        # a dict of values by tuple of label values
+        self.function = function
+
+    def set(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, *labelvalues):
+        if self.function:
+            value = self.function()
+            return value.get(self._key(labelvalues)) if self.labelnames else value
+        with self._lock:
+            return self._values.get(self._key(labelvalues))
+
+    def samples(self):
+        if self.function:
+            value = self.function()
+            if self.labelnames:
+                return [(self.name, self.labelnames, k, v) for k, v in sorted(value.items())]
+            return [] if value is None else [(self.name, (), (), value)]
+        return super().samples()
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    """
+    Observes the duration of a block, as a context manager, or of each call
+    of a function, as a decorator.
+    """
+    def time(self, *labelvalues):
+        self._key(labelvalues)
+        return _Timer(self, labelvalues)
+
+    def count(self, *labelvalues):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labelvalues), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self):
+        ret = []
+        labelnames = self.labelnames + ('le',)
+        with self._lock:
+            values = sorted((k, (list(c), t)) for k, (c, t) in self._values.items())
+        for labelvalues, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                ret.append((self.name + '_bucket', labelnames, labelvalues + (_format_value(bound),), cumulative))
+            ret.append((self.name + '_count', self.labelnames, labelvalues, cumulative))
+            ret.append((self.name + '_sum', self.labelnames, labelvalues, total))
+        return ret
+
+
+class _Timer(contextlib.ContextDecorator):
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def _recreate_cm(self):
+        # As a decorator, each call is timed by its own _Timer, so that calls
+        # overlapping on other threads don't overwrite its start time
+        return _Timer(self.histogram, self.labelvalues)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# Metrics are kept for the whole process. Those of the auto-update loop have
+# an account label, which tells apart the accounts of a daemon; the API and
+# Nightscout metrics are totals across all accounts.
+CYCLE_DURATION = Histogram('tconnectsync_cycle_duration_seconds', 'Duration of auto-update cycles', ['account'], buckets=(.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+EVENTS_DECODED = Counter('tconnectsync_events_decoded_total', 'Pump events decoded, by event type', ['event_type'])
+ENTRIES_UPLOADED = Counter('tconnectsync_entries_uploaded_total', 'Entries uploaded to Nightscout, by collection', ['collection'])
+HTTP_REQUEST_DURATION = Histogram('tconnectsync_http_request_duration_seconds', 'Duration of requests to upstream APIs', ['upstream', 'endpoint'])
+LOGINS = Counter('tconnectsync_logins_total', 'Logins to upstream APIs', ['upstream'])
+LAST_NEW_DATA = Gauge('tconnectsync_last_new_data_timestamp_seconds', 'Unix time when Tandem Source last reported new pump data', ['account'])
+
+def _seconds_since_new_data():
+    now = time.time()
+    return {labelvalues: now - last for _, _, labelvalues, last in LAST_NEW_DATA.samples()}
+
+SECONDS_SINCE_NEW_DATA = Gauge('tconnectsync_seconds_since_last_new_data', 'Seconds since Tandem Source last reported new pump data', ['account'], function=_seconds_since_new_data)
+SLEEP_DECISIONS = Counter('tconnectsync_sleep_decisions_total', 'Auto-update sleep decisions, by scheduler and reason', ['account', 'scheduler', 'reason'])
+SLEEP_SECONDS = Histogram('tconnectsync_sleep_seconds', 'Auto-update sleep durations', ['account'], buckets=(15, 30, 60, 120, 300, 600, 900, 1500, 3600))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format % args)
+
+"""
+Serves the registry's metrics at http://addr:port/metrics from a background
+thread, and returns the server.
+"""
+def serve(port, addr='127.0.0.1', registry=REGISTRY):
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='tconnectsync-metrics', daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics" % (addr, server.server_address[1]))
+    return server
@@ -0,0 +1,26 @@
+import json
+
+# Encodes without whitespace, like orjson, and without checking for the
+# circular references which Nightscout entries can't contain
+_ENCODER = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, check_circular=False)
+
+_dumps = None
+
+def _load_dumps():
+    try:
+        import orjson
+    except ImportError:
+        return lambda obj: _ENCODER.encode(obj).encode('utf-8')
+    return orjson.dumps
+
+
+"""
+Returns the JSON encoding of obj as UTF-8 bytes, using orjson when it is
+installed and otherwise a reused stdlib encoder. Encoding a list of
+entries in one call is much faster than encoding them one at a time.
+"""
+def dumps(obj):
+    global _dumps
+    if _dumps is None:
+        _dumps = _load_dumps()
+    return _dumps(obj)
@@ -0,0 +1,149 @@
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timings:
+    """
+    Wall clock time spent in each named stage of a sync (login, event
+    download, each processor's transform and upload, Nightscout requests,
+    ...), accumulated over every time the stage runs. Safe to use from
+    several threads.
+    """
+    enabled = True
+
+    def __init__(self, report_path=None):
+        self.report_path = report_path
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            # name -> [count, seconds], in the order stages first ran
+            self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            s = self.stages.setdefault(name, [0, 0.0])
+            s[0] += 1
+            s[1] += seconds
+
+    def summary(self):
+        with self._lock:
+            stages = list(self.stages.items())
+        if not stages:
+            return 'no stages timed'
+        return ' '.join(
+            '%s=%.3fs' % (name, seconds) if count == 1 else '%s=%.3fs/%d' % (name, seconds, count)
+            for name, (count, seconds) in stages)
+
+    def report(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'stages': {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in self.stages.items()},
+            }
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    """
+    Logs a one-line summary of the timings, labelled with what they cover
+    (such as one sync cycle), and writes them as JSON to report_path if set.
+    """
+    def emit(self, label):
+        logger.info("%s timings: %s" % (label, self.summary()))
+        if self.report_path:
+            self.write_report(self.report_path)
+
+
+class _NoTimings(Timings):
+    enabled = False
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def add(self, name, seconds):
+        pass
+
+    def emit(self, label):
+        pass
+
+"""
+Timings which records nothing, used when profiling is off.
+"""
+NO_TIMINGS = _NoTimings()
+
+
+"""
+Decorator which times each call of a method as a stage of self.timings.
+"""
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.timings.stage(name):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfilerUnavailableError(RuntimeError):
+    def __str__(self):
+        return "%s: %s" % (self.__class__.__name__, super().__str__())
+
+
+class Profiler:
+    """
+    Captures a Python profile of everything run inside the context, with
+    cProfile (written as pstats data) or pyinstrument (written as HTML, and
+    only available if pyinstrument is installed).
+    """
+    KINDS = ['cprofile', 'pyinstrument']
+
+    def __init__(self, kind, path):
+        if kind not in self.KINDS:
+            raise ValueError("Unknown profiler %s" % kind)
+        self.kind = kind
+        self.path = path
+        self._profiler = None
+
+    def __enter__(self):
+        if self.kind == 'cprofile':
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            try:
+                import pyinstrument
+            except ImportError:
+                raise ProfilerUnavailableError("pyinstrument is not installed, install it with: pip install pyinstrument")
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.kind == 'cprofile':
+            self._profiler.disable()
+            self._profiler.dump_stats(self.path)
+        else:
+            self._profiler.stop()
+            with open(self.path, 'w') as f:
+                f.write(self._profiler.output_html())
+        logger.info("Wrote %s profile to %s" % (self.kind, self.path))
@@ -1,11 +1,14 @@
 import tconnectsync.api
 import requests
 
+from tconnectsync.api.common import RetryPolicy
+
 class ControlIQApi(tconnectsync.api.controliq.ControlIQApi):
     def __init__(self):
         self.BASE_URL = 'invalid://'
         self.LOGIN_URL = 'invalid://'
         self.session = requests.Session() # mocked in tests
+        self.retry_policy = RetryPolicy('ControlIQApi', base_delay=0)
 
     def login(self, email, password):
         raise NotImplementedError
@@ -20,6 +23,7 @@ class WS2Api(tconnectsync.api.ws2.WS2Api):
     def __init__(self):
         self.BASE_URL = 'invalid://'
         self.SLEEP_SECONDS_INCREMENT = 0.01
+        self.retry_policy = self.build_retry_policy()
 
     def get(self, endpoint):
         raise NotImplementedError
@@ -30,6 +34,7 @@ class WS2Api(tconnectsync.api.ws2.WS2Api):
 class AndroidApi(tconnectsync.api.android.AndroidApi):
     def __init__(self):
         self.BASE_URL = 'invalid://'
+        self.retry_policy = RetryPolicy('AndroidApi', base_delay=0)
 
     def login(self, email, password):
         raise NotImplementedError
@@ -43,6 +48,7 @@ class AndroidApi(tconnectsync.api.android.AndroidApi):
 class WebUIScraper(tconnectsync.api.webui.WebUIScraper):
     def __init__(self, controliq):
         self.controliq = controliq
+        self.retry_policy = RetryPolicy('WebUIScraper', base_delay=0)
 
     def my_devices(self):
         raise NotImplementedError
@@ -50,6 +56,23 @@ class WebUIScraper(tconnectsync.api.webui.WebUIScraper):
     def device_settings(self, pump_guid):
         raise NotImplementedError
 
+class TandemSourceApi(tconnectsync.api.tandemsource.TandemSourceApi):
+    def __init__(self, region='US', secret=None):
+        if secret is not None:
+            self.secret = secret
+        self.region = region
+        self._region_urls = self._US_URLS if region == 'US' else self._EU_URLS
+        self.loginSession = requests.Session() # mocked in tests
+        self.accessToken = 'access_tok'
+        self.accessTokenExpiresAt = None
+        self.retry_policy = RetryPolicy('TandemSourceApi', base_delay=0)
+
+    def login(self, email, password):
+        raise NotImplementedError
+
+    def needs_relogin(self):
+        return False
+
 class TConnectApi(tconnectsync.api.TConnectApi):
     def __init__(self, email=None, password=None):
         if email is not None and password is not None:
@@ -2,7 +2,7 @@ import unittest
 
 from unittest.mock import patch
 
-from tconnectsync.api.common import base_session
+from tconnectsync.api.common import base_session, parse_retry_after, RetryPolicy, CircuitBreaker, ApiException, CircuitOpenException
 
 class TestRequestsProxy(unittest.TestCase):
     def test_proxy_used_in_base_session(self):
@@ -41,4 +41,174 @@ class TestRequestsProxy(unittest.TestCase):
                 'https': mock_secret.REQUESTS_PROXY
             })
 
-            
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        clock = FakeClock()
+        b = CircuitBreaker(failure_threshold=3, reset_timeout=60, clock=clock)
+        b.record_failure()
+        b.record_failure()
+        self.assertTrue(b.allow_request())
+        b.record_failure()
+        self.assertFalse(b.allow_request())
+        self.assertEqual(b.state, CircuitBreaker.OPEN)
+        self.assertEqual(b.retry_in(), 60)
+
+    def test_success_resets_failures(self):
+        b = CircuitBreaker(failure_threshold=2, clock=FakeClock())
+        b.record_failure()
+        b.record_success()
+        b.record_failure()
+        self.assertEqual(b.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_after_timeout(self):
+        clock = FakeClock()
+        b = CircuitBreaker(failure_threshold=1, reset_timeout=60, clock=clock)
+        b.record_failure()
+        clock.now = 30
+        self.assertFalse(b.allow_request())
+        self.assertEqual(b.retry_in(), 30)
+
+        clock.now = 60
+        self.assertEqual(b.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(b.allow_request())
+
+        # A failed probe re-opens the circuit immediately
+        b.record_failure()
+        self.assertEqual(b.state, CircuitBreaker.OPEN)
+
+        clock.now = 120
+        self.assertTrue(b.allow_request())
+        b.record_success()
+        self.assertEqual(b.state, CircuitBreaker.CLOSED)
+
+
+    def test_half_open_allows_single_probe(self):
+        clock = FakeClock()
+        b = CircuitBreaker(failure_threshold=1, reset_timeout=60, clock=clock)
+        b.record_failure()
+        clock.now = 60
+
+        self.assertTrue(b.allow_request())
+        self.assertFalse(b.allow_request())
+        self.assertEqual(b.retry_in(), CircuitBreaker.PROBE_WAIT_SECONDS)
+
+        # The next request becomes the probe if this one had no verdict
+        b.release_probe()
+        self.assertTrue(b.allow_request())
+        b.record_success()
+        self.assertTrue(b.allow_request())
+        self.assertTrue(b.allow_request())
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def build(self, **kwargs):
+        sleeps = []
+        policy = RetryPolicy('TestApi', sleep=sleeps.append, **kwargs)
+        return policy, sleeps
+
+    def failing(self, codes, result='ok', retry_after=None):
+        codes = list(codes)
+        calls = []
+        def fn():
+            calls.append(1)
+            if codes:
+                raise ApiException(codes.pop(0), 'fake', retry_after=retry_after)
+            return result
+        return fn, calls
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after('invalid'), None)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+    def test_backoff_is_exponential_and_capped(self):
+        policy, _ = self.build(base_delay=1, max_delay=5, jitter=False)
+        self.assertEqual([policy.backoff_seconds(i) for i in range(5)], [1, 2, 4, 5, 5])
+
+    def test_backoff_jitter_within_bounds(self):
+        policy, _ = self.build(base_delay=4, max_delay=60)
+        for _ in range(20):
+            d = policy.backoff_seconds(1)
+            self.assertGreaterEqual(d, 4)
+            self.assertLessEqual(d, 8)
+
+    def test_backoff_honors_retry_after(self):
+        policy, _ = self.build(base_delay=1, max_delay=60, jitter=False)
+        self.assertEqual(policy.backoff_seconds(0, retry_after=30), 30)
+        self.assertEqual(policy.backoff_seconds(0, retry_after=600), 60)
+
+    def test_retries_transient_errors(self):
+        policy, sleeps = self.build(max_retries=2, base_delay=1, jitter=False)
+        fn, calls = self.failing([503, 500])
+        self.assertEqual(policy.call('endpoint', fn), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleeps, [1, 2])
+
+    def test_uses_retry_after_from_exception(self):
+        policy, sleeps = self.build(base_delay=1, jitter=False)
+        fn, calls = self.failing([429], retry_after='7')
+        self.assertEqual(policy.call('endpoint', fn), 'ok')
+        self.assertEqual(sleeps, [7])
+
+    def test_raises_after_max_retries(self):
+        policy, sleeps = self.build(max_retries=1, base_delay=0)
+        fn, calls = self.failing([500, 500])
+        self.assertRaisesRegex(ApiException, 'TestApi HTTP 500 on retry #1', policy.call, 'endpoint', fn)
+        self.assertEqual(len(calls), 2)
+
+    def test_does_not_retry_client_errors(self):
+        policy, sleeps = self.build(base_delay=0)
+        fn, calls = self.failing([404])
+        self.assertRaises(ApiException, policy.call, 'endpoint', fn)
+        self.assertEqual(len(calls), 1)
+
+    def test_relogin_on_unauthorized(self):
+        policy, sleeps = self.build(base_delay=0)
+        relogins = []
+        fn, calls = self.failing([401])
+        self.assertEqual(policy.call('endpoint', fn, on_unauthorized=lambda: relogins.append(1)), 'ok')
+        self.assertEqual(len(relogins), 1)
+        self.assertEqual(sleeps, [])
+
+    def test_circuit_opens_per_endpoint(self):
+        policy, sleeps = self.build(max_retries=0, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            fn, _ = self.failing([500])
+            self.assertRaises(ApiException, policy.call, 'api/pumpers/123/metadata?x=1', fn)
+
+        fn, calls = self.failing([])
+        self.assertRaises(CircuitOpenException, policy.call, 'api/pumpers/456/metadata', fn)
+        self.assertEqual(len(calls), 0)
+        self.assertGreater(policy.open_circuit_seconds(), 0)
+
+        # Other endpoints are unaffected
+        self.assertEqual(policy.call('api/pumpers/456/events', fn), 'ok')
+
+    def test_client_error_releases_probe(self):
+        policy, sleeps = self.build(max_retries=0, failure_threshold=1, reset_timeout=0)
+        fn, _ = self.failing([500])
+        self.assertRaises(ApiException, policy.call, 'endpoint', fn)
+        self.assertEqual(policy.breaker('endpoint').state, CircuitBreaker.HALF_OPEN)
+
+        fn, _ = self.failing([404])
+        self.assertRaises(ApiException, policy.call, 'endpoint', fn)
+        fn, calls = self.failing([])
+        self.assertEqual(policy.call('endpoint', fn), 'ok')
+        self.assertEqual(policy.breaker('endpoint').state, CircuitBreaker.CLOSED)
+
+    def test_endpoint_key(self):
+        self.assertEqual(RetryPolicy.endpoint_key('api/reports/reportsfacade/12345/pumpeventmetadata'), 'api/reports/reportsfacade/{id}/pumpeventmetadata')
+        self.assertEqual(RetryPolicy.endpoint_key('cloud/upload/getlasteventuploaded?sn=1111'), 'cloud/upload/getlasteventuploaded')
+        self.assertEqual(
+            RetryPolicy.endpoint_key('api/reports/reportsfacade/pumpevents/a1b2-c3/1234?minDate=2024-01-01&maxDate=2024-01-02'),
+            'api/reports/reportsfacade/pumpevents/{id}/{id}')
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import unittest
+import base64
+import datetime
+import json
+import mmap
+import os
+import tempfile
+
+import arrow
+
+from tconnectsync.api.replay import ReplayTConnectApi, load_events_file
+from tconnectsync.eventparser import events as eventtypes
+from tconnectsync.eventparser.synthetic import SyntheticPump, encode_event, timestamp_raw
+from tconnectsync.features import BASAL
+from tconnectsync.sync.tandemsource.choose_device import ChooseDevice
+from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+
+from ..nightscout_fake import NightscoutApi
+from ..secrets import build_secrets
+
+TIMEZONE = 'America/New_York'
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.secret = build_secrets(TIMEZONE_NAME=TIMEZONE, PUMP_SERIAL_NUMBER=None)
+        self.events = SyntheticPump(start=datetime.datetime(2024, 1, 1)).events(3)
+        self.data = b''.join(self.events)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w' if isinstance(content, str) else 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_load_binary_and_base64(self):
+        b64 = base64.b64encode(self.data).decode()
+        self.assertEqual(load_events_file(self.write('events.bin', self.data)), self.data)
+        self.assertEqual(load_events_file(self.write('events.b64', b64 + '\n')), self.data)
+        self.assertEqual(load_events_file(self.write('events.json', json.dumps(b64))), self.data)
+
+        mapped = load_events_file(self.write('mapped.bin', self.data), use_mmap=True)
+        self.assertIsInstance(mapped, mmap.mmap)
+        self.assertEqual(mapped[:], self.data)
+        mapped.close()
+
+    def test_pump_events_by_date_and_type(self):
+        tconnect = ReplayTConnectApi([self.write('events.bin', self.data)], self.secret, use_mmap=True)
+
+        events = list(tconnect.tandemsource.pump_events('replay', '2024-01-02', '2024-01-02'))
+        self.assertEqual(len([e for e in events if type(e) == eventtypes.LidBasalDelivery]), 288)
+        self.assertEqual({e.eventTimestamp.date() for e in events}, {datetime.date(2024, 1, 2)})
+
+        raw = base64.b64decode(tconnect.tandemsource.pump_events_raw('replay', event_ids_filter=[eventtypes.LidBolusCompleted.ID]))
+        self.assertEqual(len(raw), 9 * 26)
+
+    def test_default_event_ids(self):
+        ignored = encode_event(eventtypes.LidDailyBasal, timestamp_raw(datetime.datetime(2024, 1, 1, 12)), 10000)
+        tconnect = ReplayTConnectApi([self.write('events.bin', self.data + ignored)], self.secret)
+
+        self.assertNotIn(eventtypes.LidDailyBasal, {type(e) for e in tconnect.tandemsource.pump_events('replay')})
+        self.assertIn(eventtypes.LidDailyBasal, {type(e) for e in tconnect.tandemsource.pump_events('replay', fetch_all_event_types=True)})
+
+    def test_several_files(self):
+        tconnect = ReplayTConnectApi([
+            self.write('a.bin', b''.join(self.events[:100])),
+            self.write('b.b64', base64.b64encode(b''.join(self.events[100:])).decode()),
+        ], self.secret)
+        self.assertEqual(len(list(tconnect.tandemsource.pump_events('replay', fetch_all_event_types=True))), len(self.events))
+
+    def test_built_metadata(self):
+        tconnect = ReplayTConnectApi([self.write('events.bin', self.data)], build_secrets(TIMEZONE_NAME=TIMEZONE, PUMP_SERIAL_NUMBER='123'))
+        device = ChooseDevice(build_secrets(PUMP_SERIAL_NUMBER='123'), tconnect).choose()
+        self.assertEqual(device['tconnectDeviceId'], 'replay')
+        self.assertEqual(device['minDateWithEvents'], '2024-01-01T00:00:00')
+        self.assertEqual(device['maxDateWithEvents'], '2024-01-03T23:55:30')
+
+        self.assertEqual(tconnect.tandemsource.pump_event_metadata_if_changed(), [device])
+        self.assertIsNone(tconnect.tandemsource.pump_event_metadata_if_changed())
+
+    def test_metadata_file(self):
+        metadata = [{'tconnectDeviceId': 'abc', 'serialNumber': '456', 'maxDateWithEvents': '2024-01-03T00:00:00'}]
+        tconnect = ReplayTConnectApi([self.write('events.bin', self.data)], self.secret, metadata_path=self.write('metadata.json', json.dumps(metadata)))
+        self.assertEqual(tconnect.tandemsource.pump_event_metadata(), metadata)
+
+    def test_process_time_range(self):
+        tconnect = ReplayTConnectApi([self.write('events.bin', self.data)], self.secret)
+        nightscout = NightscoutApi()
+        nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+
+        device = ChooseDevice(self.secret, tconnect).choose()
+        process = ProcessTimeRange(tconnect, nightscout, device, pretend=False, secret=self.secret, features=[BASAL])
+        process.process(arrow.get('2024-01-02T00:00:00-05:00'), arrow.get('2024-01-02T23:59:59-05:00'))
+
+        basals = nightscout.uploaded_entries['treatments']
+        self.assertGreater(len(basals), 0)
+        self.assertTrue(all(b['created_at'].startswith('2024-01-02') for b in basals))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import unittest
+import tempfile
+import json
+import os
+import requests
+import requests_mock
+import arrow
+
+from unittest.mock import patch
+
+
+import tconnectsync.api
+import tconnectsync.api.tandemsource
+from .fake import TandemSourceApi
+
+from tconnectsync.api.common import ApiException
+from tconnectsync.config import Config
+
+JWKS_URL = 'https://tdcservices.tandemdiabetes.com/accounts/api/.well-known/openid-configuration/jwks'
+JWKS = {'keys': [{'kid': 'key1', 'kty': 'RSA', 'n': 'abc', 'e': 'AQAB'}]}
+ROTATED_JWKS = {'keys': [{'kid': 'key2', 'kty': 'RSA', 'n': 'def', 'e': 'AQAB'}]}
+
+class TestTandemSourceApiJwksCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, 'config', '.jwks_cache')
+        self.secret = Config(CACHE_JWKS=True, CACHE_JWKS_PATH=self.cache_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fetch_jwks_saves_cache(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'public, max-age=3600', 'ETag': '"v1"'})
+
+            self.assertEqual(api.fetch_jwks(), JWKS)
+            self.assertEqual(m.call_count, 1)
+
+        with open(self.cache_path) as f:
+            cache = json.load(f)
+        self.assertEqual(cache[JWKS_URL]['jwks'], JWKS)
+        self.assertEqual(cache[JWKS_URL]['etag'], '"v1"')
+        self.assertEqual(cache[JWKS_URL]['expiresAt'] - cache[JWKS_URL]['fetchedAt'], 3600)
+
+    def test_fetch_jwks_uses_fresh_cache_without_request(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'max-age=3600'})
+            api.fetch_jwks()
+            self.assertEqual(api.fetch_jwks(), JWKS)
+            self.assertEqual(TandemSourceApi(secret=self.secret).fetch_jwks(), JWKS)
+
+            self.assertEqual(m.call_count, 1)
+
+    def test_fetch_jwks_revalidates_stale_cache(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'max-age=0', 'ETag': '"v1"'})
+            api.fetch_jwks()
+
+            m.get(JWKS_URL, status_code=304, request_headers={'If-None-Match': '"v1"'}, headers={'Cache-Control': 'max-age=60'})
+            self.assertEqual(api.fetch_jwks(), JWKS)
+            self.assertEqual(m.call_count, 2)
+
+            # Revalidated entry is fresh again
+            self.assertEqual(api.fetch_jwks(), JWKS)
+            self.assertEqual(m.call_count, 2)
+
+    def test_fetch_jwks_force_refresh_after_key_rotation(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'max-age=3600'})
+            api.fetch_jwks()
+
+            m.get(JWKS_URL, json=ROTATED_JWKS, headers={'Cache-Control': 'max-age=3600'})
+            self.assertEqual(api.fetch_jwks(), JWKS)
+            self.assertEqual(api.fetch_jwks(force_refresh=True), ROTATED_JWKS)
+            self.assertEqual(api.fetch_jwks(), ROTATED_JWKS)
+            self.assertEqual(m.call_count, 2)
+
+    def test_fetch_jwks_falls_back_to_stale_cache_on_error(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'no-cache'})
+            api.fetch_jwks()
+
+            m.get(JWKS_URL, status_code=503, text='unavailable')
+            self.assertEqual(api.fetch_jwks(), JWKS)
+
+    def test_fetch_jwks_falls_back_to_stale_cache_on_connection_error(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'no-cache'})
+            api.fetch_jwks()
+
+            m.get(JWKS_URL, exc=requests.ConnectionError)
+            self.assertEqual(api.fetch_jwks(), JWKS)
+            m.get(JWKS_URL, exc=requests.Timeout)
+            self.assertEqual(api.fetch_jwks(), JWKS)
+
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, exc=requests.ConnectionError)
+            self.assertRaises(requests.ConnectionError, TandemSourceApi(secret=self.secret.replace(CACHE_JWKS=False)).fetch_jwks)
+
+    def test_fetch_jwks_raises_without_cache_on_error(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, status_code=503, text='unavailable')
+            self.assertRaises(ApiException, api.fetch_jwks)
+
+    def test_fetch_jwks_no_store_is_not_cached(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'no-store'})
+            api.fetch_jwks()
+            api.fetch_jwks()
+
+            self.assertEqual(m.call_count, 2)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_fetch_jwks_no_store_removes_cache(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'no-cache'})
+            api.fetch_jwks()
+            self.assertTrue(os.path.exists(self.cache_path))
+
+            m.get(JWKS_URL, json=ROTATED_JWKS, headers={'Cache-Control': 'no-store'})
+            self.assertEqual(api.fetch_jwks(), ROTATED_JWKS)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_fetch_jwks_failed_save_keeps_cache(self):
+        api = TandemSourceApi(secret=self.secret)
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'max-age=0'})
+            api.fetch_jwks()
+
+            def partial_dump(obj, f):
+                f.write('{"partial')
+                raise OSError('disk full')
+
+            m.get(JWKS_URL, json=ROTATED_JWKS, headers={'Cache-Control': 'max-age=0'})
+            with patch('tconnectsync.api.tandemsource.json.dump', partial_dump):
+                self.assertEqual(api.fetch_jwks(), ROTATED_JWKS)
+
+        with open(self.cache_path) as f:
+            self.assertEqual(json.load(f)[JWKS_URL]['jwks'], JWKS)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), ['.jwks_cache'])
+
+    def test_fetch_jwks_disabled(self):
+        api = TandemSourceApi(secret=self.secret.replace(CACHE_JWKS=False))
+        with requests_mock.Mocker() as m:
+            m.get(JWKS_URL, json=JWKS, headers={'Cache-Control': 'max-age=3600'})
+            api.fetch_jwks()
+            api.fetch_jwks()
+
+            self.assertEqual(m.call_count, 2)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+
+class TestTandemSourceApiRetryPolicy(unittest.TestCase):
+    def build(self, api):
+        with patch.object(tconnectsync.api.tandemsource.TandemSourceApi, 'login'):
+            return api()
+
+    def open_circuit(self, api):
+        for _ in range(api.retry_policy.failure_threshold):
+            api.retry_policy.breaker('api/pumpers').record_failure()
+
+    def test_circuit_breakers_per_client(self):
+        a = self.build(lambda: tconnectsync.api.tandemsource.TandemSourceApi('a@email.com', 'password'))
+        b = self.build(lambda: tconnectsync.api.tandemsource.TandemSourceApi('b@email.com', 'password'))
+        self.open_circuit(a)
+
+        self.assertGreater(a.retry_policy.open_circuit_seconds(), 0)
+        self.assertEqual(b.retry_policy.open_circuit_seconds(), 0)
+
+    def test_tconnect_api_keeps_circuit_breakers_on_relogin(self):
+        tconnect = tconnectsync.api.TConnectApi('a@email.com', 'password')
+        self.assertEqual(tconnect.tandemsource_circuit_open_seconds(), 0)
+
+        first = self.build(lambda: tconnect.tandemsource)
+        self.open_circuit(first)
+        first.accessTokenExpiresAt = arrow.get().shift(minutes=2)
+
+        second = self.build(lambda: tconnect.tandemsource)
+        self.assertIsNot(first, second)
+        self.assertIs(first.retry_policy, second.retry_policy)
+        self.assertGreater(tconnect.tandemsource_circuit_open_seconds(), 0)
+
+        other = tconnectsync.api.TConnectApi('b@email.com', 'password')
+        self.build(lambda: other.tandemsource)
+        self.assertEqual(other.tandemsource_circuit_open_seconds(), 0)
+
+
+METADATA_URL = 'https://source.tandemdiabetes.com/api/reports/reportsfacade/pumper-1/pumpeventmetadata'
+METADATA = [{'tconnectDeviceId': 'device-1', 'serialNumber': '11111111', 'maxDateWithEvents': '2025-01-01T00:00:00'}]
+
+class TestTandemSourceApiMetadataProbe(unittest.TestCase):
+    def setUp(self):
+        self.api = TandemSourceApi()
+        self.api.pumperId = 'pumper-1'
+
+    def test_returns_metadata_on_first_call(self):
+        with requests_mock.Mocker() as m:
+            m.get(METADATA_URL, json=METADATA)
+            self.assertEqual(self.api.pump_event_metadata_if_changed(), METADATA)
+            self.assertNotIn('If-None-Match', m.last_request.headers)
+
+    def test_unchanged_body_returns_none(self):
+        with requests_mock.Mocker() as m:
+            m.get(METADATA_URL, text=json.dumps(METADATA))
+            self.assertEqual(self.api.pump_event_metadata_if_changed(), METADATA)
+            self.assertIsNone(self.api.pump_event_metadata_if_changed())
+
+            changed = [{**METADATA[0], 'maxDateWithEvents': '2025-01-01T00:05:00'}]
+            m.get(METADATA_URL, text=json.dumps(changed))
+            self.assertEqual(self.api.pump_event_metadata_if_changed(), changed)
+
+    def test_sends_validators_and_handles_304(self):
+        with requests_mock.Mocker() as m:
+            m.get(METADATA_URL, json=METADATA, headers={'ETag': '"abc"', 'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'})
+            self.assertEqual(self.api.pump_event_metadata_if_changed(), METADATA)
+
+            m.get(METADATA_URL, status_code=304, request_headers={
+                'If-None-Match': '"abc"',
+                'If-Modified-Since': 'Wed, 01 Jan 2025 00:00:00 GMT'
+            })
+            self.assertIsNone(self.api.pump_event_metadata_if_changed())
+            self.assertEqual(m.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
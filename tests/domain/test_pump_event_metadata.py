@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import unittest
+import copy
+
+from unittest.mock import patch
+
+from tconnectsync.domain.tandemsource.pump_event_metadata import PumpEventMetadataSnapshot
+from tconnectsync.domain.tandemsource.pump_settings import PumpSettings
+
+SETTINGS = {
+    'profiles': {
+        'activeIdp': 1,
+        'profile': [{
+            'name': 'Default',
+            'idp': 1,
+            'tDependentSegs': [{'startTime': 0, 'basalRate': 800, 'isf': 50, 'carbRatio': 10000, 'targetBg': 110}],
+            'insulinDuration': 300,
+            'carbEntry': 1,
+            'maxBolus': 15000
+        }]
+    },
+    'cgmSettings': {
+        'highGlucoseAlert': {'mgPerDl': 200, 'enabled': 1, 'duration': 60, 'status': 0},
+        'lowGlucoseAlert': {'mgPerDl': 80, 'enabled': 1, 'duration': 30, 'status': 0}
+    }
+}
+
+def build_metadata(settings=SETTINGS, device_id='device-1'):
+    return [
+        {'tconnectDeviceId': 'other-device', 'serialNumber': '22222222', 'lastUpload': {}},
+        {'tconnectDeviceId': device_id, 'serialNumber': '11111111', 'lastUpload': {'settings': copy.deepcopy(settings)}},
+    ]
+
+class TestPumpEventMetadataSnapshot(unittest.TestCase):
+    def setUp(self):
+        PumpEventMetadataSnapshot._parsed_settings = {}
+
+    def test_for_device(self):
+        snapshot = PumpEventMetadataSnapshot(build_metadata())
+        self.assertEqual(snapshot.for_device('device-1')['serialNumber'], '11111111')
+        self.assertIsNone(snapshot.for_device('missing'))
+
+    def test_pump_settings_missing(self):
+        snapshot = PumpEventMetadataSnapshot(build_metadata())
+        self.assertIsNone(snapshot.pump_settings('other-device'))
+        self.assertIsNone(snapshot.pump_settings('missing'))
+        self.assertIsNone(PumpEventMetadataSnapshot(None).pump_settings('device-1'))
+
+    def test_pump_settings_parsed(self):
+        settings = PumpEventMetadataSnapshot(build_metadata()).pump_settings('device-1')
+        self.assertEqual(settings, PumpSettings.from_dict(SETTINGS))
+
+    def test_pump_settings_reused_across_snapshots_when_unchanged(self):
+        with patch.object(PumpSettings, 'from_dict', wraps=PumpSettings.from_dict) as from_dict:
+            first = PumpEventMetadataSnapshot(build_metadata()).pump_settings('device-1')
+            second = PumpEventMetadataSnapshot(build_metadata()).pump_settings('device-1')
+            self.assertIs(first, second)
+            self.assertEqual(from_dict.call_count, 1)
+
+            changed = copy.deepcopy(SETTINGS)
+            changed['profiles']['profile'][0]['tDependentSegs'][0]['basalRate'] = 900
+            third = PumpEventMetadataSnapshot(build_metadata(changed)).pump_settings('device-1')
+            self.assertEqual(from_dict.call_count, 2)
+            self.assertEqual(third.profiles.profile[0].tDependentSegs[0].basalRate, 900)
+
+
+if __name__ == '__main__':
+    unittest.main()
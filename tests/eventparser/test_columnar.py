@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+
+from tconnectsync.eventparser import events as eventtypes
+from tconnectsync.eventparser.columnar import decode_columns
+from tconnectsync.eventparser.generic import Events
+from tconnectsync.eventparser.synthetic import SyntheticPump, encode_event
+
+
+class TestDecodeColumns(unittest.TestCase):
+    def setUp(self):
+        self.data = b''.join(SyntheticPump(start=datetime.datetime(2024, 1, 1)).events(2))
+
+    def test_same_values_as_events(self):
+        columns, unknown = decode_columns(self.data)
+        self.assertEqual(unknown, {})
+
+        events = list(Events(self.data))
+        self.assertEqual(sum(len(c) for c in columns.values()), len(events))
+        for event_id, c in columns.items():
+            of_type = [e for e in events if e.eventId == event_id]
+            self.assertEqual(c.name, type(of_type[0]).__name__)
+            self.assertEqual(c.columns['seqNum'], [e.seqNum for e in of_type])
+            self.assertEqual(c.columns['timestampRaw'], [e.raw.timestampRaw for e in of_type])
+            for name, values in c.columns.items():
+                if name in ('source', 'seqNum', 'timestampRaw'):
+                    continue
+                expected = [getattr(e, name) for e in of_type]
+                if c.types[name] == 'enum':
+                    expected = [v.name if v is not None else None for v in expected]
+                if c.types[name] == 'bitmask':
+                    expected = [tuple(m.name for m in type(v) if m in v) for v in expected]
+                self.assertEqual(values, expected, '%s.%s' % (c.name, name))
+
+    def test_types(self):
+        columns, _ = decode_columns(self.data)
+        basal = columns[eventtypes.LidBasalDelivery.ID]
+        self.assertEqual(basal.types['commandedRate'], 'uint16')
+        self.assertEqual(basal.types['commandedRateSourceRaw'], 'uint16')
+        self.assertEqual(basal.types['commandedRateSource'], 'enum')
+        self.assertEqual(set(basal.columns['commandedRateSource']), {'Algorithm'})
+
+    def test_bitmask(self):
+        data = encode_event(eventtypes.LidBasalRateChange, 0, 1, changetypeRaw=0b101)
+        c = decode_columns(data)[0][eventtypes.LidBasalRateChange.ID]
+        self.assertEqual(c.types['changetype'], 'bitmask')
+        self.assertEqual(c.columns['changetype'], [('TimedSegment', 'TempRateStart')])
+
+    def test_event_ids_and_unknown(self):
+        unknown = bytes([0x0f, 0xff]) + bytes(24)
+        columns, skipped = decode_columns(self.data + unknown + unknown + b'\x00\x01', event_ids={eventtypes.LidBasalDelivery.ID, 0xfff})
+        self.assertEqual(list(columns), [eventtypes.LidBasalDelivery.ID])
+        self.assertEqual(skipped, {0xfff: 2})
+
+    def test_empty(self):
+        self.assertEqual(decode_columns(b''), ({}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import unittest
+import enum
+import logging
+import random
+import struct
+import subprocess
+import sys
+
+from tconnectsync.eventparser import events as generated
+from tconnectsync.eventparser.compact import CompactEventsModule, schema, install
+
+
+def value(v):
+    # Compares enum members by name and value, and floats including NaN by repr
+    if isinstance(v, enum.Enum):
+        return (type(v).__name__, v.name, v.value)
+    return repr(v)
+
+
+class TestCompactEvents(unittest.TestCase):
+    def setUp(self):
+        self.module = CompactEventsModule('tconnectsync.eventparser.events_compact')
+
+    def test_same_event_types(self):
+        self.assertEqual(set(self.module.EVENT_IDS), set(generated.EVENT_IDS))
+        self.assertEqual(set(self.module.EVENT_NAMES), set(generated.EVENT_NAMES))
+        for event_id, clazz in generated.EVENT_IDS.items():
+            compact = self.module.EVENT_IDS[event_id]
+            self.assertEqual(compact.__name__, clazz.__name__)
+            self.assertEqual((compact.ID, compact.NAME), (clazz.ID, clazz.NAME))
+
+    def test_same_enums_and_maps(self):
+        for clazz in generated.EVENT_IDS.values():
+            compact = getattr(self.module, clazz.__name__)
+            for name, attr in vars(clazz).items():
+                if isinstance(attr, type) and issubclass(attr, enum.Enum):
+                    self.assertEqual([(m.name, m.value) for m in getattr(compact, name)], [(m.name, m.value) for m in attr], name)
+                elif name.endswith('Map'):
+                    self.assertEqual(getattr(compact, name), attr, name)
+
+    def test_decodes_like_generated(self):
+        rng = random.Random(0)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        for event_id, clazz in generated.EVENT_IDS.items():
+            compact = self.module.EVENT_IDS[event_id]
+            properties = [name for name, attr in vars(clazz).items() if isinstance(attr, property)]
+            for _ in range(20):
+                raw = bytearray(struct.pack('>HII', event_id, rng.randrange(2**28), rng.randrange(2**20)) + bytes(rng.randrange(256) for _ in range(16)))
+                expected, actual = clazz.build(raw), compact.build(raw)
+
+                self.assertEqual(repr(actual), repr(expected))
+                self.assertEqual(repr(actual.todict()), repr(expected.todict()))
+                for name in properties:
+                    self.assertEqual(value(getattr(actual, name)), value(getattr(expected, name)), '%s.%s' % (clazz.__name__, name))
+
+    def test_classes_created_when_used(self):
+        self.assertNotIn('LidBasalDelivery', vars(self.module))
+        clazz = self.module.EVENT_IDS[279]
+        self.assertIs(vars(self.module)['LidBasalDelivery'], clazz)
+        self.assertIs(self.module.LidBasalDelivery, clazz)
+        self.assertNotIn('LidBolusCompleted', vars(self.module))
+
+        with self.assertRaises(AttributeError):
+            self.module.NotAnEvent
+
+    def test_slotted(self):
+        raw = bytearray(struct.pack('>HII', 279, 0, 1) + bytes(16))
+        event = self.module.LidBasalDelivery.build(raw)
+        self.assertFalse(hasattr(event, '__dict__'))
+        self.assertEqual(event, self.module.LidBasalDelivery.build(raw))
+        self.assertEqual(event.commandedRateSource, self.module.LidBasalDelivery.CommandedratesourceEnum.Suspended)
+
+    def test_constructor(self):
+        raw = generated.RawEvent.build(bytearray(struct.pack('>HII', 20, 0, 1) + bytes(16)))
+        event = self.module.LidBolusCompleted(raw, 3, bolusid=7)
+        self.assertEqual((event.completionstatusRaw, event.bolusid), (3, 7))
+        with self.assertRaises(TypeError):
+            self.module.LidBolusCompleted(raw, rate=1)
+
+    def test_schema_compiled_once(self):
+        self.assertIs(schema(), schema())
+
+    def test_install_after_import(self):
+        if isinstance(generated, CompactEventsModule):
+            self.assertIs(install(), generated)
+        else:
+            with self.assertRaises(RuntimeError):
+                install()
+
+    def test_install(self):
+        out = subprocess.check_output([sys.executable, '-c', '; '.join([
+            'import sys',
+            'from tconnectsync.eventparser import events',
+            'from tconnectsync.eventparser.generic import Event',
+            'from tconnectsync.domain.tandemsource.event_class import EventClass',
+            'e = Event(bytearray(b"\\x01\\x17" + bytes(24)))',
+            'print(type(events).__name__, type(e).__name__, EventClass.for_event(e).name)',
+        ])], env={'EVENT_SCHEMA': 'compact', 'PATH': ''})
+        self.assertEqual(out.decode().split(), ['CompactEventsModule', 'LidBasalDelivery', 'BASAL'])
+
+
+if __name__ == '__main__':
+    unittest.main()
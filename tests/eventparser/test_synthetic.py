@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import unittest
+import collections
+import datetime
+
+from tconnectsync.eventparser.generic import Event, Events, decode_raw_events
+from tconnectsync.eventparser.synthetic import SyntheticPump, encode_event, timestamp_raw
+from tconnectsync.eventparser import events as eventtypes
+
+
+class TestEncodeEvent(unittest.TestCase):
+    def test_round_trip(self):
+        ts = timestamp_raw(datetime.datetime(2024, 1, 1, 12, 30))
+        event = Event(bytearray(encode_event(eventtypes.LidBolusCompleted, ts, 42, bolusid=7, completionstatusRaw=3, insulindelivered=1.5, insulinrequested=2.0)), timezone='America/New_York')
+
+        self.assertIsInstance(event, eventtypes.LidBolusCompleted)
+        self.assertEqual(event.seqNum, 42)
+        self.assertEqual(event.eventTimestamp.isoformat(), '2024-01-01T12:30:00-05:00')
+        self.assertEqual(event.bolusid, 7)
+        self.assertEqual(event.completionstatus, eventtypes.LidBolusCompleted.CompletionstatusEnum.Completed)
+        self.assertEqual(event.insulindelivered, 1.5)
+        self.assertEqual(event.insulinrequested, 2.0)
+        self.assertEqual(event.IOB, 0)
+
+    def test_unknown_field(self):
+        with self.assertRaises(TypeError):
+            encode_event(eventtypes.LidBasalDelivery, 0, 1, rate=800)
+
+
+class TestSyntheticPump(unittest.TestCase):
+    def test_one_day(self):
+        events = list(Events(decode_raw_events(SyntheticPump().blob(1))))
+        counts = collections.Counter(type(e) for e in events)
+
+        self.assertEqual(counts[eventtypes.LidBasalDelivery], 288)
+        self.assertEqual(counts[eventtypes.LidCgmDataG7], 288)
+        self.assertEqual(counts[eventtypes.LidBolusCompleted], 3)
+        self.assertEqual(counts[eventtypes.LidCartridgeFilled], 1)
+        self.assertEqual([e.seqNum for e in events], list(range(1, len(events) + 1)))
+
+    def test_time_order(self):
+        events = list(Events(decode_raw_events(SyntheticPump().blob(4))))
+        timestamps = [e.raw.timestampRaw for e in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+        modes = [e.requestedaction.name for e in events if isinstance(e, eventtypes.LidAaUserModeChange)]
+        self.assertEqual(modes[:5], ['StartSleep', 'StopSleep', 'StartExercise', 'StopExercise', 'StartSleep'])
+
+    def test_deterministic(self):
+        self.assertEqual(SyntheticPump(seed=1).blob(2), SyntheticPump(seed=1).blob(2))
+        self.assertNotEqual(SyntheticPump(seed=1).blob(2), SyntheticPump(seed=2).blob(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import tempfile
+import time
+
+import arrow
+
+from tconnectsync.api.common import ApiException
+from tconnectsync.api.replay import ReplayTConnectApi
+from tconnectsync.eventparser.synthetic import SyntheticPump
+from tconnectsync.fake.nightscout import FakeNightscout, parse_query, matches
+from tconnectsync.features import BASAL, BOLUS, CGM, PUMP_EVENTS
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+
+from ..secrets import build_secrets
+
+
+class TestQuery(unittest.TestCase):
+    def test_parse_query(self):
+        self.assertEqual(
+            parse_query('count=1&find[eventType]=Temp%20Basal&find[created_at][$gte]=2024-01-01T00:00:00+00:00&ts=1'),
+            (1, [('eventType', None, 'Temp Basal'), ('created_at', '$gte', '2024-01-01T00:00:00+00:00')]))
+
+    def test_matches_dates(self):
+        doc = {'created_at': '2024-01-01 10:00:00-05:00'}
+        self.assertTrue(matches(doc, [('created_at', '$gte', '2024-01-01T15:00:00+00:00')]))
+        self.assertFalse(matches(doc, [('created_at', '$gte', '2024-01-01T15:00:01Z')]))
+        self.assertTrue(matches(doc, [('created_at', '$lte', '2024-01-01 10:00:00-05:00')]))
+        self.assertFalse(matches(doc, [('device', None, 'x')]))
+
+    def test_matches_numbers(self):
+        self.assertTrue(matches({'date': 1704067200000}, [('date', '$gt', '1704067199999')]))
+
+
+class TestFakeNightscout(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeNightscout(secret='secret').serve()
+        self.addCleanup(self.fake.shutdown)
+        self.nightscout = NightscoutApi(self.fake.url, 'secret')
+
+    def test_status(self):
+        self.assertEqual(self.nightscout.api_status()['status'], 'ok')
+
+    def test_last_uploaded_entry(self):
+        for hour in (10, 12, 11):
+            self.nightscout.upload_entry({'eventType': 'Temp Basal', 'created_at': '2024-01-01 %d:00:00-05:00' % hour, 'enteredBy': 'Pump (tconnectsync)'})
+        self.nightscout.upload_entry({'eventType': 'Temp Basal', 'created_at': '2024-01-01 13:00:00-05:00', 'enteredBy': 'Someone else'})
+
+        self.assertEqual(self.nightscout.last_uploaded_entry('Temp Basal')['created_at'], '2024-01-01 12:00:00-05:00')
+        self.assertEqual(
+            self.nightscout.last_uploaded_entry('Temp Basal', arrow.get('2024-01-01T10:30:00-05:00'), arrow.get('2024-01-01T11:30:00-05:00'))['created_at'],
+            '2024-01-01 11:00:00-05:00')
+        self.assertIsNone(self.nightscout.last_uploaded_entry('Combo Bolus'))
+
+    def test_bg_entries_and_devicestatus(self):
+        self.nightscout.upload_entry({'type': 'sgv', 'sgv': 120, 'date': 1704121200000, 'dateString': '2024-01-01T15:00:00+00:00', 'device': 'Pump (tconnectsync)'}, entity='entries')
+        self.nightscout.upload_entry({'device': 'Pump (tconnectsync)', 'created_at': '2024-01-01T15:00:00+00:00'}, entity='devicestatus')
+
+        self.assertEqual(self.nightscout.last_uploaded_bg_entry()['sgv'], 120)
+        self.assertIsNotNone(self.nightscout.last_uploaded_devicestatus(arrow.get('2024-01-01T14:00:00+00:00')))
+        self.assertIsNone(self.nightscout.last_uploaded_devicestatus(arrow.get('2024-01-01T16:00:00+00:00')))
+
+    def test_delete(self):
+        self.nightscout.upload_entry({'eventType': 'Sleep', 'enteredBy': 'Pump (tconnectsync)'})
+        entry = self.nightscout.last_uploaded_entry('Sleep')
+        self.nightscout.delete_entry('treatments/%s' % entry['_id'])
+        self.assertEqual(self.fake.collections['treatments'], [])
+
+    def test_profile(self):
+        self.assertIsNone(self.nightscout.current_profile())
+        self.nightscout.upload_entry({'defaultProfile': 'A', 'startDate': '2024-01-01T00:00:00Z'}, entity='profile')
+        self.nightscout.upload_entry({'defaultProfile': 'B', 'startDate': '2024-01-02T00:00:00Z'}, entity='profile')
+
+        profile = self.nightscout.current_profile()
+        self.assertEqual(profile['defaultProfile'], 'B')
+        profile['defaultProfile'] = 'C'
+        self.nightscout.put_entry(profile, entity='profile')
+        self.assertEqual(self.nightscout.current_profile()['defaultProfile'], 'C')
+        self.assertEqual(len(self.fake.collections['profile']), 2)
+
+    def test_post_array(self):
+        import requests
+        r = requests.post(self.fake.url + 'api/v1/treatments', json=[{'eventType': 'A'}, {'eventType': 'B'}], headers={'api-secret': 'secret'})
+        self.assertEqual([d['eventType'] for d in r.json()], ['A', 'B'])
+        self.assertEqual(len(self.fake.collections['treatments']), 2)
+
+    def test_upload_entries(self):
+        entries = [{'eventType': 'Temp Basal', 'created_at': '2024-01-01 10:%02d:00-05:00' % i} for i in range(5)]
+        self.nightscout.upload_entries(entries, batch_size=2)
+        self.assertEqual(self.fake.requests[('POST', 'treatments')], 3)
+        self.assertEqual([d['created_at'] for d in self.fake.collections['treatments']], [e['created_at'] for e in entries])
+
+        self.nightscout.upload_entries(entries[:2], entity='entries')
+        self.assertEqual(self.fake.requests[('POST', 'entries')], 2)
+
+    def test_unauthorized(self):
+        with self.assertRaises(ApiException):
+            NightscoutApi(self.fake.url, 'wrong').upload_entry({'eventType': 'A'})
+        self.assertEqual(self.fake.collections['treatments'], [])
+
+    def test_requests_counted(self):
+        self.nightscout.upload_entry({'eventType': 'A'})
+        self.nightscout.last_uploaded_entry('A')
+        self.assertEqual(self.fake.requests[('POST', 'treatments')], 1)
+        self.assertEqual(self.fake.requests[('GET', 'treatments')], 1)
+
+
+class TestFaults(unittest.TestCase):
+    def test_error_rate(self):
+        with FakeNightscout(error_rate=0.5, error_status=503, seed=1) as fake:
+            nightscout = NightscoutApi(fake.url, 'secret')
+            failures = 0
+            for i in range(40):
+                try:
+                    nightscout.upload_entry({'eventType': 'A'})
+                except ApiException as e:
+                    self.assertEqual(e.status_code, 503)
+                    failures += 1
+            self.assertTrue(10 < failures < 30)
+            self.assertEqual(len(fake.collections['treatments']), 40 - failures)
+
+    def test_latency(self):
+        with FakeNightscout(latency=(0.05, 0.1)) as fake:
+            start = time.monotonic()
+            NightscoutApi(fake.url, 'secret').api_status()
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+
+class TestSyncToFakeNightscout(unittest.TestCase):
+    def test_process_time_range(self):
+        secret = build_secrets(TIMEZONE_NAME='America/New_York', PUMP_SERIAL_NUMBER=None)
+        with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+            f.write(b''.join(SyntheticPump(start=datetime.datetime(2024, 1, 1)).events(1)))
+            f.flush()
+            tconnect = ReplayTConnectApi([f.name], secret)
+        device = tconnect.tandemsource.pump_event_metadata()[0]
+
+        with FakeNightscout(secret='secret') as fake:
+            nightscout = NightscoutApi(fake.url, 'secret')
+            time_start, time_end = arrow.get('2024-01-01T00:00:00-05:00'), arrow.get('2024-01-01T23:59:59-05:00')
+            def sync():
+                return ProcessTimeRange(tconnect, nightscout, device, pretend=False, secret=secret, features=[BASAL, BOLUS, PUMP_EVENTS]).process(time_start, time_end)
+
+            added, _ = sync()
+            self.assertGreater(added, 0)
+            self.assertEqual(len(fake.collections['treatments']), added)
+            self.assertEqual(len([t for t in fake.collections['treatments'] if t['eventType'] == 'Combo Bolus']), 3)
+
+            # Everything was already uploaded
+            self.assertEqual(sync()[0], 0)
+
+    def test_process_time_range_batched(self):
+        secret = build_secrets(TIMEZONE_NAME='America/New_York', PUMP_SERIAL_NUMBER=None, NS_UPLOAD_BATCH_SIZE=100)
+        with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+            f.write(b''.join(SyntheticPump(start=datetime.datetime(2024, 1, 1)).events(1)))
+            f.flush()
+            tconnect = ReplayTConnectApi([f.name], secret)
+        device = tconnect.tandemsource.pump_event_metadata()[0]
+
+        with FakeNightscout(secret='secret') as fake:
+            nightscout = NightscoutApi(fake.url, 'secret')
+            time_start, time_end = arrow.get('2024-01-01T00:00:00-05:00'), arrow.get('2024-01-01T23:59:59-05:00')
+            added, _ = ProcessTimeRange(tconnect, nightscout, device, pretend=False, secret=secret, features=[BASAL, CGM]).process(time_start, time_end)
+
+            self.assertEqual(len(fake.collections['treatments']) + len(fake.collections['entries']), added)
+            # 288 basal treatments and 288 readings, 100 to a request
+            self.assertEqual(fake.requests[('POST', 'treatments')], 3)
+            self.assertEqual(fake.requests[('POST', 'entries')], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+
+import arrow
+
+from tconnectsync.api.common import ApiException
+from tconnectsync.eventparser import events as eventtypes
+from tconnectsync.eventparser.generic import Events, decode_raw_events
+from tconnectsync.fake.nightscout import FakeNightscout
+from tconnectsync.fake.tandemsource import FakeTandemSource, FakeTConnectApi, FakeTandemSourceApi, SimulatedClock
+from tconnectsync.features import BASAL, BOLUS, PUMP_EVENTS
+from tconnectsync.nightscout import NightscoutApi
+from tconnectsync.sync.tandemsource.autoupdate import TandemSourceAutoupdate
+
+from ..secrets import build_secrets
+
+
+class TestSimulatedClock(unittest.TestCase):
+    def test_advance(self):
+        clock = SimulatedClock(start=datetime.datetime(2024, 1, 1), speed=0)
+        self.assertEqual(clock.now(), datetime.datetime(2024, 1, 1))
+        clock.advance(90)
+        self.assertEqual(clock.now(), datetime.datetime(2024, 1, 1, 0, 1, 30))
+
+
+class TestFakeTandemSource(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock(start=datetime.datetime(2024, 1, 10, 12, 2), speed=0)
+        self.fake = FakeTandemSource(pumps=2, days=3, clock=self.clock).serve()
+        self.addCleanup(self.fake.shutdown)
+        self.secret = build_secrets(TIMEZONE_NAME='America/New_York')
+        self.api = FakeTandemSourceApi(self.fake, self.secret)
+
+    def test_metadata(self):
+        metadata = self.api.pump_event_metadata()
+        self.assertEqual([p['serialNumber'] for p in metadata], ['10000001', '10000002'])
+        self.assertEqual(metadata[0]['minDateWithEvents'], '2024-01-07T00:00:00-05:00')
+        self.assertEqual(metadata[0]['maxDateWithEvents'], '2024-01-10T12:00:00-05:00')
+        self.assertEqual(self.api.pumper_info()['pumperId'], self.fake.pumper_id)
+
+    def test_metadata_if_changed(self):
+        self.assertIsNotNone(self.api.pump_event_metadata_if_changed())
+        self.assertIsNone(self.api.pump_event_metadata_if_changed())
+
+        # Not yet time for the next upload
+        self.clock.advance(60)
+        self.assertIsNone(self.api.pump_event_metadata_if_changed())
+
+        self.clock.advance(4 * 60)
+        self.assertEqual(self.api.pump_event_metadata_if_changed()[0]['maxDateWithEvents'], '2024-01-10T12:05:00-05:00')
+
+    def test_pump_events(self):
+        device_id = self.api.pump_event_metadata()[0]['tconnectDeviceId']
+        events = list(self.api.pump_events(device_id, '2024-01-10', '2024-01-10'))
+        self.assertEqual({e.eventTimestamp.date() for e in events}, {datetime.date(2024, 1, 10)})
+        self.assertLessEqual(max(e.eventTimestamp for e in events), arrow.get('2024-01-10T12:00:00-05:00'))
+
+        # Only the breakfast bolus has been uploaded
+        self.assertEqual(len([e for e in events if isinstance(e, eventtypes.LidBolusCompleted)]), 1)
+
+        self.clock.advance(60 * 60)
+        later = list(self.api.pump_events(device_id, '2024-01-10', '2024-01-10'))
+        self.assertEqual(len([e for e in later if isinstance(e, eventtypes.LidBolusCompleted)]), 2)
+
+    def test_pump_events_ids(self):
+        device_id = self.api.pump_event_metadata()[1]['tconnectDeviceId']
+        raw = self.api.pump_events_raw(device_id, '2024-01-07', '2024-01-08', event_ids_filter=[eventtypes.LidCartridgeFilled.ID])
+        events = list(Events(decode_raw_events(raw), timezone='America/New_York'))
+        self.assertEqual([type(e) for e in events], [eventtypes.LidCartridgeFilled])
+
+    def test_history_extends_with_clock(self):
+        device_id = self.api.pump_event_metadata()[0]['tconnectDeviceId']
+        self.clock.advance(3 * 24 * 60 * 60)
+        events = list(self.api.pump_events(device_id, '2024-01-13', '2024-01-13'))
+        self.assertEqual(max(e.eventTimestamp for e in events).date(), datetime.date(2024, 1, 13))
+
+    def test_unauthorized(self):
+        self.api.accessToken = 'wrong'
+        with self.assertRaises(ApiException) as cm:
+            self.api.pump_event_metadata()
+        self.assertEqual(cm.exception.status_code, 401)
+
+    def test_requests_counted_by_endpoint(self):
+        self.api.pump_event_metadata()
+        self.assertEqual(self.fake.requests[('GET', 'api/reports/reportsfacade/{id}/pumpeventmetadata')], 1)
+
+
+class TestAutoupdateWithFakes(unittest.TestCase):
+    def test_cycles(self):
+        clock = SimulatedClock(start=datetime.datetime.now() - datetime.timedelta(hours=3), speed=0)
+        secret = build_secrets(TIMEZONE_NAME='America/New_York', PUMP_SERIAL_NUMBER='10000001')
+        with FakeTandemSource(days=1, clock=clock) as tandemsource, FakeNightscout(secret='secret') as nightscout:
+            tconnect = FakeTConnectApi(tandemsource, secret)
+            ns = NightscoutApi(nightscout.url, 'secret')
+            autoupdate = TandemSourceAutoupdate(secret)
+            features = [BASAL, BOLUS, PUMP_EVENTS]
+
+            autoupdate.cycle(tconnect, ns, pretend=False, features=features)
+            uploaded = len(nightscout.collections['treatments'])
+            self.assertGreater(uploaded, 0)
+
+            # No upload since the last cycle: only the metadata is requested
+            metadata_requests = tandemsource.requests[('GET', 'api/reports/reportsfacade/{id}/pumpeventmetadata')]
+            autoupdate.cycle(tconnect, ns, pretend=False, features=features)
+            self.assertEqual(len(nightscout.collections['treatments']), uploaded)
+            self.assertEqual(tandemsource.requests[('GET', 'api/reports/reportsfacade/{id}/pumpeventmetadata')], metadata_requests + 1)
+
+            clock.advance(2 * 60 * 60)
+            autoupdate.cycle(tconnect, ns, pretend=False, features=features)
+            self.assertGreater(len(nightscout.collections['treatments']), uploaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,7 +12,10 @@ class NightscoutApi(tconnectsync.nightscout.NightscoutApi):
         self.put_entries = collections.defaultdict(list)
 
     def upload_entry(self, ns_format, entity='treatments'):
-        self.uploaded_entries[entity].append(ns_format)
+        if isinstance(ns_format, list):
+            self.uploaded_entries[entity].extend(ns_format)
+        else:
+            self.uploaded_entries[entity].append(ns_format)
 
     def delete_entry(self, ns_path):
         self.deleted_entries.append(ns_path)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import unittest
+import arrow
 from tconnectsync.parser.nightscout import NightscoutEntry, InvalidBolusTypeException, tandem_to_ns_time, tandem_to_ns_time_seconds
 from tconnectsync.domain.device_settings import Profile, ProfileSegment, DeviceSettings
 from .test_profile_data import DEVICE_PROFILE_A, DEVICE_SETTINGS, NS_PROFILE_A
@@ -158,6 +159,12 @@ class TestNightscoutEntry(unittest.TestCase):
             }
         )
 
+    def test_entry_created_at_formats(self):
+        for created_at in ("2021-10-24T02:17:14+00:00", "2021-10-24T02:17:14Z", arrow.get("2021-10-23T22:17:14-04:00").datetime):
+            entry = NightscoutEntry.entry(sgv=152, created_at=created_at)
+            self.assertEqual(entry["date"], 1635041834000)
+            self.assertEqual(entry["dateString"], arrow.get(created_at).strftime('%Y-%m-%dT%H:%M:%S%z'))
+
     def test_sitechange(self):
         self.assertEqual(
             NightscoutEntry.sitechange(
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import unittest
+import time
+
+from tconnectsync.sync.tandemsource.autoupdate import TandemSourceAutoupdate
+from ...secrets import build_secrets
+
+
+class FakeTConnectApi:
+    def tandemsource_circuit_open_seconds(self):
+        return 0
+
+
+class TestTandemSourceAutoupdateRolling(unittest.TestCase):
+    def setUp(self):
+        self.u = TandemSourceAutoupdate(build_secrets(
+            AUTOUPDATE_SCHEDULER='rolling',
+            AUTOUPDATE_DEFAULT_SLEEP_SECONDS=300,
+            AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS=60,
+            AUTOUPDATE_NO_DATA_FAILURE_MINUTES=1000,
+            AUTOUPDATE_FAILURE_MINUTES=1000,
+        ))
+        self.max_date = '2024-01-01T00:00:00'
+        self.u.choose_device = lambda tconnect: {'tconnectDeviceId': 'abcdef', 'maxDateWithEvents': self.max_date}
+
+    def cycle(self, max_date=None):
+        if max_date:
+            self.max_date = max_date
+        return self.u.cycle(FakeTConnectApi(), None, pretend=True)
+
+    def test_pretend_does_not_track_time_between_updates(self):
+        for i in range(5):
+            self.assertEqual(self.cycle('2024-01-01T00:%02d:00' % (i * 5)), (None, 300))
+        self.assertEqual(self.u.scheduler.time_diffs_between_updates, [])
+
+    def test_unexpected_no_index_sleep(self):
+        self.u.last_event_time = time.time()
+        self.cycle()
+        self.assertEqual(self.cycle(), (None, 300))
+        self.assertEqual(self.cycle(), (None, 300))
+        self.assertEqual(self.cycle(), (None, 60))
+
+        self.assertEqual(self.cycle('2024-01-01T00:05:00'), (None, 300))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import unittest
+import random
+
+from tconnectsync.sync.tandemsource.autoupdate_scheduler import RollingMeanScheduler, UploadPhaseScheduler, build_scheduler, percentile, simulate
+from ...secrets import build_secrets
+
+
+def upload_times(count, cadence, phase=0, jitter=0, start=1_700_000_000, seed=1):
+    rng = random.Random(seed)
+    return [start + phase + i * cadence + rng.uniform(0, jitter) for i in range(count)]
+
+
+class TestRollingMeanScheduler(unittest.TestCase):
+    def secret(self, **kwargs):
+        return build_secrets(**{
+            'AUTOUPDATE_DEFAULT_SLEEP_SECONDS': 300,
+            'AUTOUPDATE_MAX_SLEEP_SECONDS': 1500,
+            'AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS': 60,
+            'AUTOUPDATE_USE_FIXED_SLEEP': False,
+            **kwargs
+        })
+
+    def test_default_sleep_until_three_updates(self):
+        s = RollingMeanScheduler(self.secret())
+        s.new_data(1000, 900)
+        s.new_data(1600, 1500)
+        s.new_data(2200, 2100)
+        self.assertEqual(s.next_sleep(2200), (300, False))
+
+        s.new_data(2800, 2700)
+        self.assertEqual(s.next_sleep(2800), (700, False))
+
+    def test_mean_of_last_ten_updates_capped(self):
+        s = RollingMeanScheduler(self.secret(AUTOUPDATE_MAX_SLEEP_SECONDS=500))
+        s.new_data(0, 0)
+        for i in range(1, 15):
+            s.new_data(i * 1000 + 400, i * 1000)
+        self.assertEqual(len(s.time_diffs_between_updates), 10)
+        self.assertEqual(s.next_sleep(15000), (500, False))
+
+    def test_fixed_sleep(self):
+        s = RollingMeanScheduler(self.secret(AUTOUPDATE_USE_FIXED_SLEEP=True))
+        for i in range(5):
+            s.new_data(i * 1000 + 400, i * 1000)
+        self.assertEqual(s.next_sleep(5000), (300, False))
+
+    def test_unexpected_no_index_after_three_misses(self):
+        s = RollingMeanScheduler(self.secret())
+        s.new_data(1000, 900)
+        s.no_new_data(1300)
+        s.no_new_data(1600)
+        self.assertEqual(s.next_sleep(1600), (300, False))
+
+        s.no_new_data(1900)
+        self.assertEqual(s.next_sleep(1900), (60, True))
+
+        s.new_data(1960, 1950)
+        self.assertEqual(s.next_sleep(1960), (300, False))
+
+
+class TestUploadPhaseScheduler(unittest.TestCase):
+    def secret(self, **kwargs):
+        return build_secrets(**{
+            'AUTOUPDATE_DEFAULT_SLEEP_SECONDS': 300,
+            'AUTOUPDATE_MAX_SLEEP_SECONDS': 1500,
+            'AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS': 60,
+            'AUTOUPDATE_USE_FIXED_SLEEP': False,
+            'AUTOUPDATE_PHASE_CONFIDENCE_PERCENT': 90,
+            **kwargs
+        })
+
+    def test_polls_while_learning(self):
+        s = UploadPhaseScheduler(self.secret())
+        s.new_data(1000, 900)
+        self.assertIsNone(s.cadence())
+        self.assertEqual(s.next_sleep(1000), (60, False))
+
+    def test_learns_cadence_and_wakes_at_window(self):
+        s = UploadPhaseScheduler(self.secret())
+        for i in range(6):
+            s.no_new_data(i * 600 + 100)
+            s.new_data(i * 600 + 140, i * 600 + 120)
+
+        self.assertAlmostEqual(s.cadence(), 600)
+        # Wake half a retry interval before the next expected upload
+        seconds, unexpected = s.next_sleep(3140)
+        self.assertFalse(unexpected)
+        self.assertAlmostEqual(3140 + seconds, 3120 + 600 - 30)
+
+    def test_polls_inside_window_then_reports_missed_window(self):
+        s = UploadPhaseScheduler(self.secret())
+        for i in range(6):
+            s.no_new_data(i * 600 + 100)
+            s.new_data(i * 600 + 140, i * 600 + 120)
+
+        # Inside the expected window, poll again shortly
+        s.no_new_data(3720)
+        seconds, unexpected = s.next_sleep(3720)
+        self.assertFalse(unexpected)
+        self.assertAlmostEqual(seconds, 30)
+
+        # Once the window has passed, sleep until the following one
+        s.no_new_data(3800)
+        seconds, unexpected = s.next_sleep(3800)
+        self.assertTrue(unexpected)
+        self.assertAlmostEqual(3800 + seconds, 3120 + 1200 - 30)
+
+    def test_cadence_ignores_skipped_uploads(self):
+        s = UploadPhaseScheduler(self.secret())
+        for t in [0, 300, 600, 1200, 1500, 1800]:
+            s.no_new_data(t)
+            s.new_data(t + 30, t)
+        self.assertAlmostEqual(s.cadence(), 300)
+
+    def test_ignores_imprecise_uploads_then_relearns(self):
+        s = UploadPhaseScheduler(self.secret())
+        for i in range(6):
+            s.no_new_data(i * 600 + 100)
+            s.new_data(i * 600 + 140, i * 600 + 120)
+
+        # Uploads seen only after a long sleep don't shift the learned phase
+        s.new_data(4000, 3900)
+        s.new_data(4600, 4500)
+        self.assertEqual(len(s.visible_times), 6)
+        self.assertIsNotNone(s.cadence())
+
+        s.new_data(5200, 5100)
+        self.assertIsNone(s.cadence())
+        self.assertEqual(s.next_sleep(5200), (60, False))
+
+
+class TestBuildScheduler(unittest.TestCase):
+    def test_build_scheduler(self):
+        self.assertIsInstance(build_scheduler(build_secrets(AUTOUPDATE_SCHEDULER='rolling')), RollingMeanScheduler)
+        self.assertIsInstance(build_scheduler(build_secrets(AUTOUPDATE_SCHEDULER='phase')), UploadPhaseScheduler)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([5], 50), 5)
+        self.assertEqual(percentile([0, 10], 50), 5)
+        self.assertEqual(percentile([0, 10, 20], 100), 20)
+
+
+class TestSimulate(unittest.TestCase):
+    def secret(self, **kwargs):
+        return build_secrets(**{
+            'AUTOUPDATE_DEFAULT_SLEEP_SECONDS': 300,
+            'AUTOUPDATE_MAX_SLEEP_SECONDS': 1500,
+            'AUTOUPDATE_UNEXPECTED_NO_INDEX_SLEEP_SECONDS': 60,
+            'AUTOUPDATE_USE_FIXED_SLEEP': False,
+            'AUTOUPDATE_PHASE_CONFIDENCE_PERCENT': 90,
+            **kwargs
+        })
+
+    def test_simulate_counts_polls_and_latency(self):
+        times = [0, 300, 600, 900]
+        result = simulate(RollingMeanScheduler(self.secret(AUTOUPDATE_USE_FIXED_SLEEP=True)), times, start=-50)
+
+        self.assertEqual(result.polls, 5)
+        self.assertEqual(result.wasted_polls, 1)
+        self.assertEqual(result.latencies, [250, 250, 250, 250])
+
+    def test_phase_scheduler_beats_rolling_mean(self):
+        times = upload_times(200, 900, phase=137, jitter=45)
+
+        rolling = simulate(RollingMeanScheduler(self.secret()), times)
+        phase = simulate(UploadPhaseScheduler(self.secret()), times)
+
+        self.assertEqual(len(phase.latencies), len(times) - 1)
+        self.assertLess(phase.mean_latency, rolling.mean_latency)
+        self.assertLess(phase.p95_latency, 60)
+        self.assertLess(phase.wasted_polls / len(times), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import unittest
+import arrow
+
+from tconnectsync.sync.tandemsource.helpers import TimestampSortedEvents, sort_by_timestamp, watermark_index
+from tconnectsync.eventparser.generic import Event
+
+from .test_process import BASAL_EVENT_1, BASAL_EVENT_2, CGM_EVENT_NORMAL
+
+
+class TestSortByTimestamp(unittest.TestCase):
+    def test_sorts_events(self):
+        a, b, c = Event(BASAL_EVENT_1), Event(BASAL_EVENT_2), Event(CGM_EVENT_NORMAL)
+
+        events = sort_by_timestamp([c, a, b])
+
+        self.assertIsInstance(events, TimestampSortedEvents)
+        self.assertEqual(events, [a, b, c])
+        self.assertEqual(events, sorted([c, a, b], key=lambda x: x.eventTimestamp))
+
+    def test_sorted_events_are_not_sorted_again(self):
+        events = sort_by_timestamp([Event(BASAL_EVENT_2), Event(BASAL_EVENT_1)])
+        self.assertIs(sort_by_timestamp(events), events)
+
+    def test_pump_clock_change(self):
+        a, b, c = Event(BASAL_EVENT_1), Event(BASAL_EVENT_2), Event(CGM_EVENT_NORMAL)
+        # The pump clock was set back between b and c, so c has a later
+        # seqNum but an earlier timestamp
+        c.raw.timestampRaw = a.raw.timestampRaw - 60
+
+        self.assertEqual(sort_by_timestamp([a, b, c]), [c, a, b])
+
+class TestWatermarkIndex(unittest.TestCase):
+    def setUp(self):
+        # 13:12:40, 13:17:40 and 13:22:40 on 2025-11-18 -05:00
+        self.events = sort_by_timestamp([Event(BASAL_EVENT_1), Event(BASAL_EVENT_2), Event(CGM_EVENT_NORMAL)])
+
+    def test_no_watermark(self):
+        self.assertEqual(watermark_index(self.events, None), 0)
+        self.assertEqual(watermark_index([], arrow.get('2025-11-18T13:00:00-05:00')), 0)
+
+    def test_watermark(self):
+        self.assertEqual(watermark_index(self.events, arrow.get('2025-11-18T13:00:00-05:00')), 0)
+        self.assertEqual(watermark_index(self.events, arrow.get('2025-11-18T13:12:40-05:00')), 1)
+        self.assertEqual(watermark_index(self.events, arrow.get('2025-11-18T13:20:00-05:00')), 2)
+        self.assertEqual(watermark_index(self.events, arrow.get('2025-11-18T13:22:40-05:00')), 3)
+
+    def test_watermark_in_other_timezone(self):
+        self.assertEqual(watermark_index(self.events, arrow.get('2025-11-18T18:17:40+00:00')), 2)
+        self.assertEqual(watermark_index(self.events, '2025-11-18T18:17:39Z'), 1)
+
+    def test_matches_linear_scan(self):
+        start = arrow.get('2025-11-18T13:10:00-05:00')
+        for minutes in range(0, 16):
+            watermark = start.shift(minutes=minutes)
+            expected = len([e for e in self.events if e.eventTimestamp <= watermark])
+            self.assertEqual(watermark_index(self.events, watermark), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+import threading
+import time
+
+from tconnectsync.sync.tandemsource.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_runs_stages_in_order(self):
+        p = Pipeline(range(10), [lambda x: x * 2, lambda x: x + 1])
+        self.assertEqual(list(p), [2 * i + 1 for i in range(10)])
+
+    def test_stages_run_on_own_threads(self):
+        threads = []
+        def record(x):
+            threads.append(threading.current_thread().name)
+            return x
+
+        list(Pipeline(range(3), [record], name='test'))
+        self.assertEqual(set(threads), {'test-record'})
+
+    def test_bounded_queues_hold_back_source(self):
+        produced = []
+        def source():
+            for i in range(20):
+                produced.append(i)
+                yield i
+
+        it = iter(Pipeline(source(), [lambda x: x], queue_size=1))
+        self.assertEqual(next(it), 0)
+        time.sleep(0.2)
+        # One item in each of the two queues, one held by the stage and
+        # one waiting to be put by the source
+        self.assertLessEqual(len(produced), 5)
+        self.assertEqual(list(it), list(range(1, 20)))
+
+    def test_stage_failure_is_raised(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError('bad item')
+            return x
+
+        seen = []
+        with self.assertRaisesRegex(ValueError, 'bad item'):
+            for x in Pipeline(range(10), [fail]):
+                seen.append(x)
+        self.assertEqual(seen, [0, 1, 2])
+
+    def test_stops_stages_when_consumer_stops(self):
+        p = Pipeline(iter(range(1000)), [lambda x: x], queue_size=1)
+        for x in p:
+            if x == 2:
+                break
+        self.assertEqual(p._threads, [])
+
+if __name__ == '__main__':
+    unittest.main()
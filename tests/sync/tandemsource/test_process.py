@@ -3,7 +3,9 @@
 import unittest
 import arrow
 
-from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+from tconnectsync.sync.tandemsource.process import ProcessTimeRange, ChunkRouter, day_chunks
+from tconnectsync.features import BASAL, CGM
+from tconnectsync.util.timing import Timings
 from tconnectsync.eventparser import events as eventtypes
 from tconnectsync.eventparser.generic import Event
 
@@ -146,5 +148,180 @@ class TestProcessTimeRangeBasalDuration(unittest.TestCase):
         self.assertEqual(basal_2['duration'], 5.0)
 
 
+class TestProcessTimeRangeConcurrent(unittest.TestCase):
+    def build_process(self, workers):
+        tconnect = TConnectApi()
+        tconnect._tandemsource = FakeTandemSourceApi()
+        tconnect._tandemsource.events = [Event(BASAL_EVENT_1), Event(BASAL_EVENT_2), Event(CGM_EVENT_NORMAL)]
+        nightscout = NightscoutApi()
+        nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+        nightscout.last_uploaded_bg_entry = lambda *args, **kwargs: None
+
+        process = ProcessTimeRange(
+            tconnect,
+            nightscout,
+            {'tconnectDeviceId': 'test-device-123', 'maxDateWithEvents': '2025-11-18T13:00:00-05:00'},
+            pretend=False,
+            secret=build_secrets(FETCH_ALL_EVENT_TYPES=False, PROCESSOR_WORKERS=workers),
+            features=[BASAL, CGM]
+        )
+        return process, nightscout
+
+    def run_process(self, workers):
+        process, nightscout = self.build_process(workers)
+        with self.assertLogs('tconnectsync.sync.tandemsource', level='INFO') as logs:
+            count, last_seqnum = process.process(arrow.get('2025-11-18T13:00:00-05:00'), arrow.get('2025-11-18T13:29:00-05:00'))
+        messages = [r.getMessage() for r in logs.records if 'Running' not in r.getMessage()]
+        return count, last_seqnum, nightscout.uploaded_entries, messages
+
+    def test_concurrent_matches_sequential(self):
+        sequential = self.run_process(1)
+        concurrent = self.run_process(4)
+
+        self.assertEqual(concurrent[0], 3)
+        self.assertEqual(concurrent[0], sequential[0])
+        self.assertEqual(concurrent[1], sequential[1])
+        self.assertEqual(concurrent[2], sequential[2])
+        self.assertEqual(concurrent[3], sequential[3])
+
+    def test_records_stage_timings(self):
+        process, nightscout = self.build_process(4)
+        process.timings = Timings()
+        process.process(arrow.get('2025-11-18T13:00:00-05:00'), arrow.get('2025-11-18T13:29:00-05:00'))
+
+        self.assertEqual(set(process.timings.report()['stages'].keys()), {
+            'events.build',
+            'events.classify',
+            'ProcessBasal.transform',
+            'ProcessBasal.upload',
+            'ProcessCGMReading.transform',
+            'ProcessCGMReading.upload',
+        })
+
+    def test_concurrent_raises_processor_failure(self):
+        process, nightscout = self.build_process(4)
+
+        def fail(entry, *args, **kwargs):
+            raise RuntimeError('upload failed')
+        nightscout.upload_entry = fail
+
+        with self.assertRaisesRegex(RuntimeError, 'upload failed'):
+            process.process(arrow.get('2025-11-18T13:00:00-05:00'), arrow.get('2025-11-18T13:29:00-05:00'))
+
+
+class DatedFakeTandemSourceApi(FakeTandemSourceApi):
+    """Returns only the events on the requested dates"""
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def pump_events(self, device_id, time_start, time_end, fetch_all_event_types=False):
+        self.requests.append((str(time_start), str(time_end)))
+        start, end = arrow.get(time_start).date(), arrow.get(time_end).date()
+        return iter([e for e in self.events if start <= e.eventTimestamp.date() <= end])
+
+
+class TestProcessTimeRangePipelined(unittest.TestCase):
+    def basal(self, timestamp, seqnum):
+        e = Event(BASAL_EVENT_1)
+        e.raw.timestampRaw += (arrow.get(timestamp) - e.eventTimestamp).total_seconds()
+        e.raw.seqNum = seqnum
+        return e
+
+    def run_process(self, chunk_days):
+        tconnect = TConnectApi()
+        tconnect._tandemsource = DatedFakeTandemSourceApi()
+        tconnect._tandemsource.events = [
+            self.basal('2025-11-16T22:00:00-05:00', 1),
+            self.basal('2025-11-16T23:50:00-05:00', 2),
+            self.basal('2025-11-17T00:10:00-05:00', 3),
+            self.basal('2025-11-18T09:00:00-05:00', 4),
+        ]
+        nightscout = NightscoutApi()
+        last = [None]
+        def last_uploaded_entry(*args, **kwargs):
+            return {'created_at': last[0]} if last[0] else None
+        nightscout.last_uploaded_entry = last_uploaded_entry
+        upload_entry = nightscout.upload_entry
+        def upload(entry, *args, **kwargs):
+            last[0] = entry['created_at']
+            return upload_entry(entry, *args, **kwargs)
+        nightscout.upload_entry = upload
+
+        process = ProcessTimeRange(
+            tconnect,
+            nightscout,
+            {'tconnectDeviceId': 'test-device-123', 'maxDateWithEvents': '2025-11-18T13:00:00-05:00'},
+            pretend=False,
+            secret=build_secrets(FETCH_ALL_EVENT_TYPES=False, PIPELINE_CHUNK_DAYS=chunk_days, TIMEZONE_NAME='America/New_York'),
+            features=[BASAL]
+        )
+        count, last_seqnum = process.process(arrow.get('2025-11-16T12:00:00-05:00'), arrow.get('2025-11-18T13:00:00-05:00'))
+        return count, last_seqnum, nightscout.uploaded_entries['treatments'], tconnect._tandemsource.requests
+
+    def test_pipelined_matches_single_fetch(self):
+        single = self.run_process(0)
+        pipelined = self.run_process(1)
+
+        self.assertEqual(len(single[3]), 1)
+        self.assertEqual(pipelined[3], [
+            ('2025-11-16', '2025-11-16'),
+            ('2025-11-17', '2025-11-17'),
+            ('2025-11-18', '2025-11-18'),
+        ])
+        self.assertEqual(pipelined[0], 4)
+        self.assertEqual(pipelined[:3], single[:3])
+
+    def test_day_chunks(self):
+        self.assertEqual([(str(a), str(b), last) for a, b, last in day_chunks('2025-11-10T12:00:00', '2025-11-14T01:00:00', 2)], [
+            ('2025-11-10', '2025-11-11', False),
+            ('2025-11-12', '2025-11-13', False),
+            ('2025-11-14', '2025-11-14', True),
+        ])
+        self.assertEqual(len(list(day_chunks('2025-11-10T12:00:00', '2025-11-10T13:00:00', 1))), 1)
+
+    def test_router_carries_events_near_chunk_end(self):
+        router = ChunkRouter('America/New_York', 60)
+        first = [self.basal('2025-11-16T20:00:00-05:00', 1), self.basal('2025-11-16T21:00:00-05:00', 2), self.basal('2025-11-16T23:50:00-05:00', 3)]
+        second = [self.basal('2025-11-17T00:10:00-05:00', 4)]
+
+        a = router.route(first[:2], (arrow.get('2025-11-16').date(), arrow.get('2025-11-16').date(), False))
+        # The last event of each class is held back
+        self.assertEqual([e.seqNum for e in a.for_eventclass['BASAL']], [1])
+        self.assertEqual(a.class_time_end['BASAL'], first[1].eventTimestamp)
+
+        router = ChunkRouter('America/New_York', 60)
+        a = router.route(first, (arrow.get('2025-11-16').date(), arrow.get('2025-11-16').date(), False))
+        # Events in the last hour of the chunk are held back
+        self.assertEqual([e.seqNum for e in a.for_eventclass['BASAL']], [1, 2])
+        self.assertEqual(a.class_time_end['BASAL'], first[2].eventTimestamp)
+
+        b = router.route(second, (arrow.get('2025-11-17').date(), arrow.get('2025-11-17').date(), True))
+        self.assertEqual([e.seqNum for e in b.for_eventclass['BASAL']], [3, 4])
+        self.assertEqual(b.class_time_end, {})
+
+    def test_router_uses_processor_held_events(self):
+        events = [self.basal('2025-11-16T20:00:00-05:00', 1), self.basal('2025-11-16T21:00:00-05:00', 2)]
+        held = []
+        def held_events(clazz, class_events):
+            held.append((clazz, [e.seqNum for e in class_events]))
+            return []
+
+        router = ChunkRouter('America/New_York', 0, held_events=held_events)
+        a = router.route(events, (arrow.get('2025-11-16').date(), arrow.get('2025-11-16').date(), False))
+
+        self.assertEqual(held, [('BASAL', [1, 2])])
+        self.assertEqual([e.seqNum for e in a.for_eventclass['BASAL']], [1, 2])
+        self.assertEqual(router.carried, [])
+
+    def test_router_releases_events_held_too_long(self):
+        events = [self.basal('2025-11-14T20:00:00-05:00', 1), self.basal('2025-11-16T21:00:00-05:00', 2)]
+
+        router = ChunkRouter('America/New_York', 0, held_events=lambda clazz, class_events: class_events)
+        a = router.route(events, (arrow.get('2025-11-16').date(), arrow.get('2025-11-16').date(), False))
+
+        self.assertEqual([e.seqNum for e in a.for_eventclass['BASAL']], [1])
+        self.assertEqual([e.seqNum for e in router.carried], [2])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import arrow
+
+from tconnectsync.sync.tandemsource.process_basal import ProcessBasal
+from tconnectsync.eventparser import events as eventtypes
+from tconnectsync.eventparser.generic import Event
+from tconnectsync.eventparser.synthetic import encode_event, timestamp_raw
+
+from ...api.fake import TConnectApi
+from ...nightscout_fake import NightscoutApi
+from ...secrets import build_secrets
+
+
+def basal_delivery(minutes, rate, seq_num, source=3):
+    dt = datetime.datetime(2024, 1, 1, 10, 0) + datetime.timedelta(minutes=minutes)
+    return Event(encode_event(eventtypes.LidBasalDelivery, timestamp_raw(dt), seq_num, commandedRateSourceRaw=source, commandedRate=rate), timezone='America/New_York')
+
+
+class TestProcessBasalCompaction(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        self.tconnect = TConnectApi()
+        self.nightscout = NightscoutApi()
+        self.nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+        self.events = [
+            basal_delivery(0, 800, 1),
+            basal_delivery(5, 800, 2),
+            basal_delivery(10, 800, 3),
+            basal_delivery(15, 900, 4),
+            basal_delivery(20, 900, 5, source=2),
+            basal_delivery(25, 900, 6, source=2),
+        ]
+        self.time_end = arrow.get('2024-01-01T10:32:00-05:00')
+
+    def process(self, **secrets):
+        process = ProcessBasal(self.tconnect, self.nightscout, 'abcdef', pretend=False, secret=build_secrets(**secrets))
+        return process.process(self.events, time_start=None, time_end=self.time_end)
+
+    def test_not_compacted_by_default(self):
+        self.assertEqual([e['duration'] for e in self.process()], [5, 5, 5, 5, 5, 7])
+
+    def test_compacted(self):
+        entries = self.process(COMPACT_BASAL=True)
+        self.assertEqual(
+            [(e['created_at'], e['absolute'], e['duration'], e['pump_event_id']) for e in entries],
+            [
+                ('2024-01-01 10:00:00-05:00', 0.8, 15, '1'),
+                ('2024-01-01 10:15:00-05:00', 0.9, 5, '4'),
+                ('2024-01-01 10:20:00-05:00', 0.9, 5, '5'),
+                # The newest event is never merged into
+                ('2024-01-01 10:25:00-05:00', 0.9, 7, '6'),
+            ])
+
+    def test_compacted_after_last_upload(self):
+        self.nightscout.last_uploaded_entry = lambda *args, **kwargs: {'created_at': '2024-01-01 10:05:00-05:00'}
+        entries = self.process(COMPACT_BASAL=True)
+        self.assertEqual([(e['pump_event_id'], e['duration']) for e in entries], [('3', 5), ('4', 5), ('5', 5), ('6', 7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import os
+import tempfile
+
+from tconnectsync.sync.tandemsource.process_bolus import ProcessBolus
+from tconnectsync.sync.tandemsource.bolus_joiner import BolusJoiner
+from tconnectsync.eventparser import events as eventtypes
+from tconnectsync.eventparser.generic import Event
+from tconnectsync.eventparser.synthetic import encode_event, timestamp_raw
+
+from ...api.fake import TConnectApi
+from ...nightscout_fake import NightscoutApi
+from ...secrets import build_secrets
+
+
+def bolus_event(event_type, minutes, seq_num, **fields):
+    dt = datetime.datetime(2024, 1, 1, 12, 0) + datetime.timedelta(minutes=minutes)
+    return Event(encode_event(event_type, timestamp_raw(dt), seq_num, **fields), timezone='America/New_York')
+
+def requested(bolusid, minutes, seq_num, options=0, carbs=40):
+    return [
+        bolus_event(eventtypes.LidBolusRequestedMsg1, minutes, seq_num, bolusid=bolusid, bolustypeRaw=1, carbamount=carbs, BG=150),
+        bolus_event(eventtypes.LidBolusRequestedMsg2, minutes, seq_num + 1, bolusid=bolusid, optionsRaw=options, standardpercent=50 if options else 100, duration=120 if options else 0),
+        bolus_event(eventtypes.LidBolusRequestedMsg3, minutes, seq_num + 2, bolusid=bolusid, foodbolussize=4, totalbolussize=4),
+    ]
+
+def completed(bolusid, minutes, seq_num, units, event_type=eventtypes.LidBolusCompleted):
+    return bolus_event(event_type, minutes, seq_num, bolusid=bolusid, completionstatusRaw=3, insulindelivered=units, insulinrequested=units)
+
+
+class TestProcessBolus(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        self.nightscout = NightscoutApi()
+        self.nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state_path = os.path.join(tmp.name, 'sync_state')
+
+    def process(self, events, **secrets):
+        secret = build_secrets(TIMEZONE_NAME='America/New_York', **secrets)
+        return ProcessBolus(TConnectApi(), self.nightscout, 'abcdef', pretend=False, secret=secret).process(events, time_start=None, time_end=None)
+
+    def test_standard_bolus(self):
+        entries = self.process(requested(7, 0, 10) + [completed(7, 2, 13, 4.0)])
+        self.assertEqual(entries, [{
+            "eventType": "Combo Bolus",
+            "created_at": "2024-01-01 12:02:00-05:00",
+            "carbs": 40,
+            "insulin": 4.0,
+            "notes": "Standard Bolus",
+            "enteredBy": "Pump (tconnectsync)",
+            "pump_event_id": "13,10,11,12",
+            "glucose": "150",
+        }])
+
+    def test_extended_bolus(self):
+        events = requested(8, 0, 10, options=1) + [
+            completed(8, 2, 13, 2.0),
+            completed(9, 30, 14, 1.0),
+            completed(8, 120, 15, 2.0, event_type=eventtypes.LidBolexCompleted),
+        ]
+        entries = self.process(events)
+        self.assertEqual(
+            [(e['created_at'], e['insulin'], e['carbs'], e['notes'], e['pump_event_id']) for e in entries],
+            [
+                ('2024-01-01 12:02:00-05:00', 2.0, 40, 'Extended Bolus', '13,10,11,12'),
+                # No requested events are known for bolus 9
+                ('2024-01-01 12:30:00-05:00', 1.0, 0, '', '14'),
+                ('2024-01-01 14:00:00-05:00', 2.0, 0, 'Extended Bolus (Extended)', '15,10,11,12'),
+            ])
+
+    def test_held_events(self):
+        events = requested(8, 0, 10, options=1) + [completed(8, 2, 13, 2.0)] + requested(9, 5, 14)
+        process = ProcessBolus(TConnectApi(), self.nightscout, 'abcdef', pretend=False, secret=build_secrets())
+        self.assertEqual([e.seqNum for e in process.held_events(events)], [10, 11, 12, 14, 15, 16])
+
+    def test_split_across_syncs(self):
+        first, second = requested(7, 0, 10), [completed(7, 2, 13, 4.0)]
+
+        # Without SYNC_STATE, the second sync doesn't know the carbs
+        self.assertEqual(self.process(first), [])
+        self.assertEqual(self.process(second)[0]['carbs'], 0)
+
+        self.assertEqual(self.process(first, SYNC_STATE=True, SYNC_STATE_PATH=self.state_path), [])
+        entries = self.process(second, SYNC_STATE=True, SYNC_STATE_PATH=self.state_path)
+        self.assertEqual((entries[0]['carbs'], entries[0]['pump_event_id']), (40, '13,10,11,12'))
+
+        # The completed bolus is no longer kept
+        self.assertEqual(self.process([], SYNC_STATE=True, SYNC_STATE_PATH=self.state_path), [])
+        self.assertEqual(self.process(second, SYNC_STATE=True, SYNC_STATE_PATH=self.state_path)[0]['carbs'], 0)
+
+
+class TestBolusJoiner(unittest.TestCase):
+    def test_only_open_boluses_kept(self):
+        joiner = BolusJoiner()
+        for event in requested(1, 0, 10) + [completed(1, 2, 13, 1.0)] + requested(2, 5, 14):
+            joiner.add(event)
+        self.assertEqual(list(joiner.open.keys()), [2])
+
+    def test_stale_evicted(self):
+        joiner = BolusJoiner()
+        for event in requested(1, 0, 10):
+            joiner.add(event)
+        joiner.add(requested(2, 25 * 60, 14)[0])
+        self.assertEqual(list(joiner.open.keys()), [2])
+
+    def test_state_round_trip(self):
+        joiner = BolusJoiner()
+        for event in requested(1, 0, 10, options=1) + [completed(1, 2, 13, 1.0)]:
+            joiner.add(event)
+
+        restored = BolusJoiner.from_state(joiner.to_state(), timezone='America/New_York')
+        self.assertEqual(restored.open, joiner.open)
+        self.assertEqual(restored.last_seen, joiner.last_seen)
+        event, requested_events = restored.add(completed(1, 120, 14, 1.0, event_type=eventtypes.LidBolexCompleted))
+        self.assertEqual(sorted(e.seqNum for e in requested_events.values()), [10, 11, 12])
+        self.assertEqual(restored.open, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import unittest
+import os
+import tempfile
 import arrow
 
 from tconnectsync.sync.tandemsource.process_user_mode import ProcessUserMode
@@ -9,6 +11,7 @@ from tconnectsync.eventparser.generic import Event
 
 from ...api.fake import TConnectApi
 from ...nightscout_fake import NightscoutApi
+from ...secrets import build_secrets
 
 class TestProcessUserModeSleep(unittest.TestCase):
     maxDiff = None
@@ -276,7 +279,78 @@ class TestProcessUserModeExercise(unittest.TestCase):
         self.assertEqual(self.nightscout.deleted_entries, ['treatments/id_to_delete'])
 
 
+class TestProcessUserModeHeldEvents(unittest.TestCase):
+    def setUp(self):
+        self.process = ProcessUserMode(TConnectApi(), NightscoutApi(), 'abcdef', pretend=False)
+
+    def test_holds_unended_sleep(self):
+        # 2024-12-04 23:00:23-05:00 - sleep start
+        start = Event(b'\x00\xe5\x1f\xd7\\\x87\x00\x10\t\xaa\x00\x01\x00\x01\x00\x00\x01\x00\x00\xf0\x01\x01\x00\x00\x00\x00')
+        # 2024-12-05 09:01:23-05:00 - sleep end
+        stop = Event(b'\x00\xe5\x1f\xd7\xe9c\x00\x10\x10\xf8\x00\x02\x01\x00\x00\x00\x00\x00\x00\xf0\x01\x01\x00\x00\x00\x00')
+
+        self.assertEqual(self.process.held_events([start]), [start])
+        self.assertEqual(self.process.held_events([start, stop]), [])
+        self.assertEqual(self.process.held_events([stop]), [])
+
+
+class TestProcessUserModeSyncState(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.secret = build_secrets(SYNC_STATE=True, SYNC_STATE_PATH=os.path.join(tmp.name, 'sync_state'))
+
+        self.nightscout = NightscoutApi()
+        upload_entry = self.nightscout.upload_entry
+        def upload_with_id(ns_format, entity='treatments'):
+            upload_entry(ns_format, entity)
+            return [dict(ns_format, _id='ns%d' % len(self.nightscout.uploaded_entries[entity]))]
+        self.nightscout.upload_entry = upload_with_id
+
+        # 2024-12-04 23:00:23-05:00 - sleep start
+        self.start = Event(b'\x00\xe5\x1f\xd7\\\x87\x00\x10\t\xaa\x00\x01\x00\x01\x00\x00\x01\x00\x00\xf0\x01\x01\x00\x00\x00\x00')
+        # 2024-12-05 09:01:23-05:00 - sleep end
+        self.stop = Event(b'\x00\xe5\x1f\xd7\xe9c\x00\x10\x10\xf8\x00\x02\x01\x00\x00\x00\x00\x00\x00\xf0\x01\x01\x00\x00\x00\x00')
+
+    def sync(self, events, time_end, pretend=False):
+        process = ProcessUserMode(TConnectApi(), self.nightscout, 'abcdef', pretend=pretend, secret=self.secret)
+        ns_entries = process.process(events, time_start=None, time_end=arrow.get(time_end))
+        process.write(ns_entries)
+        return ns_entries
+
+    def test_open_sleep_kept_between_syncs(self):
+        self.nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+        p = self.sync([self.start], '2024-12-04T23:00:30-05:00')
+        self.assertEqual([e['reason'] for e in p], ['Sleep (Scheduled) - Not Ended'])
+
+        # Later syncs don't query Nightscout, and only process new events
+        def last_uploaded_entry(*args, **kwargs):
+            raise AssertionError('queried Nightscout')
+        self.nightscout.last_uploaded_entry = last_uploaded_entry
+        self.assertEqual(self.sync([self.start], '2024-12-05T01:00:00-05:00'), [])
+
+        p = self.sync([self.start, self.stop], '2024-12-05T09:02:00-05:00')
+        self.assertEqual(self.nightscout.deleted_entries, ['treatments/ns1'])
+        self.assertDictEqual(p[0], {
+            "eventType": 'Sleep',
+            "reason": 'Sleep (Scheduled)',
+            "notes": 'Sleep (Scheduled)',
+            "created_at": '2024-12-04 23:00:23-05:00',
+            "duration": 601.0,
+            "enteredBy": 'Pump (tconnectsync)',
+            "pump_event_id": '1051050,1052920',
+        })
+
+        self.assertEqual(self.sync([self.start, self.stop], '2024-12-05T09:10:00-05:00'), [])
+        self.assertEqual(len(self.nightscout.uploaded_entries['treatments']), 2)
+
+    def test_not_saved_when_pretend(self):
+        self.nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+        self.sync([self.start], '2024-12-04T23:00:30-05:00', pretend=True)
+        self.assertEqual(len(self.sync([self.start], '2024-12-04T23:00:30-05:00')), 1)
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
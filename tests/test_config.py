@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import unittest
+import struct
+
+import arrow
+
+from tconnectsync import secret
+from tconnectsync.config import Config
+from tconnectsync.eventparser.generic import Events
+from tconnectsync.eventparser import events as eventtypes
+
+TANDEM_EPOCH = 1199145600
+
+# LidBgReadingTaken at 2021-12-02 21:58:00 pump time
+BG_READING_TAKEN = struct.pack('>HII', 16, arrow.get('2021-12-02 21:58:00').int_timestamp - TANDEM_EPOCH, 1000) + bytes(16)
+
+
+class TestConfig(unittest.TestCase):
+    def test_defaults_from_secret(self):
+        c = Config()
+        self.assertEqual(c.TIMEZONE_NAME, secret.TIMEZONE_NAME)
+        self.assertEqual(c.AUTOUPDATE_DEFAULT_SLEEP_SECONDS, secret.AUTOUPDATE_DEFAULT_SLEEP_SECONDS)
+
+    def test_overrides_are_instance_scoped(self):
+        a = Config(TIMEZONE_NAME='America/New_York')
+        b = Config(TIMEZONE_NAME='Europe/London')
+
+        self.assertEqual(a.TIMEZONE_NAME, 'America/New_York')
+        self.assertEqual(b.TIMEZONE_NAME, 'Europe/London')
+        self.assertNotEqual(secret.TIMEZONE_NAME, 'Europe/London')
+
+    def test_replace(self):
+        a = Config(TIMEZONE_NAME='America/New_York', CACHE_JWKS=True)
+        b = a.replace(CACHE_JWKS=False)
+
+        self.assertTrue(a.CACHE_JWKS)
+        self.assertFalse(b.CACHE_JWKS)
+        self.assertEqual(b.TIMEZONE_NAME, 'America/New_York')
+
+    def test_unknown_setting(self):
+        with self.assertRaisesRegex(TypeError, 'NOT_A_SETTING'):
+            Config(NOT_A_SETTING=1)
+
+
+class TestEventTimezone(unittest.TestCase):
+    def test_events_use_given_timezone(self):
+        ny, = Events(BG_READING_TAKEN, timezone='America/New_York')
+        london, = Events(BG_READING_TAKEN, timezone='Europe/London')
+
+        self.assertIsInstance(ny, eventtypes.LidBgReadingTaken)
+        self.assertEqual(ny.eventTimestamp.format(), '2021-12-02 21:58:00-05:00')
+        self.assertEqual(london.eventTimestamp.format(), '2021-12-02 21:58:00+00:00')
+
+if __name__ == '__main__':
+    unittest.main()
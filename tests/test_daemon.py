@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import tempfile
+import threading
+import arrow
+import requests_mock
+
+from unittest.mock import patch
+
+from tconnectsync.api.common import RetryPolicy
+from tconnectsync.api.tandemsource import TandemSourceApi
+
+import tconnectsync.secret
+from tconnectsync.daemon import Daemon, DaemonAccount, DaemonConfigError, account_secret, load_accounts
+from tconnectsync.eventparser.generic import Event
+from tconnectsync.sync.tandemsource.process_bolus import ProcessBolus
+from tconnectsync.sync.tandemsource.process_user_mode import ProcessUserMode
+from .api.fake import TConnectApi as FakeTConnectApi
+from .nightscout_fake import NightscoutApi
+from .secrets import build_secrets
+from .sync.tandemsource.test_process_bolus import requested, completed
+
+ACCOUNT = {
+    'TCONNECT_EMAIL': 'a@email.com',
+    'TCONNECT_PASSWORD': 'password',
+    'NS_URL': 'https://a.nightscout/',
+    'NS_SECRET': 'apisecret',
+}
+
+
+class TestAccountSecret(unittest.TestCase):
+    def test_overrides_settings(self):
+        base = build_secrets(PUMP_SERIAL_NUMBER='11111111', AUTOUPDATE_MAX_LOOP_INVOCATIONS=-1)
+        s = account_secret({**ACCOUNT, 'PUMP_SERIAL_NUMBER': '1234', 'AUTOUPDATE_MAX_LOOP_INVOCATIONS': 2}, base=base)
+
+        self.assertEqual(s.TCONNECT_EMAIL, 'a@email.com')
+        self.assertEqual(s.PUMP_SERIAL_NUMBER, '1234')
+        self.assertEqual(s.AUTOUPDATE_MAX_LOOP_INVOCATIONS, 2)
+        self.assertEqual(s.AUTOUPDATE_DEFAULT_SLEEP_SECONDS, base.AUTOUPDATE_DEFAULT_SLEEP_SECONDS)
+        self.assertEqual(base.AUTOUPDATE_MAX_LOOP_INVOCATIONS, -1)
+
+    def test_default_serial_number(self):
+        s = account_secret(ACCOUNT, base=build_secrets(PUMP_SERIAL_NUMBER='11111111'))
+        self.assertIsNone(s.PUMP_SERIAL_NUMBER)
+
+    def test_missing_setting(self):
+        with self.assertRaisesRegex(DaemonConfigError, 'NS_SECRET'):
+            account_secret({k: v for k, v in ACCOUNT.items() if k != 'NS_SECRET'}, base=build_secrets())
+
+    def test_unknown_setting(self):
+        with self.assertRaisesRegex(DaemonConfigError, 'NS_SECRT'):
+            account_secret({**ACCOUNT, 'NS_SECRT': 'x'}, base=build_secrets())
+
+    def test_account_timezone(self):
+        base = build_secrets(TIMEZONE_NAME='America/New_York')
+        s = account_secret({**ACCOUNT, 'TIMEZONE_NAME': 'Europe/London'}, base=base)
+
+        self.assertEqual(s.TIMEZONE_NAME, 'Europe/London')
+        self.assertEqual(base.TIMEZONE_NAME, 'America/New_York')
+
+    def test_process_wide_setting(self):
+        base = build_secrets(ENABLE_TESTING_MODES=False)
+        account_secret({**ACCOUNT, 'ENABLE_TESTING_MODES': False}, base=base)
+
+        with self.assertRaisesRegex(DaemonConfigError, 'ENABLE_TESTING_MODES'):
+            account_secret({**ACCOUNT, 'ENABLE_TESTING_MODES': True}, base=base)
+
+
+class TestLoadAccounts(unittest.TestCase):
+    def test_load_accounts(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'accounts.json')
+            with open(path, 'w') as f:
+                json.dump([
+                    {**ACCOUNT, 'name': 'first', 'features': ['BASAL']},
+                    {**ACCOUNT, 'TCONNECT_EMAIL': 'b@email.com', 'pretend': True},
+                ], f)
+
+            accounts = load_accounts(path)
+
+        self.assertEqual([a.name for a in accounts], ['first', 'b@email.com#1'])
+        self.assertEqual(accounts[0].features, ['BASAL'])
+        self.assertTrue(accounts[1].pretend)
+        self.assertIsNone(accounts[0].tconnect)
+
+    def test_credentials_cache_per_account(self):
+        a = DaemonAccount({**ACCOUNT, 'name': 'first'})
+        b = DaemonAccount({**ACCOUNT, 'TCONNECT_EMAIL': 'b@email.com'}, 1)
+        c = DaemonAccount({**ACCOUNT, 'CACHE_CREDENTIALS_PATH': '/tmp/creds'})
+
+        self.assertTrue(a.secret.CACHE_CREDENTIALS_PATH.endswith('.first'))
+        self.assertTrue(b.secret.CACHE_CREDENTIALS_PATH.endswith('.b@email.com_1'))
+        self.assertEqual(c.secret.CACHE_CREDENTIALS_PATH, '/tmp/creds')
+
+    def test_sync_state_per_account(self):
+        a = DaemonAccount({**ACCOUNT, 'name': 'first'})
+        b = DaemonAccount({**ACCOUNT, 'SYNC_STATE_PATH': '/tmp/state'})
+
+        self.assertTrue(a.secret.SYNC_STATE_PATH.endswith('.first'))
+        self.assertEqual(b.secret.SYNC_STATE_PATH, '/tmp/state')
+
+    def test_unknown_feature(self):
+        with self.assertRaisesRegex(DaemonConfigError, 'NOT_A_FEATURE'):
+            DaemonAccount({**ACCOUNT, 'features': ['NOT_A_FEATURE']})
+
+
+class TestDaemonAccountSyncState(unittest.TestCase):
+    """
+    Two accounts which upload the same pump to different Nightscout sites.
+    """
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with patch.object(tconnectsync.secret, 'SYNC_STATE_PATH', os.path.join(tmp.name, 'sync_state')):
+            self.accounts = [
+                DaemonAccount({**ACCOUNT, 'NS_URL': url, 'SYNC_STATE': True, 'TIMEZONE_NAME': 'America/New_York'}, i)
+                for i, url in enumerate(['https://a.nightscout/', 'https://b.nightscout/'])
+            ]
+
+    def test_bolus_state_per_account(self):
+        a, b = self.accounts
+        def process(account, events):
+            nightscout = NightscoutApi()
+            nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+            return ProcessBolus(FakeTConnectApi(), nightscout, 'abcdef', pretend=False, secret=account.secret).process(events, time_start=None, time_end=None)
+
+        process(a, requested(7, 0, 10))
+        self.assertEqual(process(b, [completed(7, 2, 13, 4.0)])[0]['carbs'], 0)
+        self.assertEqual(process(a, [completed(7, 2, 13, 4.0)])[0]['carbs'], 40)
+
+    def test_user_mode_state_per_account(self):
+        a, b = self.accounts
+        # 2024-12-04 23:00:23-05:00 - sleep start
+        start = Event(b'\x00\xe5\x1f\xd7\\\x87\x00\x10\t\xaa\x00\x01\x00\x01\x00\x00\x01\x00\x00\xf0\x01\x01\x00\x00\x00\x00')
+        def sync(account):
+            nightscout = NightscoutApi()
+            nightscout.last_uploaded_entry = lambda *args, **kwargs: None
+            process = ProcessUserMode(FakeTConnectApi(), nightscout, 'abcdef', pretend=False, secret=account.secret)
+            process.write(process.process([start], time_start=None, time_end=arrow.get('2024-12-04T23:00:30-05:00')))
+            return nightscout.uploaded_entries['treatments']
+
+        self.assertEqual(len(sync(a)), 1)
+        # The other account's Nightscout hasn't seen the sleep yet
+        self.assertEqual(len(sync(b)), 1)
+        self.assertEqual(sync(a), [])
+
+
+METADATA_URL = 'https://source.tandemdiabetes.com/api/reports/reportsfacade/%s/pumpeventmetadata'
+
+def metadata(day):
+    return {'json': [{'tconnectDeviceId': 'device', 'serialNumber': '1234', 'maxDateWithEvents': '2025-01-%02dT00:00:00' % day}]}
+
+def fake_login(self, email, password):
+    self.pumperId = email.split('@')[0]
+    self.accessToken = 'token'
+    self.accessTokenExpiresAt = None
+
+
+class TestDaemonAccountFailures(unittest.TestCase):
+    def test_accounts_back_off_independently(self):
+        accounts = [
+            DaemonAccount({**ACCOUNT, 'TCONNECT_EMAIL': email, 'pretend': True, 'AUTOUPDATE_MAX_LOOP_INVOCATIONS': 3, 'AUTOUPDATE_DEFAULT_SLEEP_SECONDS': 0}, i)
+            for i, email in enumerate(['failing@email.com', 'flaky@email.com'])
+        ]
+
+        with requests_mock.Mocker() as m, \
+             patch.object(TandemSourceApi, 'login', fake_login), \
+             patch.object(RetryPolicy, 'backoff_seconds', return_value=0):
+            m.get(METADATA_URL % 'failing', status_code=500)
+            m.get(METADATA_URL % 'flaky', [{'status_code': 500}] + [metadata(day) for day in range(1, 4)])
+
+            self.assertEqual(Daemon(accounts, workers=2).run(), 0)
+
+        failing, flaky = accounts
+        self.assertGreater(failing.tconnect.tandemsource_circuit_open_seconds(), 0)
+        self.assertEqual(flaky.tconnect.tandemsource_circuit_open_seconds(), 0)
+        self.assertEqual(flaky.autoupdate.last_max_date_with_events, arrow.get('2025-01-03').float_timestamp)
+
+
+class FakeAutoupdate:
+    def __init__(self, max_invocations):
+        self.autoupdate_invocations = 0
+        self.max_invocations = max_invocations
+
+    def finished(self):
+        return self.autoupdate_invocations >= self.max_invocations
+
+
+class FakeAccount:
+    def __init__(self, name, results, max_invocations):
+        self.name = name
+        self.secret = build_secrets(AUTOUPDATE_DEFAULT_SLEEP_SECONDS=0)
+        self.results = list(results)
+        self.max_invocations = max_invocations
+        self.threads = []
+        self.resets = 0
+        self.autoupdate = FakeAutoupdate(max_invocations)
+
+    def reset(self):
+        self.resets += 1
+        invocations = self.autoupdate.autoupdate_invocations
+        self.autoupdate = FakeAutoupdate(self.max_invocations)
+        self.autoupdate.autoupdate_invocations = invocations
+
+    def run_cycle(self):
+        self.threads.append(threading.current_thread().name)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def finished(self):
+        return self.autoupdate.finished()
+
+
+class TestDaemon(unittest.TestCase):
+    def test_runs_accounts_until_finished(self):
+        a = FakeAccount('a', [(None, 0)] * 3, 3)
+        b = FakeAccount('b', [(None, 0)] * 2, 2)
+
+        self.assertEqual(Daemon([a, b], workers=2).run(), 0)
+
+        self.assertEqual(a.results, [])
+        self.assertEqual(b.results, [])
+        self.assertEqual(a.threads, ['a'] * 3)
+        self.assertEqual(b.threads, ['b'] * 2)
+
+    def test_restarts_account_after_failure(self):
+        a = FakeAccount('a', [RuntimeError('failed'), (1, 0), (None, 0), (None, 0)], 3)
+
+        self.assertEqual(Daemon([a], workers=1).run(), 0)
+
+        self.assertEqual(a.results, [(None, 0)])
+        self.assertEqual(a.resets, 2)
+
+    def test_failed_cycles_count_towards_max_invocations(self):
+        a = FakeAccount('a', [RuntimeError('failed')] * 3, 3)
+
+        self.assertEqual(Daemon([a], workers=1).run(), 0)
+
+        self.assertEqual(a.results, [])
+        self.assertEqual(a.resets, 3)
+
+    def test_orders_accounts_by_next_cycle(self):
+        order = []
+        clock = [0]
+
+        class OrderedAccount(FakeAccount):
+            def run_cycle(self):
+                order.append((clock[0], self.name))
+                return super().run_cycle()
+
+        a = OrderedAccount('a', [(None, 0)] * 2, 2)
+        b = OrderedAccount('b', [(None, 0)] * 2, 2)
+
+        d = Daemon([], workers=1, clock=lambda: clock[0])
+        d.schedule(a, 10)
+        d.schedule(b, 5)
+        clock[0] = 20
+        d.run()
+
+        self.assertEqual([name for _, name in order][:2], ['b', 'a'])
+
+if __name__ == '__main__':
+    unittest.main()
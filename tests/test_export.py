@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import unittest
+import base64
+import datetime
+import os
+import tempfile
+
+import arrow
+
+from tconnectsync.eventparser.synthetic import SyntheticPump
+from tconnectsync.export import ExportTimeRange, export_events
+
+from .api.fake import TConnectApi
+from .secrets import build_secrets
+
+try:
+    import pyarrow.dataset
+except ImportError:
+    pyarrow = None
+
+TIMEZONE = 'America/New_York'
+
+
+class FakeTandemSourceApi:
+    def __init__(self, pump):
+        self.pump = pump
+        self.requests = []
+
+    def pump_events_raw(self, tconnect_device_id, min_date=None, max_date=None, event_ids_filter=None):
+        self.requests.append((min_date, max_date, event_ids_filter))
+        days = (max_date - self.pump.start.date()).days + 1
+        return base64.b64encode(b''.join(self.pump.events(days)))
+
+    def needs_relogin(self):
+        return False
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = self.dir.name
+        self.data = b''.join(SyntheticPump(start=datetime.datetime(2024, 1, 1)).events(3))
+
+    def read(self, name, fmt='parquet'):
+        return pyarrow.dataset.dataset(os.path.join(self.path, name), format=fmt, partitioning='hive').to_table()
+
+    def test_tables_by_event_type_and_day(self):
+        counts = export_events(self.data, self.path, TIMEZONE)
+        self.assertEqual(counts['LidBasalDelivery'], 3 * 288)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, 'LidBasalDelivery'))), ['date=2024-01-01', 'date=2024-01-02', 'date=2024-01-03'])
+
+        table = self.read('LidBolusCompleted').sort_by('seqNum')
+        self.assertEqual(table.num_rows, 9)
+        self.assertEqual(table['bolusid'].type, pyarrow.uint16())
+        self.assertEqual(table['completionstatus'].to_pylist()[0], 'Completed')
+        self.assertEqual(table['eventTimestamp'].type.tz, TIMEZONE)
+        self.assertEqual(
+            arrow.get(table['eventTimestamp'][0].as_py()),
+            arrow.get('2024-01-01T07:32:00-05:00'))
+
+    def test_arrow_format(self):
+        export_events(self.data, self.path, TIMEZONE, fmt='arrow')
+        self.assertEqual(self.read('LidCgmDataG7', fmt='ipc').num_rows, 3 * 288)
+
+    def test_date_range_and_rewrite(self):
+        export_events(self.data, self.path, TIMEZONE, min_date=datetime.date(2024, 1, 2), max_date=datetime.date(2024, 1, 2))
+        self.assertEqual(os.listdir(os.path.join(self.path, 'LidBasalDelivery')), ['date=2024-01-02'])
+
+        # Writing a day again replaces it
+        export_events(self.data, self.path, TIMEZONE)
+        self.assertEqual(self.read('LidBasalDelivery').num_rows, 3 * 288)
+
+    def test_export_time_range(self):
+        tconnect = TConnectApi()
+        tconnect._tandemsource = FakeTandemSourceApi(SyntheticPump(start=datetime.datetime(2024, 1, 1)))
+        export = ExportTimeRange(tconnect, {'tconnectDeviceId': '123'}, self.path, build_secrets(TIMEZONE_NAME=TIMEZONE), chunk_days=2)
+        counts = export.export(arrow.get('2024-01-01'), arrow.get('2024-01-03'))
+
+        self.assertEqual(tconnect._tandemsource.requests, [
+            (datetime.date(2024, 1, 1), datetime.date(2024, 1, 2), None),
+            (datetime.date(2024, 1, 3), datetime.date(2024, 1, 3), None),
+        ])
+        self.assertEqual(counts['LidBasalDelivery'], 3 * 288)
+        self.assertEqual(self.read('LidBasalDelivery').num_rows, 3 * 288)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            ExportTimeRange(TConnectApi(), {'tconnectDeviceId': '123'}, self.path, build_secrets(), fmt='csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import unittest
+import subprocess
+import sys
+import json
+
+import tconnectsync
+import tconnectsync.api
+
+# Modules which a sync needs, but which aren't needed to parse arguments
+HEAVY_MODULES = ['requests', 'bs4', 'jwt', 'requests_oidc', 'arrow', 'tconnectsync.api.tandemsource', 'tconnectsync.eventparser.events']
+
+
+def loaded_modules(code):
+    out = subprocess.check_output([sys.executable, '-c', code + '; import sys, json; print(json.dumps(sorted(sys.modules)))'])
+    return json.loads(out.decode().splitlines()[-1])
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_is_lazy(self):
+        modules = loaded_modules('import tconnectsync')
+        for m in HEAVY_MODULES:
+            self.assertNotIn(m, modules)
+        # Config reads secret.py, which must fail with a message rather than a traceback
+        self.assertNotIn('tconnectsync.config', modules)
+
+    def test_parse_args_is_lazy(self):
+        modules = loaded_modules('import tconnectsync; tconnectsync.parse_args(["--pretend"])')
+        for m in HEAVY_MODULES:
+            self.assertNotIn(m, modules)
+
+    def test_lazy_attributes(self):
+        from tconnectsync.api.tandemsource import TandemSourceApi
+        from tconnectsync.sync.tandemsource.process import ProcessTimeRange
+
+        self.assertIs(tconnectsync.TConnectApi, tconnectsync.api.TConnectApi)
+        self.assertIs(tconnectsync.TandemSourceProcessTimeRange, ProcessTimeRange)
+        self.assertIs(tconnectsync.api.TandemSourceApi, TandemSourceApi)
+        self.assertIs(tconnectsync.api.tandemsource.TandemSourceApi, TandemSourceApi)
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            tconnectsync.NotAThing
+        with self.assertRaises(AttributeError):
+            tconnectsync.api.NotAThing
+
+
+if __name__ == '__main__':
+    unittest.main()
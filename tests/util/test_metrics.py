@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import unittest
+import time
+import threading
+import urllib.error
+import urllib.request
+
+from tconnectsync.util import metrics
+from tconnectsync.util.metrics import Registry, Counter, Gauge, Histogram, serve
+from tconnectsync.sync.tandemsource.autoupdate import TandemSourceAutoupdate
+from tconnectsync.sync.tandemsource.process import count_decoded
+
+from ..secrets import build_secrets
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        r = Registry()
+        c = Counter('uploads_total', 'Uploads', ['collection'], registry=r)
+        c.inc('entries')
+        c.inc('treatments', amount=3)
+        c.inc('entries')
+
+        self.assertEqual(c.get('entries'), 2)
+        self.assertEqual(r.render(), '\n'.join([
+            '# HELP uploads_total Uploads',
+            '# TYPE uploads_total counter',
+            'uploads_total{collection="entries"} 2',
+            'uploads_total{collection="treatments"} 3',
+        ]) + '\n')
+
+    def test_labels_must_match(self):
+        c = Counter('uploads_total', 'Uploads', ['collection'], registry=Registry())
+        with self.assertRaises(ValueError):
+            c.inc()
+        with self.assertRaises(ValueError):
+            c.inc('entries', 'extra')
+
+    def test_label_escaping(self):
+        r = Registry()
+        Counter('c', 'C', ['name'], registry=r).inc('a"b\\c')
+        self.assertIn('c{name="a\\"b\\\\c"} 1', r.render())
+
+    def test_gauge(self):
+        r = Registry()
+        g = Gauge('last_seconds', 'Last', registry=r)
+        self.assertNotIn('\nlast_seconds ', r.render())
+        g.set(1.5)
+        self.assertIn('last_seconds 1.5\n', r.render())
+
+    def test_gauge_function(self):
+        r = Registry()
+        value = [None]
+        Gauge('since_seconds', 'Since', registry=r, function=lambda: value[0])
+        self.assertNotIn('\nsince_seconds ', r.render())
+        value[0] = 12
+        self.assertIn('since_seconds 12\n', r.render())
+
+    def test_histogram(self):
+        r = Registry()
+        h = Histogram('latency_seconds', 'Latency', ['upstream'], registry=r, buckets=(0.1, 1))
+        h.observe(0.05, 'nightscout')
+        h.observe(0.1, 'nightscout')
+        h.observe(5, 'nightscout')
+
+        self.assertEqual(h.count('nightscout'), 3)
+        self.assertEqual(r.render().splitlines()[2:], [
+            'latency_seconds_bucket{upstream="nightscout",le="0.1"} 2',
+            'latency_seconds_bucket{upstream="nightscout",le="1"} 2',
+            'latency_seconds_bucket{upstream="nightscout",le="+Inf"} 3',
+            'latency_seconds_count{upstream="nightscout"} 3',
+            'latency_seconds_sum{upstream="nightscout"} 5.15',
+        ])
+
+    def test_histogram_time(self):
+        h = Histogram('latency_seconds', 'Latency', ['upstream'], registry=Registry())
+
+        @h.time('tandemsource')
+        def work(x):
+            return x * 2
+
+        self.assertEqual(work(2), 4)
+        with self.assertRaises(ValueError):
+            with h.time('nightscout'):
+                raise ValueError()
+
+        self.assertEqual(h.count('tandemsource'), 1)
+        self.assertEqual(h.count('nightscout'), 1)
+
+    def test_gauge_function_with_labels(self):
+        r = Registry()
+        values = {}
+        g = Gauge('since_seconds', 'Since', ['account'], registry=r, function=lambda: values)
+        values[('a',)] = 12
+        values[('b',)] = 3
+        self.assertEqual(g.get('a'), 12)
+        self.assertIn('since_seconds{account="a"} 12\nsince_seconds{account="b"} 3\n', r.render())
+
+    def test_histogram_time_overlapping_calls(self):
+        h = Histogram('latency_seconds', 'Latency', ['upstream'], registry=Registry(), buckets=(0.15,))
+        started = threading.Event()
+
+        @h.time('nightscout')
+        def work(seconds):
+            started.set()
+            time.sleep(seconds)
+
+        slow = threading.Thread(target=work, args=(0.3,))
+        slow.start()
+        started.wait()
+        time.sleep(0.2)
+        work(0.05)
+        slow.join()
+
+        # One call under 0.15s and one over it, with the total of both
+        self.assertEqual(h.samples()[0][3], 1)
+        self.assertEqual(h.count('nightscout'), 2)
+        self.assertGreaterEqual(h.samples()[-1][3], 0.35)
+
+    def test_serve(self):
+        r = Registry()
+        Counter('logins_total', 'Logins', ['upstream'], registry=r).inc('tandemsource')
+        server = serve(0, registry=r)
+        try:
+            url = 'http://127.0.0.1:%d' % server.server_address[1]
+            with urllib.request.urlopen(url + '/metrics') as resp:
+                self.assertEqual(resp.headers['Content-Type'], metrics.CONTENT_TYPE)
+                self.assertIn('logins_total{upstream="tandemsource"} 1', resp.read().decode())
+
+            with self.assertRaises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(url + '/other')
+            self.assertEqual(e.exception.code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class Event:
+    pass
+
+class OtherEvent:
+    pass
+
+
+class TestRecordedMetrics(unittest.TestCase):
+    def test_count_decoded(self):
+        before = metrics.EVENTS_DECODED.get('Event'), metrics.EVENTS_DECODED.get('OtherEvent')
+        count_decoded([Event(), OtherEvent(), Event()])
+        self.assertEqual(metrics.EVENTS_DECODED.get('Event') - before[0], 2)
+        self.assertEqual(metrics.EVENTS_DECODED.get('OtherEvent') - before[1], 1)
+
+    def test_sleep_decision(self):
+        u = TandemSourceAutoupdate(build_secrets(), account='a')
+        before = metrics.SLEEP_DECISIONS.get('a', 'rolling', 'circuit_open'), metrics.SLEEP_SECONDS.count('a')
+
+        self.assertEqual(u.circuit_open(30), (None, 30))
+        self.assertEqual(metrics.SLEEP_DECISIONS.get('a', 'rolling', 'circuit_open') - before[0], 1)
+        self.assertEqual(metrics.SLEEP_SECONDS.count('a') - before[1], 1)
+        self.assertEqual(metrics.SLEEP_SECONDS.count('b'), 0)
+
+    def test_seconds_since_new_data_per_account(self):
+        metrics.LAST_NEW_DATA.set(time.time() - 60, 'a')
+        self.assertGreaterEqual(metrics.SECONDS_SINCE_NEW_DATA.get('a'), 60)
+        self.assertIsNone(metrics.SECONDS_SINCE_NEW_DATA.get('unknown'))
+
+
+if __name__ == '__main__':
+    unittest.main()
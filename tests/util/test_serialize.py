@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+
+from tconnectsync.util import serialize
+
+
+class TestSerialize(unittest.TestCase):
+    entries = [
+        {"type": "sgv", "sgv": 152, "date": 1635041834000, "dateString": "2021-10-23T22:17:14-0400", "device": "Pump (tconnectsync)", "pump_event_id": "1"},
+        {"eventType": "Temp Basal", "duration": 5.0, "absolute": 0.8, "carbs": None, "notes": "Ümlaut"},
+    ]
+
+    def test_dumps(self):
+        self.assertEqual(json.loads(serialize.dumps(self.entries)), self.entries)
+        self.assertIsInstance(serialize.dumps(self.entries[0]), bytes)
+
+    def test_stdlib_fallback(self):
+        # The same bytes as orjson, when it is installed
+        self.assertEqual(serialize._ENCODER.encode(self.entries).encode('utf-8'), serialize.dumps(self.entries))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import pstats
+import tempfile
+
+from tconnectsync.util.timing import Timings, NO_TIMINGS, Profiler, timed
+
+
+class Timed:
+    def __init__(self, timings):
+        self.timings = timings
+
+    @timed('work')
+    def work(self, x):
+        return x * 2
+
+
+class TestTimings(unittest.TestCase):
+    def test_accumulates_stages(self):
+        t = Timings()
+        with t.stage('login'):
+            pass
+        t.add('upload', 0.5)
+        t.add('upload', 0.25)
+
+        report = t.report()
+        self.assertEqual(list(report['stages'].keys()), ['login', 'upload'])
+        self.assertEqual(report['stages']['upload'], {'count': 2, 'seconds': 0.75})
+        self.assertEqual(report['stages']['login']['count'], 1)
+        self.assertRegex(t.summary(), r'^login=\d+\.\d{3}s upload=0\.750s/2$')
+
+    def test_stage_records_failures(self):
+        t = Timings()
+        with self.assertRaises(ValueError):
+            with t.stage('fails'):
+                raise ValueError()
+        self.assertEqual(t.report()['stages']['fails']['count'], 1)
+
+    def test_reset(self):
+        t = Timings()
+        t.add('upload', 1)
+        t.reset()
+        self.assertEqual(t.summary(), 'no stages timed')
+
+    def test_timed(self):
+        t = Timings()
+        self.assertEqual(Timed(t).work(2), 4)
+        self.assertEqual(t.report()['stages']['work']['count'], 1)
+        self.assertEqual(Timed(NO_TIMINGS).work(3), 6)
+        self.assertEqual(NO_TIMINGS.report()['stages'], {})
+
+    def test_emit_writes_report(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'report.json')
+            t = Timings(report_path=path)
+            t.add('upload', 0.5)
+
+            with self.assertLogs('tconnectsync.util.timing', level='INFO') as logs:
+                t.emit('Cycle')
+
+            self.assertEqual(logs.records[0].getMessage(), 'Cycle timings: upload=0.500s')
+            with open(path) as f:
+                self.assertEqual(json.load(f)['stages'], {'upload': {'count': 1, 'seconds': 0.5}})
+
+
+class TestProfiler(unittest.TestCase):
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'profile.prof')
+            with Profiler('cprofile', path):
+                sum(range(1000))
+
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_unknown_profiler(self):
+        with self.assertRaises(ValueError):
+            Profiler('gprof', 'out')
+
+if __name__ == '__main__':
+    unittest.main()